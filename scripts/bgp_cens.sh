@@ -21,10 +21,14 @@ echo -e "\xE2\x9C\x94 Country: $COUNTRY; Dataset: $DATASET"
 # 1. Calculate choke potential of each border AS of the country mainland
 echo -e "  \xe2\x86\xb3 [1/2] Choke Potential of border ASes of the mainland (choke_potential.py)."
 python -m source.simulation.bgp.choke_potential --country ${COUNTRY} --dataset ${DATASET}
+# All countries (utils.COUNTRIES) in one pass over the routing trees:
+# python -m source.simulation.bgp.choke_potential --countries --dataset ${DATASET}
 
 # 2. Calculate BGP results.
 echo -e "  \xe2\x86\xb3 [2/2] BGP results with various N (bgp_censorship_metric.py)."
 python -m source.simulation.bgp.bgp_censorship_metric --country ${COUNTRY} --dataset ${DATASET}
+# All countries (utils.COUNTRIES) in one pass over the routing trees:
+# python -m source.simulation.bgp.bgp_censorship_metric --countries --dataset ${DATASET}
 
 # Done!
 echo -e "  \xe2\x86\xb3 Finished!\n"
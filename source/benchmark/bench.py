@@ -0,0 +1,409 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from tabulate import tabulate
+
+from source.benchmark.topogen import (
+    generate_topology, save_topology, topology_files
+)
+from source.simulation.bgp.bgpsim import BGPSimulator, tiebreak_ranks
+from source.simulation.bgp.quicksand import bgp_simulate
+from source.simulation.scion.sciongen import get_isd_topos
+from source.simulation.scion.scionsim import nodes_within_foreign_reach
+from source.utils import load
+from source.utils import utils
+
+# Benchmark of the pipeline stages on synthetic topologies (see topogen.py).
+#
+# In-process stages are timed with their peak of Python allocations
+#   (tracemalloc); the scripts (python -m ...) run in a child process, timed
+#   with the peak RSS of the child (as reported by the child, see launch.py).
+#   Later stages use the outputs of the earlier ones, kept in the work dir of
+#   the topology.
+
+REPO_ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+STAGES = [
+    'load_AS_topology', 'bgp_simulate', 'bgpsim', 'routes', 'choke_potential',
+    'bgp_crp', 'vpn_crp', 'bgp_global_reach', 'vpn_global_reach',
+    'customer_cones', 'scion_core_topo', 'get_isd_topos',
+    'nodes_within_foreign_reach'
+]
+
+DATASET = 'CAIDA_HYBRID'
+N_CENSORS = [0, 1, 5, 10]
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--as_nums', nargs='+', type=int, default=[1000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--countries', nargs='+', default=['CH', 'DE', 'US'])
+    parser.add_argument(
+        '--destinations', type=int, default=50,
+        help='Number of (random) destinations timed by bgp_simulate/bgpsim.'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of worker processes of quicksand (routes).'
+    )
+    parser.add_argument(
+        '--trace_memory', action=argparse.BooleanOptionalAction,
+        help='Peak memory of in-process stages (tracemalloc slows them down).'
+    )
+    parser.set_defaults(trace_memory=True)
+    parser.add_argument('--work_dir', default='generated_data/benchmark')
+    parser.add_argument(
+        '--save_file',
+        default=f'generated_data/benchmark/bench.{utils.TODAY}.json'
+    )
+    parser.add_argument(
+        '--baseline', default=None,
+        help='Results of a previous run (JSON), to compare with.'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.1,
+        help='Relative slowdown (or memory increase) reported as regression.'
+    )
+
+    return parser.parse_args()
+
+# ==============================================================================
+# ============================  MEASUREMENTS  ==================================
+# ==============================================================================
+
+def _measure(func, items=1):
+    '''
+        Runs func() in this process.
+        Returns: result, record = {'time_s', 'items', 'peak_mb'}
+    '''
+    if trace_memory: tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    record = {'time_s': time.perf_counter() - start, 'items': items}
+    if trace_memory:
+        record['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, record
+
+def _measure_module(module, module_args, work_dir):
+    '''
+        Runs python -m module in a child process (in the work dir).
+        Returns: record = {'time_s', 'items', 'peak_mb'}, or {'error'}
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_ROOT] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+    )
+    # Inputs are parsed (not read from snapshots) in every run
+    env['CENS_SNAPSHOT_DIR'] = ''
+
+    module_name = module.split('.')[-1]
+    stderr_file = os.path.join(work_dir, f'{module_name}.err.txt')
+    peak_file = os.path.abspath(
+        os.path.join(work_dir, f'{module_name}.peak_rss.txt')
+    )
+    if os.path.isfile(peak_file): os.remove(peak_file)
+    with open(stderr_file, 'w') as stderr:
+        start = time.perf_counter()
+        exit_code = subprocess.call(
+            [sys.executable, '-m', 'source.benchmark.launch', peak_file,
+             module] + [str(a) for a in module_args],
+            cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        elapsed = time.perf_counter() - start
+
+    if exit_code != 0:
+        logging.warning(f'{module} failed ({exit_code}), see {stderr_file}')
+        return {'error': f'exit code {exit_code}'}
+    record = {'time_s': elapsed, 'items': 1}
+    if os.path.isfile(peak_file):
+        with open(peak_file) as f:
+            record['peak_mb'] = int(f.read()) / 1024
+    return record
+
+def _add_record(records, stage, record):
+    if 'items' in record and record['items'] > 1:
+        record['per_item_ms'] = 1000 * record['time_s'] / record['items']
+    records[stage] = record
+    logging.info(f'{stage}: {json.dumps(record)}')
+
+# ==============================================================================
+# ===============================  STAGES  =====================================
+# ==============================================================================
+
+def _prepare_inputs(as_num, size_dir):
+    topo_file, as_info_file = topology_files(
+        os.path.join(size_dir, 'synthetic'), as_num, seed
+    )
+    if not os.path.isfile(topo_file) or not os.path.isfile(as_info_file):
+        links, as_countries = generate_topology(as_num, seed=seed)
+        save_topology(links, as_countries, topo_file, as_info_file, seed=seed)
+
+    # VPN nodes: 1% of the ASes (at least 5)
+    vpn_nodes_file = os.path.join(size_dir, 'vpn_nodes.txt')
+    if not os.path.isfile(vpn_nodes_file):
+        as_topo = load.load_AS_topology(topo_file, snapshot=False)
+        rnd = random.Random(seed)
+        vpn_nodes = rnd.sample(as_topo.asns, min(len(as_topo), max(5, as_num // 100)))
+        with open(vpn_nodes_file, 'w') as f:
+            f.writelines(f'{asn}\n' for asn in vpn_nodes)
+    return topo_file, as_info_file, vpn_nodes_file
+
+def _bench_in_process(records, topo_file, as_info_file, size_dir):
+    as_topo, record = _measure(
+        lambda: load.load_AS_topology(topo_file, snapshot=False)
+    )
+    if 'load_AS_topology' in stages:
+        _add_record(records, 'load_AS_topology', record)
+
+    rnd = random.Random(seed)
+    dests = rnd.sample(as_topo.asns, min(destinations, len(as_topo)))
+    if 'bgp_simulate' in stages:
+        _, record = _measure(
+            lambda: [bgp_simulate(as_topo, dest) for dest in dests],
+            items=len(dests)
+        )
+        _add_record(records, 'bgp_simulate', record)
+    if 'bgpsim' in stages:
+        sim = BGPSimulator(as_topo, tiebreak_ranks(as_topo))
+        _, record = _measure(
+            lambda: [sim.simulate(as_topo.asn2id[dest]) for dest in dests],
+            items=len(dests)
+        )
+        _add_record(records, 'bgpsim', record)
+
+    # SCION (on the outputs of customer_cones and scion_core_topo)
+    if 'get_isd_topos' not in stages and \
+        'nodes_within_foreign_reach' not in stages: return
+    cone_file = os.path.join(size_dir, 'cones.txt')
+    core_file = os.path.join(size_dir, 'core_topo.txt')
+    if not os.path.isfile(cone_file) or not os.path.isfile(core_file):
+        logging.warning('No SCION core topology, skipping the ISD stages')
+        return
+    as_info = load.load_as_info(as_info_file, snapshot=False)
+    cones = load.load_customer_cone(cone_file, snapshot=False)
+    scion_core_topo = load.load_SCION_core_topo_no_rels(
+        core_file, snapshot=False
+    )
+
+    isd_topos, record = _measure(
+        lambda: {
+            country: get_isd_topos(
+                scion_core_topo, as_topo, cones, as_info, country
+            )
+            for country in countries
+        },
+        items=len(countries)
+    )
+    if 'get_isd_topos' in stages:
+        _add_record(records, 'get_isd_topos', record)
+
+    if 'nodes_within_foreign_reach' in stages:
+        _, record = _measure(
+            lambda: [
+                nodes_within_foreign_reach(
+                    scion_core_topo, *isd_topos[country], as_info, country
+                )
+                for country in countries
+            ],
+            items=len(countries)
+        )
+        _add_record(records, 'nodes_within_foreign_reach', record)
+
+def _bench_modules(
+    records, as_num, topo_file, as_info_file, vpn_nodes_file, size_dir
+):
+    routes = os.path.join(size_dir, 'routes', 'r')
+    choke_potentials = os.path.join(size_dir, 'choke_potentials', 't')
+    common_args = [
+        '--bgp_topo_file', topo_file, '--as_info_caida_hybrid', as_info_file,
+        '--dataset', DATASET
+    ]
+    routing_args = [
+        '--routing_file_root', routes, '--route_store', f'{routes}.routes'
+    ]
+    for sub_dir in [
+        'logs', 'routes', 'choke_potentials', 'crp', 'global_reach'
+    ]:
+        os.makedirs(os.path.join(size_dir, sub_dir), exist_ok=True)
+
+    # In the order of the pipeline
+    modules = [
+        ('routes', 'source.simulation.bgp.quicksand', [
+            '--bgp_topo_file', topo_file, '--save_file', routes,
+            '--route_store', '--no-resume', '--workers', workers
+        ]),
+        ('choke_potential', 'source.simulation.bgp.choke_potential',
+            common_args + routing_args + [
+                '--save_file', choke_potentials, '--countries', *countries
+            ]
+        ),
+        ('bgp_crp', 'source.simulation.bgp.bgp_censorship_metric',
+            common_args + routing_args + [
+                '--choke_potentials_file', choke_potentials,
+                '--save_file', os.path.join(size_dir, 'crp', 'bgp'),
+                '--countries', *countries, '--Ns', *N_CENSORS
+            ]
+        ),
+        ('bgp_global_reach', 'source.simulation.bgp.bgp_global_reach',
+            common_args + routing_args + [
+                '--save_file', os.path.join(size_dir, 'global_reach', 'bgp'),
+                '--hegemons', 'all'
+            ]
+        ),
+        ('vpn_global_reach', 'source.simulation.vpn.vpn_global_reach',
+            common_args + routing_args + [
+                '--save_file', os.path.join(size_dir, 'global_reach', 'vpn'),
+                '--hegemons', 'United-States',
+                '--vpn_nodes_file', vpn_nodes_file
+            ]
+        ),
+        ('customer_cones', 'source.simulation.scion.conesize', [
+            '--bgp_topo_file', topo_file,
+            '--save_file', os.path.join(size_dir, 'cones.txt')
+        ]),
+        ('scion_core_topo', 'source.simulation.scion.sciongen', [
+            '--bgp_topo_file', topo_file,
+            '--customer_cone_file', os.path.join(size_dir, 'cones.txt'),
+            '--save_file', os.path.join(size_dir, 'core_topo.txt'),
+            '-N', min(2000, max(10, as_num // 20))
+        ]),
+    ]
+    for stage, module, module_args in modules:
+        if stage in stages:
+            record = _measure_module(module, module_args, size_dir)
+            _add_record(records, stage, record)
+
+        # One run per country
+        if stage == 'bgp_crp' and 'vpn_crp' in stages:
+            vpn_records = [
+                _measure_module(
+                    'source.simulation.vpn.vpn_censorship_metric',
+                    common_args + routing_args + [
+                        '--choke_potentials_file', choke_potentials,
+                        '--save_file', os.path.join(size_dir, 'crp', 'vpn'),
+                        '-c', country, '--vpn_nodes_file', vpn_nodes_file,
+                        '--Ns', *N_CENSORS
+                    ],
+                    size_dir
+                )
+                for country in countries
+            ]
+            _add_record(records, 'vpn_crp', _merge_records(vpn_records))
+
+def _merge_records(records):
+    errors = [record['error'] for record in records if 'error' in record]
+    if errors: return {'error': errors[0]}
+    return {
+        'time_s': sum(record['time_s'] for record in records),
+        'items': len(records),
+        'peak_mb': max(record['peak_mb'] for record in records),
+    }
+
+def bench_topology(as_num):
+    '''
+        Returns: records[stage] = {'time_s', 'items', 'peak_mb', ...}
+    '''
+    size_dir = os.path.abspath(os.path.join(work_dir, f'{as_num}.s{seed}'))
+    os.makedirs(size_dir, exist_ok=True)
+    topo_file, as_info_file, vpn_nodes_file = _prepare_inputs(as_num, size_dir)
+
+    records = dict()
+    _bench_modules(
+        records, as_num, topo_file, as_info_file, vpn_nodes_file, size_dir
+    )
+    _bench_in_process(records, topo_file, as_info_file, size_dir)
+    return {stage: records[stage] for stage in STAGES if stage in records}
+
+# ==============================================================================
+# ==============================  BASELINES  ===================================
+# ==============================================================================
+
+def compare_with_baseline(results, baseline, tolerance):
+    '''
+        Prints the stages measured in both runs. A stage regressed if its time
+        (or peak memory) grew by more than the tolerance.
+        Returns: [(as_num, stage)] of the regressed stages
+    '''
+    rows, regressions = list(), list()
+    for as_num, records in results['results'].items():
+        base_records = baseline['results'].get(as_num, dict())
+        for stage, record in records.items():
+            base = base_records.get(stage)
+            if base is None or 'error' in base or 'error' in record: continue
+
+            speedup = base['time_s'] / max(record['time_s'], 1e-9)
+            regressed = record['time_s'] > (1 + tolerance) * base['time_s']
+            if 'peak_mb' in record and 'peak_mb' in base:
+                regressed |= record['peak_mb'] > (1 + tolerance) * base['peak_mb']
+            if regressed: regressions.append((as_num, stage))
+
+            rows.append([
+                as_num, stage, f'{base["time_s"]:.3f}',
+                f'{record["time_s"]:.3f}', f'{speedup:.2f}x',
+                f'{base.get("peak_mb", float("nan")):.1f}',
+                f'{record.get("peak_mb", float("nan")):.1f}',
+                '\033[91mREGRESSION\033[00m' if regressed else ''
+            ])
+
+    headers = [
+        'ASes', 'Stage', 'Base [s]', 'Now [s]', 'Speedup', 'Base [MB]',
+        'Now [MB]', ''
+    ]
+    print(tabulate(rows, headers=headers))
+    return regressions
+
+def _set_global_vars(args):
+    global seed, stages, countries, destinations, workers, trace_memory
+    seed = args.seed
+    stages = set(args.stages)
+    countries = args.countries
+    destinations = args.destinations
+    workers = args.workers
+    trace_memory = args.trace_memory
+
+    global work_dir
+    work_dir = args.work_dir
+
+if __name__ == '__main__':
+    args = _parse_args()
+    _set_global_vars(args)
+    utils.enable_logger('bench', log_dir='logs/benchmark')
+
+    results = {
+        'metadata': {
+            'date': utils.TODAY, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'seed': seed, 'countries': countries, 'workers': workers,
+            'trace_memory': trace_memory,
+        },
+        'results': dict(),
+    }
+    start = time.time()
+    for as_num in args.as_nums:
+        logging.info(f'Benchmark: {as_num} ASes')
+        results['results'][str(as_num)] = bench_topology(as_num)
+
+    os.makedirs(os.path.dirname(args.save_file) or '.', exist_ok=True)
+    with open(args.save_file, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Results saved: {args.save_file}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions: logging.warning(f'Regressions: {regressions}')
+    end = time.time()
+    utils.log_elapsed_time(end - start)
@@ -0,0 +1,33 @@
+import atexit
+import resource
+import runpy
+import sys
+
+# Launcher of the benchmarked scripts (see bench._measure_module):
+#       python -m source.benchmark.launch <peak_file> <module> [args...]
+#   runs python -m <module> [args...], and saves its own peak RSS (in KB) to
+#   the peak file at exit. The ru_maxrss of the child (os.wait4) is not used,
+#   as on Linux it includes the peak RSS of the parent (the benchmark).
+
+def peak_rss_kb():
+    '''
+        VmHWM of the process (reset by exec, unlike ru_maxrss), or ru_maxrss
+        if not on Linux.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'): return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _save_peak_rss(peak_file):
+    with open(peak_file, 'w') as f:
+        f.write(f'{peak_rss_kb()}\n')
+
+if __name__ == '__main__':
+    peak_file, module = sys.argv[1], sys.argv[2]
+    atexit.register(_save_peak_rss, peak_file)
+    sys.argv = sys.argv[2:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
@@ -0,0 +1,137 @@
+import argparse
+import os
+import random
+
+# Countries of the synthetic ASes: the studied ones, and a few others; the
+#   earlier ones get more ASes (Zipf-like weights)
+GEN_COUNTRIES = (
+    ['US', 'DE', 'GB', 'RU', 'BR', 'CN', 'FR', 'NL', 'IN', 'AU', 'IT', 'UA',
+     'CH', 'SG', 'ZA', 'IR'] +
+    ['CA', 'JP', 'PL', 'SE', 'ES', 'KR', 'AR', 'TR']
+)
+
+def generate_topology(
+    as_num, seed=0, tier1_num=None, peer_ratio=2.0, same_country_prob=0.85,
+    multi_country_prob=0.03
+):
+    '''
+        Seeded synthetic AS topology, with a provider->customer hierarchy and
+        power-law degrees:
+            - a clique of tier-1 ASes (peers of each other);
+            - each next AS gets 1-4 providers among the earlier ASes, chosen
+                by preferential attachment (proportional to 1 + customers),
+                hence there are no customer cycles;
+            - peer_ratio * as_num peer links, also between the preferentially
+                chosen ASes;
+            - an AS is in the country of its first (non tier-1) provider with
+                the probability same_country_prob, and in a second country
+                with the probability multi_country_prob.
+
+        Returns: links, as_countries
+            links = [(asn1, asn2, -1 (provider->customer) or 0 (peers))]
+            as_countries[ASN] = [country_1, ...]
+    '''
+    rnd = random.Random(seed)
+    if tier1_num is None: tier1_num = min(max(5, as_num // 5000), 20, as_num)
+
+    # ASNs are not in the order of the hierarchy
+    asns = [str(asn) for asn in rnd.sample(range(1, 20 * as_num + 1), as_num)]
+    country_weights = [1 / (rank + 1) for rank in range(len(GEN_COUNTRIES))]
+
+    def _random_country():
+        return rnd.choices(GEN_COUNTRIES, weights=country_weights)[0]
+
+    links, linked = list(), set()
+    def _link(idx1, idx2, rel):
+        pair = (min(idx1, idx2), max(idx1, idx2))
+        if idx1 == idx2 or pair in linked: return False
+        linked.add(pair)
+        links.append((asns[idx1], asns[idx2], rel))
+        return True
+
+    # Preferential attachment: each AS is in the list once, and once more for
+    #   each of its customers
+    attach = list()
+    countries = list()
+    for idx in range(tier1_num):
+        attach.append(idx)
+        countries.append(['US'] if idx == 0 else [_random_country()])
+        for peer in range(idx):
+            _link(peer, idx, 0)
+
+    for idx in range(tier1_num, as_num):
+        provider_num = rnd.choices([1, 2, 3, 4], weights=[55, 30, 10, 5])[0]
+        providers = list()
+        for _ in range(provider_num):
+            prov = rnd.choice(attach)
+            if _link(prov, idx, -1):
+                providers.append(prov)
+                attach.append(prov)
+        attach.append(idx)
+
+        first_prov = providers[0]
+        if first_prov >= tier1_num and rnd.random() < same_country_prob:
+            country = countries[first_prov][0]
+        else:
+            country = _random_country()
+        countries.append([country])
+        if rnd.random() < multi_country_prob:
+            other = _random_country()
+            if other != country: countries[idx].append(other)
+
+    for _ in range(int(peer_ratio * as_num)):
+        _link(rnd.choice(attach), rnd.choice(attach), 0)
+
+    as_countries = {asn: countries[idx] for idx, asn in enumerate(asns)}
+    return links, as_countries
+
+def save_topology(links, as_countries, topo_file, as_info_file, seed=0):
+    '''
+        Saves the topology in the CAIDA as-rel2 format, and the countries in
+        the format of the AS info files (see load.load_as_info).
+    '''
+    for file_name in [topo_file, as_info_file]:
+        os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+
+    with open(topo_file, 'w') as f:
+        f.write(f'# synthetic topology (topogen.py), seed: {seed}\n')
+        f.write('# <provider-as>|<customer-as>|-1|<source>\n')
+        f.write('# <peer-as>|<peer-as>|0|<source>\n')
+        for asn1, asn2, rel in links:
+            f.write(f'{asn1}|{asn2}|{rel}|synthetic\n')
+
+    with open(as_info_file, 'w') as f:
+        f.write('# ASN | country_1,...,country_N\n')
+        for asn, countries in as_countries.items():
+            f.write(f'{asn} | {",".join(countries)}\n')
+
+def topology_files(save_file_root, as_num, seed):
+    root = f'{save_file_root}.{as_num}.s{seed}'
+    return f'{root}.as-rel2.txt', f'{root}.as-info.txt'
+
+################################################################################
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--as_nums', nargs='+', type=int, default=[1000, 10000, 100000]
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--save_file', default='generated_data/benchmark/synthetic'
+    )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+
+    for as_num in args.as_nums:
+        topo_file, as_info_file = topology_files(
+            args.save_file, as_num, args.seed
+        )
+        links, as_countries = generate_topology(as_num, seed=args.seed)
+        save_topology(
+            links, as_countries, topo_file, as_info_file, seed=args.seed
+        )
+        print(f'{as_num} ASes, {len(links)} links: {topo_file}')
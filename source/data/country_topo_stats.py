@@ -5,7 +5,7 @@ import sys
 from pyvis.network import Network
 from tabulate import tabulate
 
-from source.simulation.bgp.countrynet import in_country, get_border_ases, get_mainland
+from source.simulation.bgp.countrynet import load_country_index
 from source.utils import load
 from source.utils.utils import country_name, COUNTRIES, check_make_save_file_dir
 
@@ -78,16 +78,14 @@ def _get_choke_potentials(args):
         sys.exit()
     return total_cnt_outflow, cpp
 
-def print_islands_info(as_topo, as_info):
+def print_islands_info(country_index):
 
     def _get_country_info(country):
-        country_asns = [
-            asn for asn in as_topo.keys()
-            if in_country(asn, country, as_info)
-        ]
-        mainland = get_mainland(as_topo, as_info, country)
-        border_ases = get_border_ases(as_topo, mainland)
-        return len(country_asns), len(mainland), len(border_ases)
+        return (
+            country_index.country_size(country),
+            len(country_index.mainland(country)),
+            len(country_index.border_ases(country))
+        )
 
 
     data = list()
@@ -118,7 +116,7 @@ def print_islands_info(as_topo, as_info):
     
     if not LATEX_PRINT: print(tabulate(data, headers=header))
 
-def visualize_country_network(args, as_topo, as_info, as_ext, org_ext):
+def visualize_country_network(args, as_topo, country_index, as_ext, org_ext):
     '''
         Visualized: Only ASes that have at least one customer/peer
 
@@ -134,7 +132,7 @@ def visualize_country_network(args, as_topo, as_info, as_ext, org_ext):
     def _choose_visualization_nodes(mainland):
         # Visualize only nodes that have customers or peers
         vis_nodes = set()
-        for node in get_border_ases(as_topo, mainland): #mainland:
+        for node in country_index.border_ases(args.country): #mainland:
             rels = as_topo[node]
             if len(rels['customers']) > 0 or len(rels['peers']) > 0:
                 vis_nodes.add(node)
@@ -199,12 +197,12 @@ def visualize_country_network(args, as_topo, as_info, as_ext, org_ext):
         return net
 
     # Get nodes to visualize
-    mainland = get_mainland(as_topo, as_info, args.country)
+    mainland = country_index.mainland(args.country)
     vis_nodes = _choose_visualization_nodes(mainland)
     if len(vis_nodes) > VIS_NODE_THRESHOLD:
         print(f'Too many nodes to visualize ({len(vis_nodes)}).')
         return
-    border_ases = set(get_border_ases(as_topo, mainland))
+    border_ases = set(country_index.border_ases(args.country))
 
     # Visualize nodes
     net = Network()
@@ -245,18 +243,27 @@ if __name__ == '__main__':
     # Data
     as_topo = load.load_AS_topology(args.bgp_topo_file)
     if args.dataset == 'CAIDA':
-        as_info = load.load_as_info(args.as_info_caida)
+        as_info_file = args.as_info_caida
+        as_info = load.load_as_info(as_info_file)
     if args.dataset == 'CYMRU':
-        as_info = load.load_as_info(args.as_info_cymru)
+        as_info_file = args.as_info_cymru
+        as_info = load.load_as_info(as_info_file)
     if args.dataset == 'RIPE':
-        as_info = load.load_RIPE_geo_countries(args.geo_address_file)
+        as_info_file = args.geo_address_file
+        as_info = load.load_RIPE_geo_countries(as_info_file)
     if args.dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
+    country_index = load_country_index(
+        as_topo, as_info, args.bgp_topo_file, as_info_file
+    )
 
     # Table info
     if args.info:
         print(f'Dataset: \033[32m{args.dataset}\033[00m')
-        print_islands_info(as_topo, as_info)
+        print_islands_info(country_index)
     if args.vis:
         org_ext, as_ext = load.load_ORG_AS_info(args.as_org_info_file)
-        visualize_country_network(args, as_topo, as_info, as_ext, org_ext)
+        visualize_country_network(
+            args, as_topo, country_index, as_ext, org_ext
+        )
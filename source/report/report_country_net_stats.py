@@ -2,8 +2,8 @@ import argparse
 
 from tabulate import tabulate
 
-from source.simulation.bgp.countrynet import get_border_ases, get_mainland
-from source.simulation.scion.sciongen import get_isd_topos
+from source.simulation.bgp.countrynet import load_country_index
+from source.simulation.scion.isdcache import ISDCache
 from source.utils import load
 from source.utils.utils import country_name, COUNTRIES
 
@@ -56,17 +56,33 @@ def _set_global_vars(args):
     as_topo = load.load_AS_topology(args.bgp_topo_file)
 
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
+
+    global country_index
+    country_index = load_country_index(
+        as_topo, as_info, args.bgp_topo_file, as_info_file
+    )
 
     global cones, scion_core_topo
     cones = load.load_customer_cone(args.customer_cone_file)
     scion_core_topo = load.load_SCION_core_topo_no_rels(args.SCION_core_topo)
 
+    global isd_cache
+    isd_cache = ISDCache(
+        scion_core_topo, as_topo, cones, as_info, dataset,
+        input_files=[
+            args.SCION_core_topo, args.bgp_topo_file, args.customer_cone_file,
+            as_info_file
+        ],
+        country_index=country_index
+    )
+
 def report_country_net_info(args):
 
     def _get_info_bgp(country):
-        mainland = get_mainland(as_topo, as_info, country)
-        border_ases = get_border_ases(as_topo, mainland)
+        mainland = country_index.mainland(country)
+        border_ases = country_index.border_ases(country)
 
         mainland_size = len(mainland)
         border_size_bgp = len(border_ases)
@@ -81,9 +97,7 @@ def report_country_net_info(args):
         return False
     
     def _get_info_scion(country, mainland_size):
-        isd_core_topo, _ = get_isd_topos(
-            scion_core_topo, as_topo, cones, as_info, country
-        )
+        isd_core_topo, _ = isd_cache.topos(country)
 
         border_ases = [
             core_asn for core_asn in isd_core_topo.keys()
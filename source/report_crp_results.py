@@ -1,16 +1,20 @@
 import argparse
 import json
 import math
+import multiprocessing
 import sys
 
 from collections import defaultdict
+from functools import partial
 from tabulate import tabulate
 
 
-from source.simulation.scion.conesize import get_customer_cone_size_core_ISD
-from source.simulation.scion.sciongen import get_isd_topos
+from source.simulation.bgp.countrynet import load_country_index
+from source.simulation.scion.isdcache import ISDCache
 from source.simulation.scion.scionsim import nodes_within_foreign_reach
+from source.simulation.scion.scionsim import nodes_within_foreign_reach_sweep
 from source.utils import load
+from source.utils import profiling
 from source.utils import utils
 
 LATEX_PRINT = False
@@ -78,7 +82,12 @@ def _parse_args():
         '--save_file',
         default='results/CRP.ALL.results/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes evaluating the countries.'
+    )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _set_global_vars(args):
@@ -89,12 +98,25 @@ def _set_global_vars(args):
     as_topo = load.load_AS_topology(args.bgp_topo_file)
 
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
 
     global cones, scion_core_topo
     cones = load.load_customer_cone(args.customer_cone_file)
     scion_core_topo = load.load_SCION_core_topo_no_rels(args.SCION_core_topo)
 
+    global isd_cache
+    isd_cache = ISDCache(
+        scion_core_topo, as_topo, cones, as_info, dataset,
+        input_files=[
+            args.SCION_core_topo, args.bgp_topo_file, args.customer_cone_file,
+            as_info_file
+        ],
+        country_index=load_country_index(
+            as_topo, as_info, args.bgp_topo_file, as_info_file
+        )
+    )
+
 def _latex_table_print(country, country_data, n_list=N_CENSORS):
     latex_p = f'{utils.country_name(country)} &'
 
@@ -114,28 +136,109 @@ def _bgp_vpn_load(country, bgp_results_file):
         sys.exit()
     return bgp_censors_by_num, bgp_tot, bgp_res
 
-def _select_biggest_cone_size_ISD(isd_core_topo, isd_non_core_topo, N):
+def _biggest_cone_size_ISD_cores(country):
+    '''
+        Cores with a foreign connection, by their customer cone size in the ISD
+            (the censors for N are the first N of them).
+    '''
+    isd_core_topo, _ = isd_cache.topos(country)
+    isd_cores_set = set(isd_core_topo.keys())
 
-    def _has_foreign_connection(core_asn, isd_core_topo):
-        isd_cores_set = set(isd_core_topo.keys())
+    def _has_foreign_connection(core_asn):
         for conn in scion_core_topo[core_asn]['cores']:
             if conn not in isd_cores_set:
                 return True
         return False
 
-    isd_cone = get_customer_cone_size_core_ISD(isd_core_topo, isd_non_core_topo)
+    isd_cone = isd_cache.cone_sizes(country)
     
-    biggest_cone_cores = set()
-    idx = 0
-    for core_asn in utils.sort_dict(isd_cone):
-        if not _has_foreign_connection(core_asn, isd_core_topo): continue
+    return [
+        core_asn for core_asn in utils.sort_dict(isd_cone)
+        if _has_foreign_connection(core_asn)
+    ]
+
+def _scion_reach_by_N(country):
+    '''
+        Returns: reach[N] = SCION reach with the N biggest cone cores as
+            censors, for all N at once.
+    '''
+    isd_core_topo, isd_non_core_topo = isd_cache.topos(country)
+    biggest_cone_cores = _biggest_cone_size_ISD_cores(country)
+    return nodes_within_foreign_reach_sweep(
+        scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
+        biggest_cone_cores
+    )
 
-        # Count only N border ASes
-        biggest_cone_cores.add(core_asn)
-        idx += 1
-        if idx >= N: break
+def _country_crp_values(
+    args, censor_N_list, perc, cone_size_scion, vpn_required, country
+):
+    '''
+        Returns: [(BGP, VPN, SCION) result for N in censor_N_list] of the
+            country, or None if its results are not available.
+    '''
+    # BGP results
+    try:
+        bgp_censors_by_num, tot_pot_censors, bgp_results = _bgp_vpn_load(
+            country, args.bgp_crp_results_file
+        )
+    except:
+        return None
+
+    # VPN results
+    try:
+        _, _, vpn_results = _bgp_vpn_load(
+            country,
+            f'{args.vpn_crp_results_dir}.{args.vpnmethod}/{DATA_DATE}'
+        )
+    except:
+        if vpn_required: return None
+        vpn_results = defaultdict(int)
+        vpn_results[0] = 1
 
-    return biggest_cone_cores
+    # SCION ISD results
+    isd_core_topo, isd_non_core_topo = isd_cache.topos(country)
+    scion_reach_by_N = _scion_reach_by_N(country)
+    scion_all_reach = scion_reach_by_N[0]
+
+    def get_values_for_N(N):
+        # SCION results
+        if not cone_size_scion:
+            scion_reach = len( nodes_within_foreign_reach(
+                scion_core_topo, isd_core_topo, isd_non_core_topo, as_info,
+                country, censors=bgp_censors_by_num[N]
+            ))
+        else:
+            # At least one censor (also for N = 0)
+            N_scion = min(max(N, 1), len(scion_reach_by_N) - 1)
+            scion_reach = scion_reach_by_N[N_scion]
+        
+        # Get resulting values
+        a = round( math.floor(100 * bgp_results[N] / bgp_results[0]) / 100, 2)
+        b = round( math.floor(100 * vpn_results[N] / vpn_results[0]) / 100, 2)
+        c = round( math.floor(100 * scion_reach / scion_all_reach) / 100, 2)
+
+        return a, b, c
+
+    values = list()
+    for N in censor_N_list:
+        if perc: N = math.ceil(N/100 * tot_pot_censors)
+        values.append(get_values_for_N(N))
+    return values
+
+def _map_countries(func, jobs=1):
+    '''
+        Returns: [func(country) for country in utils.COUNTRIES]
+
+        With more jobs, the countries are spread over a pool of worker
+            processes. The workers are forked, so the loaded data (global
+            variables) is inherited instead of being pickled; the results
+            still come in the order of the countries.
+    '''
+    if jobs <= 1: return [func(country) for country in utils.COUNTRIES]
+
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(jobs, len(utils.COUNTRIES))) as pool:
+        return pool.map(func, utils.COUNTRIES, chunksize=1)
 
 def report_crp_results(args, perc=False, cone_size_scion=True):
 
@@ -150,31 +253,13 @@ def report_crp_results(args, perc=False, cone_size_scion=True):
             headers.append(f'\nSCION')
         return headers
 
-    def get_values_for_N(N):
-        # SCION results
-        if not cone_size_scion: censors_on_scion = bgp_censors_by_num[N]
-        else: censors_on_scion = _select_biggest_cone_size_ISD(
-            isd_core_topo, isd_non_core_topo, N
-        )
-
-        scion_reach = len( nodes_within_foreign_reach(
-            scion_core_topo, isd_core_topo, isd_non_core_topo, as_info,
-            country, censors=censors_on_scion
-        ))
-        
-        # Get resulting values
-        a = round( math.floor(100 * bgp_results[N] / bgp_results[0]) / 100, 2)
-        b = round( math.floor(100 * vpn_results[N] / vpn_results[0]) / 100, 2)
-        c = round( math.floor(100 * scion_reach / scion_all_reach) / 100, 2)
-        values = [a, b, c]
-
-        # Compare values
+    def highlight_max(values):
+        values = list(values)
         max_idx = len(values) - 1 - values[::-1].index(max(values))
         if not LATEX_PRINT:
             values[max_idx] = f'\033[92m{values[max_idx]}\033[00m'
         else:
             values[max_idx] = '\\textbf{' + str(values[max_idx]) + '}'
-
         return values
 
     # Prepare data and headers
@@ -182,42 +267,19 @@ def report_crp_results(args, perc=False, cone_size_scion=True):
     headers = get_headers()
 
     # Populate the data
-    for country in utils.COUNTRIES:
-        # BGP / VPN results
-        try:
-            bgp_censors_by_num, tot_pot_censors, bgp_results = _bgp_vpn_load(
-                country, args.bgp_crp_results_file
-            )
-        except:
-            continue
-
-        # VPN
-        try:
-            _, _, vpn_results = _bgp_vpn_load(
-                country,
-                f'{args.vpn_crp_results_dir}.{args.vpnmethod}/{DATA_DATE}'
-            )
-        except:
-            vpn_results = defaultdict(int)
-            vpn_results[0] = 1
-
-        # SCION ISD
-        isd_core_topo, isd_non_core_topo = get_isd_topos(
-            scion_core_topo, as_topo, cones, as_info, country
-        )
-        scion_all_reach = len( nodes_within_foreign_reach(
-            scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
-            censors=set()
-        ))
+    results = _map_countries(
+        partial(
+            _country_crp_values, args, censor_N_list, perc, cone_size_scion,
+            False
+        ),
+        jobs=args.jobs
+    )
+    for country, country_values in zip(utils.COUNTRIES, results):
+        if country_values is None: continue
 
-        # Results
         country_data = [utils.country_name(country)]
-        for N in censor_N_list:
-            if perc: N = math.ceil(N/100 * tot_pot_censors)
-
-            values = get_values_for_N(N)
-            for res in values:
-                country_data.append(res)
+        for values in country_values:
+            country_data.extend(highlight_max(values))
             
         if LATEX_PRINT: _latex_table_print(country, country_data)
         data.append(country_data)
@@ -230,62 +292,22 @@ def get_crp_results(args, perc=False, cone_size_scion=True):
 
     censor_N_list = N_CENSORS_PERC if perc else N_CENSORS
 
-    def get_values_for_N(N):
-        # SCION results
-        if not cone_size_scion: censors_on_scion = bgp_censors_by_num[N]
-        else: censors_on_scion = _select_biggest_cone_size_ISD(
-            isd_core_topo, isd_non_core_topo, N
-        )
-
-        scion_reach = len( nodes_within_foreign_reach(
-            scion_core_topo, isd_core_topo, isd_non_core_topo, as_info,
-            country, censors=censors_on_scion
-        ))
-        
-        # Get resulting values
-        a = round( math.floor(100 * bgp_results[N] / bgp_results[0]) / 100, 2)
-        b = round( math.floor(100 * vpn_results[N] / vpn_results[0]) / 100, 2)
-        c = round( math.floor(100 * scion_reach / scion_all_reach) / 100, 2)
-
-        return a, b, c
-
     # Prepare data
     data = defaultdict(lambda: defaultdict(lambda: defaultdict()))
 
     # Populate the data
-    for country in utils.COUNTRIES:
-        # BGP results
-        try:
-            bgp_censors_by_num, tot_pot_censors, bgp_results = _bgp_vpn_load(
-                country, args.bgp_crp_results_file
-            )
-        except:
-            continue
-
-        # VPN results
-        try:
-            _, _, vpn_results = _bgp_vpn_load(
-                country,
-                f'{args.vpn_crp_results_dir}.{args.vpnmethod}/{DATA_DATE}'
-            )
-        except:
-            continue
-
-        # SCION ISD results
-        isd_core_topo, isd_non_core_topo = get_isd_topos(
-            scion_core_topo, as_topo, cones, as_info, country
-        )
-        scion_all_reach = len( nodes_within_foreign_reach(
-            scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
-            censors=set()
-        ))
-
-        # Results
-        for N in censor_N_list:
-            if perc: N_abs = math.ceil(N/100 * tot_pot_censors)
-            else: N_abs = N
+    results = _map_countries(
+        partial(
+            _country_crp_values, args, censor_N_list, perc, cone_size_scion,
+            True
+        ),
+        jobs=args.jobs
+    )
+    for country, country_values in zip(utils.COUNTRIES, results):
+        if country_values is None: continue
 
-            bgp_res, vpn_res, scion_res = get_values_for_N(N_abs)
+        for N, values in zip(censor_N_list, country_values):
+            bgp_res, vpn_res, scion_res = values
             data[country]['BGP'][N] = bgp_res
             data[country]['VPN'][N] = vpn_res
             data[country]['SCION'][N] = scion_res
@@ -295,6 +317,7 @@ def get_crp_results(args, perc=False, cone_size_scion=True):
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('report_crp_results', args)
     _set_global_vars(args)
 
     if args.report:
@@ -1,16 +1,19 @@
 import argparse
 import logging
 import math
-import os
 import random
 import sys
 import time
 
 from collections import defaultdict
+from itertools import accumulate
 
+from source.utils import profiling
 from source.utils import utils
 from source.utils import load
-from source.simulation.bgp.countrynet import get_mainland
+from source.utils import telemetry
+from source.utils.routetrees import RoutingTrees
+from source.simulation.bgp.countrynet import load_country_index
 
 def _parse_args():
     parser = argparse.ArgumentParser()
@@ -40,11 +43,20 @@ def _parse_args():
         '--choke_potentials_file',
         default='generated_data/chokepoint_border_mainland/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', default=None,
+        help='Route store file; if given, used instead of the routing files.'
+    )
     parser.add_argument(
         '--save_file',
         default='generated_data/CRP.BGP.add.results/20230101.as-rel2'
     )
     parser.add_argument('-c', '--country', default='CH')
+    parser.add_argument(
+        '--countries', nargs='*', default=None,
+        help='Countries to process in one pass over the routing trees; '
+        'all of utils.COUNTRIES if no country is given.'
+    )
     parser.add_argument(
         '--dataset', default='CAIDA_HYBRID', required=True,
         choices=['CAIDA_HYBRID']
@@ -52,9 +64,10 @@ def _parse_args():
 
     parser.add_argument('--Ns', nargs="+", type=int, required=True)
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
-def _get_potential_censors(choke_potentials_file):
+def _get_potential_censors(choke_potentials_file, country):
     cpp_f = f'{choke_potentials_file}.{country}.{dataset}.txt'
     c, _, cpp = load.load_choke_potentials(cpp_f)
     if c != country:
@@ -63,102 +76,136 @@ def _get_potential_censors(choke_potentials_file):
     sorted_cpp = utils.sort_dict(cpp)
     return list(sorted_cpp.keys())
 
-def _create_censors_by_num(choke_potentials_file):
-    global pot_censors_num
-
-    potential_censors = _get_potential_censors(choke_potentials_file)
-    pot_censors_num = len(potential_censors)
+def _create_censors_by_num(choke_potentials_file, country):
+    potential_censors = _get_potential_censors(choke_potentials_file, country)
+    pot_censors_num[country] = len(potential_censors)
+    censor_rank[country] = {
+        asn: rank for rank, asn in enumerate(potential_censors)
+    }
     censors_by_num = defaultdict(set)
 
     for N in N_CENSORS:
-        if N > pot_censors_num: continue
+        if N > pot_censors_num[country]: continue
 
-        censor_num = min(pot_censors_num, N)
+        censor_num = min(pot_censors_num[country], N)
         top_censors = potential_censors[:censor_num]
         censors_by_num[N] = set(top_censors)
+
+    # Not enough potential censors: no censors (listed only if there are
+    #   sources in the mainland)
+    if not mainlands[country]: return censors_by_num
+    for N in N_CENSORS:
+        if N > pot_censors_num[country]: censors_by_num[N] = set()
     
     return censors_by_num
 
 def _set_global_vars(args):
 
-    global country, dataset, as_topo, mainland
-    country = args.country
+    global countries, dataset, as_topo, mainlands
+    countries = [args.country]
+    if args.countries is not None:
+        countries = args.countries if args.countries else utils.COUNTRIES
     dataset = args.dataset
 
     as_topo = load.load_AS_topology(args.bgp_topo_file)
     
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
-    mainland = get_mainland(as_topo, as_info, country)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
+    country_index = load_country_index(
+        as_topo, as_info, args.bgp_topo_file, as_info_file
+    )
+    mainlands = {
+        country: country_index.mainland(country) for country in countries
+    }
 
+    # Destinations outside the mainland of at least one country
     global non_mainland
     non_mainland = [
-        asn for asn in as_topo.keys() if not asn in mainland
+        asn for asn in as_topo.keys()
+        if not all(asn in mainlands[country] for country in countries)
     ]
     random.shuffle(non_mainland)
 
-    global routing_file_root
-    routing_file_root = args.routing_file_root
-
-    global censors_by_num, N_CENSORS
+    global censors_by_num, pot_censors_num, censor_rank, N_CENSORS
     N_CENSORS = args.Ns
-    censors_by_num = _create_censors_by_num(args.choke_potentials_file)
-
-def _routing_topo_of_destination(destination):
-    destination_routing_file = f'{routing_file_root}.D_{destination}.txt'
-    if not os.path.isfile(destination_routing_file):
-        logging.warning(f'File not found: {destination_routing_file}')
-        sys.exit()
-    d, routing_topo = load.load_routing_topo(destination_routing_file)
-    if d != destination: 
-        logging.warning(
-            f'File {destination_routing_file} contains routing info for '
-            'destination {d}, although it should contain routing info for '
-            'destination {destination}.'
+    censors_by_num, pot_censors_num, censor_rank = dict(), dict(), dict()
+    for country in countries:
+        censors_by_num[country] = _create_censors_by_num(
+            args.choke_potentials_file, country
         )
-        sys.exit()
 
-    return routing_topo
+    global routing_trees
+    routing_trees = RoutingTrees(args.routing_file_root, args.route_store)
 
-def _is_censored(source, destination, routing_topo, censors):
-    curr_node = source
-    while curr_node != destination:
-        if curr_node in censors: return True
-        curr_node = routing_topo[curr_node]
-    return False
+def _routing_topo_of_destination(destination):
+    routing_topo = routing_trees.get(destination)
+    if routing_topo is None: sys.exit()
+    return routing_topo
 
-def _could_reach(source, destination, censors, dest_routing_topo):
-    if source in censors or destination in censors: return False
-    if len(censors) == 0: return source in dest_routing_topo.keys()
-    if source not in dest_routing_topo.keys(): return False
-    return not _is_censored(source, destination, dest_routing_topo, censors)
+def _first_censor_histogram(country, destination, dest_routing_topo):
+    '''
+        The censors for N are the top N potential censors, so a source reaches
+        the destination for all N up to the best (smallest) censor rank on its
+        path. Returns hist[rank] = number of sources with that best rank on
+        their path, where rank = pot_censors_num means no censor on the path.
+    '''
+    ranks = censor_rank[country]
+    no_censor = pot_censors_num[country]
+    first_rank = {destination: ranks.get(destination, no_censor)}
+    hist = [0] * (no_censor + 1)
+
+    for source in mainlands[country]:
+        if source not in dest_routing_topo.keys(): continue
+
+        path = list()
+        curr_node = source
+        while curr_node not in first_rank:
+            path.append(curr_node)
+            curr_node = dest_routing_topo[curr_node]
+        rank = first_rank[curr_node]
+        for node in reversed(path):
+            rank = min(rank, ranks.get(node, no_censor))
+            first_rank[node] = rank
+
+        hist[first_rank[source]] += 1
+    return hist
 
 def _get_bgp_results():
-    data = defaultdict(int)
+    '''
+        Returns: data[country][N] = total reach, for all countries at once
+            (each routing tree is read only once).
+    '''
+    data = {country: defaultdict(int) for country in countries}
 
-    utils.rst_log_counter(counter_max_value=len(non_mainland))
-    for destination in non_mainland:
-        utils.log_counter()
+    for destination in telemetry.track('destinations', non_mainland):
         dest_routing_topo = _routing_topo_of_destination(destination)
 
         if dest_routing_topo is None: continue
 
-        for source in mainland:
+        for country in countries:
+            if destination in mainlands[country]: continue
+
+            # reach[rank] = number of sources with no censor ranked below rank
+            hist = _first_censor_histogram(
+                country, destination, dest_routing_topo
+            )
+            reach = list(accumulate(reversed(hist)))[::-1]
+
             for N in N_CENSORS:
-                censors = censors_by_num[N]
-                reached = _could_reach(
-                    source, destination, censors, dest_routing_topo
-                )
-                if reached:
-                    data[N] += 1
+                # No censors for N = 0, or if there are not enough of them
+                if 0 < N <= pot_censors_num[country]: N_reach = reach[N]
+                else: N_reach = reach[0]
+                if N_reach:
+                    data[country][N] += N_reach
 
     return data
 
 def _calc_save_bgp_results(save_file, info_plus):
     data = _get_bgp_results()
 
-    # Save to a file
-    utils.check_make_save_file_dir(args.save_file)
+    # Save to files
+    utils.check_make_save_file_dir(save_file)
     INITIAL_INFO = ['# Country info', '#', '# Format:', '# <Country>']
     CENSORS_INFO = [
         '# Info about censors', '#', '# Format:',
@@ -169,35 +216,46 @@ def _calc_save_bgp_results(save_file, info_plus):
         '# Chokepoint potentials', '#', '# Format:',
         '# censor_num|total_reach_outflow_path'
     ]
-    file_name = f'{save_file}.{country}.{info_plus}.{dataset}.txt'
-    with open(file_name, 'w') as f:
-        # Info dump
-        f.writelines(line + '\n' for line in INITIAL_INFO)
-        f.writelines(f'{country}\n')
-        
-        # Save data about censors
-        f.writelines(line + '\n' for line in CENSORS_INFO)
-        f.writelines(f'{pot_censors_num}\n')
-        for N, cens in censors_by_num.items():
-            cens_str = ','.join(cens)
-            f.writelines(f'{N}|{cens_str}\n')
-
-        # Save data for all N
-        f.writelines(line + '\n' for line in BGP_METRIC_INFO)
-        for N, reach in data.items():
-            f.writelines(f'{N}|{reach}\n')
+    for country in countries:
+        file_name = f'{save_file}.{country}.{info_plus}.{dataset}.txt'
+        with open(file_name, 'w') as f:
+            # Info dump
+            f.writelines(line + '\n' for line in INITIAL_INFO)
+            f.writelines(f'{country}\n')
+            
+            # Save data about censors
+            f.writelines(line + '\n' for line in CENSORS_INFO)
+            f.writelines(f'{pot_censors_num[country]}\n')
+            for N, cens in censors_by_num[country].items():
+                cens_str = ','.join(cens)
+                f.writelines(f'{N}|{cens_str}\n')
+
+            # Save data for all N
+            f.writelines(line + '\n' for line in BGP_METRIC_INFO)
+            for N, reach in data[country].items():
+                f.writelines(f'{N}|{reach}\n')
+
+    telemetry.write_summary(
+        f'{save_file}.{"_".join(countries)}.{info_plus}.{dataset}'
+    )
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('bgp_censorship_metric', args)
     _set_global_vars(args)
 
     info_plus = '_'.join([str(n) for n in N_CENSORS])
 
     utils.enable_logger(
-        f'CRP.BGP.results.{country}.{info_plus}', log_dir=f'logs/CRP.BGP.add.{dataset}'
+        f'CRP.BGP.results.{"_".join(countries)}.{info_plus}', log_dir=f'logs/CRP.BGP.add.{dataset}'
+    )
+    telemetry.enable_telemetry(
+        f'CRP.BGP.results.{"_".join(countries)}.{info_plus}',
+        log_dir=f'logs/CRP.BGP.add.{dataset}'
     )
 
     start = time.time()   
     _calc_save_bgp_results(args.save_file, info_plus)
+    routing_trees.log_stats()
     end = time.time()
     utils.log_elapsed_time(end-start)
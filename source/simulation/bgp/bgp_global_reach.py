@@ -1,11 +1,14 @@
 import argparse
-import logging
-import os
 import random
 import time
 
+from collections import Counter
+
+from source.utils import profiling
 from source.utils import utils
 from source.utils import load
+from source.utils import telemetry
+from source.utils.routetrees import RoutingTrees
 
 def _parse_args():
     parser = argparse.ArgumentParser()
@@ -29,16 +32,24 @@ def _parse_args():
         '--routing_file_root',
         default='generated_data/bgp_routes/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', default=None,
+        help='Route store file; if given, used instead of the routing files.'
+    )
     parser.add_argument(
         '--save_file',
         default='generated_data/BGP.global.reach.results/20230101.as-rel2'
     )
-    parser.add_argument('--hegemons', default='United States')
+    parser.add_argument(
+        '--hegemons', default='United States',
+        help='Hegemon group (see utils.HEG_GROUPS), or "all" for all groups.'
+    )
     parser.add_argument(
         '--dataset', default='CAIDA_HYBRID', required=True,
         choices=['CAIDA_HYBRID']
     )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _set_global_vars(args):
@@ -53,24 +64,31 @@ def _set_global_vars(args):
         for asn, list_countries in as_info.items():
             if len(list_countries) > 1: as_info[asn] = list(['-'])
 
+    global routing_trees
+    routing_trees = RoutingTrees(args.routing_file_root, args.route_store)
+
 def _country_origin(asn):
     return as_info[asn][0]
 
-def _routing_topo_of_destination(destination, routing_file_root):
-    destination_routing_file = f'{routing_file_root}.D_{destination}.txt'
-    if not os.path.isfile(destination_routing_file):
-        logging.warning(f'File not found: {destination_routing_file}')
-        return None
-    d, routing_topo = load.load_routing_topo(destination_routing_file)
-    if d != destination: 
-        logging.warning(
-            f'File {destination_routing_file} contains routing info for '
-            'destination {d}, although it should contain routing info for '
-            'destination {destination}.'
-        )
-        return None
+def _hegemon_mask_of(group_names):
+    '''
+        Returns a function: mask(asn) has the i-th bit set if the country of
+        the AS is in the i-th hegemon group.
+    '''
+    country_mask = dict()
+    for bit, group_name in enumerate(group_names):
+        for c in utils.HEG_GROUPS[group_name]:
+            country_mask[c] = country_mask.get(c, 0) | (1 << bit)
 
-    return routing_topo
+    as_mask = dict()
+    def _mask(asn):
+        if asn not in as_mask:
+            as_mask[asn] = country_mask.get(_country_origin(asn), 0)
+        return as_mask[asn]
+    return _mask
+
+def _routing_topo_of_destination(destination):
+    return routing_trees.get(destination)
 
 def _is_intercepted(source, destination, routing_topo, hegemons):
     curr_node = source
@@ -85,7 +103,7 @@ def _could_reach(source, destination, hegemons, dest_routing_topo):
     if source not in dest_routing_topo.keys(): return False
     return not _is_intercepted(source, destination, dest_routing_topo, hegemons)
 
-def _reachability_by_dest(hegemons, destination, routing_file_root):
+def _reachability_by_dest(hegemons, destination):
 
     def _not_intercepted(routing_topo):
         not_intercepted = 0
@@ -103,44 +121,121 @@ def _reachability_by_dest(hegemons, destination, routing_file_root):
     if _country_origin(destination) in hegemons: return 0, 0
     
     # Routing topo
-    routing_topo = _routing_topo_of_destination(destination, routing_file_root) 
+    routing_topo = _routing_topo_of_destination(destination)
     if routing_topo is None: return 0, 0
 
     # Updates
     paths_to_dest, not_intercepted_to_dest = _not_intercepted(routing_topo)
     return paths_to_dest, not_intercepted_to_dest
 
-def _global_reach_potentials(hegemons, routing_file_root):
+def _global_reach_potentials(hegemons):
     total_path_cnt = 0
     total_not_intercepted = 0
 
     all_asns = list(as_topo.keys())
     random.shuffle(all_asns)
 
-    utils.rst_log_counter(counter_max_value=len(as_topo))
-    for destination in all_asns:
-        utils.log_counter()
-
+    for destination in telemetry.track('destinations', all_asns):
         paths_to_dest, not_intercepted_to_dest = _reachability_by_dest(
-            hegemons, destination, routing_file_root
+            hegemons, destination
         )
         total_path_cnt += paths_to_dest
         total_not_intercepted += not_intercepted_to_dest
 
     return total_path_cnt, total_not_intercepted
 
-def _calc_save_global_reach_potentials(rfr, hegemon_group_name, save_file):
+def _path_masks_by_dest(mask, destination, routing_topo):
+    '''
+        Counts the paths to the destination by (mask of the source, OR of the
+        masks of all ASes on the path except the destination). The masks on
+        the paths are computed once per AS, top-down from the destination.
+    '''
+    path_mask = {destination: 0}
+    path_masks = Counter()
+
+    for source in routing_topo.keys():
+        if source == destination: continue
+
+        path = list()
+        curr_node = source
+        while curr_node not in path_mask:
+            path.append(curr_node)
+            curr_node = routing_topo[curr_node]
+        curr_mask = path_mask[curr_node]
+        for node in reversed(path):
+            curr_mask |= mask(node)
+            path_mask[node] = curr_mask
+
+        path_masks[(mask(source), path_mask[source])] += 1
+    return path_masks
+
+def _global_reach_potentials_all(group_names):
+    '''
+        Same as _global_reach_potentials, for all hegemon groups at once.
+        Returns: {group_name: (total_path_cnt, total_not_intercepted)}
+    '''
+    mask = _hegemon_mask_of(group_names)
+    all_groups = (1 << len(group_names)) - 1
+    total_path_cnt = [0] * len(group_names)
+    total_not_intercepted = [0] * len(group_names)
+
+    all_asns = list(as_topo.keys())
+    random.shuffle(all_asns)
+
+    for destination in telemetry.track('destinations', all_asns):
+        # Destination shouldn't be one of hegemons
+        dest_mask = mask(destination)
+        if dest_mask == all_groups: continue
+
+        routing_topo = _routing_topo_of_destination(destination)
+        if routing_topo is None: continue
+
+        path_masks = _path_masks_by_dest(mask, destination, routing_topo)
+        for bit in range(len(group_names)):
+            group = 1 << bit
+            if dest_mask & group: continue
+            for (source_mask, path_mask), cnt in path_masks.items():
+                if source_mask & group: continue
+                total_path_cnt[bit] += cnt
+                if not path_mask & group:
+                    total_not_intercepted[bit] += cnt
+
+    return {
+        group_name: (total_path_cnt[bit], total_not_intercepted[bit])
+        for bit, group_name in enumerate(group_names)
+    }
+
+def _calc_save_global_reach_potentials(hegemon_group_name, save_file):
+    if hegemon_group_name == 'all':
+        group_names = list(utils.HEG_GROUPS.keys())
+        results = _global_reach_potentials_all(group_names)
+        for group_name in group_names:
+            _save_global_reach_potentials(
+                group_name, set(utils.HEG_GROUPS[group_name]),
+                *results[group_name], save_file
+            )
+        telemetry.write_summary(f'{save_file}.all.{dataset}')
+        return
+
     hegs = set(utils.HEG_GROUPS[hegemon_group_name])
-    total_paths, free_paths = _global_reach_potentials(hegs, rfr)
+    total_paths, free_paths = _global_reach_potentials(hegs)
+    _save_global_reach_potentials(
+        hegemon_group_name, hegs, total_paths, free_paths, save_file
+    )
+    telemetry.write_summary(
+        f'{save_file}.{hegemon_group_name.replace(" ", "-")}.{dataset}'
+    )
 
-    # Save to a file
-    utils.check_make_save_file_dir(args.save_file)
+def _save_global_reach_potentials(
+    hegemon_group_name, hegs, total_paths, free_paths, save_file
+):
+    utils.check_make_save_file_dir(save_file)
     INITIAL_INFO = [
         '# Global reachability', '#','# Format:',
         '# hegemon_group_name|country_1, ..., country_N',
         '# hegemon_group_name|total_path_cnt|not_intercepted_cnt'
     ]
-    file_name = f'{save_file}.{args.hegemons.replace(" ", "-")}.{dataset}.txt'
+    file_name = f'{save_file}.{hegemon_group_name.replace(" ", "-")}.{dataset}.txt'
     with open(file_name, 'w') as f:
         f.writelines(line + '\n' for line in INITIAL_INFO)
         f.writelines(f'{hegemon_group_name}|{",".join(hegs)}\n')
@@ -148,15 +243,19 @@ def _calc_save_global_reach_potentials(rfr, hegemon_group_name, save_file):
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('bgp_global_reach', args)
     _set_global_vars(args)
     utils.enable_logger(
         f'global.reachability.{args.hegemons.replace(" ", "-")}',
         log_dir=f'logs/BGP.global.reach.{dataset}'
     )
+    telemetry.enable_telemetry(
+        f'global.reachability.{args.hegemons.replace(" ", "-")}',
+        log_dir=f'logs/BGP.global.reach.{dataset}'
+    )
 
     start = time.time()   
-    _calc_save_global_reach_potentials(
-        args.routing_file_root, args.hegemons, args.save_file
-    )
+    _calc_save_global_reach_potentials(args.hegemons, args.save_file)
+    routing_trees.log_stats()
     end = time.time()
     utils.log_elapsed_time(end - start)
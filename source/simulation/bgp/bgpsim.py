@@ -0,0 +1,254 @@
+from array import array
+from collections import deque
+from hashlib import sha256
+
+from source.utils import load
+from source.utils import profiling
+
+# Route (hop) types; NONE means no route so far
+NONE, ORIGIN, CUSTOMER, PEER, PROVIDER = 0, 1, 2, 3, 4
+
+NO_ROUTE = -1
+
+class BGPSimulator:
+    '''
+        Array-based version of quicksand.bgp_simulate, over an ASGraph.
+
+        The three stages (customer, peer, provider routes) and the tie-break
+        are the same, but the simulation state is kept in arrays that are
+        allocated once and reset after each destination (only the entries of
+        the ASes that were reached). Instead of keeping all candidate routes,
+        an AS keeps its first candidate's type and length (which decide
+        whether further candidates are accepted) and the best next hop so far,
+        chosen by the precomputed tie-break ranks (see tiebreak_ranks).
+    '''
+
+    def __init__(self, as_topo, ranks=None):
+        self.as_topo = as_topo
+        self.ranks = ranks if ranks is not None else tiebreak_ranks(as_topo)
+        asn_num = len(as_topo)
+
+        self.visited = bytearray(asn_num)
+        self.hop_type = bytearray(asn_num)
+        self.path_len = array('i', bytes(4 * asn_num))
+        self.next_hop = array('i', [NO_ROUTE]) * asn_num
+        self.best_rank = array('i', bytes(4 * asn_num))
+
+        self._routing_tree = list()
+
+    def _reset(self):
+        visited, hop_type = self.visited, self.hop_type
+        path_len, next_hop = self.path_len, self.next_hop
+        for asn in self._routing_tree:
+            visited[asn] = 0
+            hop_type[asn] = NONE
+            path_len[asn] = 0
+            next_hop[asn] = NO_ROUTE
+        self._routing_tree = list()
+
+    def _add_candidate(self, asn, next_hop, hop_type, path_len, rank):
+        if self.hop_type[asn] == NONE:
+            self.hop_type[asn] = hop_type
+            self.path_len[asn] = path_len
+            self.next_hop[asn] = next_hop
+            self.best_rank[asn] = rank
+            return
+
+        # (TB) heuristic: hash function, via its rank
+        if rank < self.best_rank[asn]:
+            self.next_hop[asn] = next_hop
+            self.best_rank[asn] = rank
+
+    def _stage_1(self, destination):
+        visited, hop_type, path_len = self.visited, self.hop_type, self.path_len
+        off = self.as_topo.offsets['providers']
+        nbr = self.as_topo.nbrs['providers']
+        ranks = self.ranks['providers']
+        routing_tree = self._routing_tree
+
+        q = deque()
+        q.append(destination)
+        visited[destination] = 1
+        hop_type[destination] = ORIGIN
+        routing_tree.append(destination)
+
+        while q:
+            curr = q.popleft()
+            next_len = path_len[curr] + 1
+            for pos in range(off[curr], off[curr + 1]):
+                provider = nbr[pos]
+                if not visited[provider]:
+                    q.append(provider)
+                    routing_tree.append(provider)
+                    visited[provider] = 1
+
+                # If the only possible path so far was via a _customer_ at the
+                #   _same distance_, then this customer is also a viable option.
+                if hop_type[provider] == NONE or path_len[provider] == next_len:
+                    self._add_candidate(
+                        provider, curr, CUSTOMER, next_len, ranks[pos]
+                    )
+
+    def _stage_2(self):
+        visited, hop_type, path_len = self.visited, self.hop_type, self.path_len
+        off = self.as_topo.offsets['peers']
+        nbr = self.as_topo.nbrs['peers']
+        ranks = self.ranks['peers']
+        routing_tree = self._routing_tree
+
+        for curr in routing_tree[:]:
+            next_len = path_len[curr] + 1
+            for pos in range(off[curr], off[curr + 1]):
+                peer = nbr[pos]
+                if not visited[peer]:
+                    routing_tree.append(peer)
+                    visited[peer] = 1
+
+                # If the only possible path so far was via a _peer_ at the
+                #   _same distance_, then this peer is also a viable option.
+                if hop_type[peer] == NONE or (
+                    hop_type[peer] == PEER and path_len[peer] == next_len
+                ):
+                    self._add_candidate(
+                        peer, curr, PEER, next_len, ranks[pos]
+                    )
+
+    def _stage_3(self):
+        visited, hop_type, path_len = self.visited, self.hop_type, self.path_len
+        off = self.as_topo.offsets['customers']
+        nbr = self.as_topo.nbrs['customers']
+        ranks = self.ranks['customers']
+        routing_tree = self._routing_tree
+
+        q = deque(routing_tree)
+        while q:
+            curr = q.popleft()
+            next_len = path_len[curr] + 1
+            for pos in range(off[curr], off[curr + 1]):
+                customer = nbr[pos]
+                if not visited[customer]:
+                    q.append(customer)
+                    routing_tree.append(customer)
+                    visited[customer] = 1
+
+                # If the only possible path so far was via a _provider_ at the
+                #   _same distance_, then this provider is also a viable option.
+                if hop_type[customer] == NONE or (
+                    hop_type[customer] == PROVIDER and
+                    path_len[customer] == next_len
+                ):
+                    self._add_candidate(
+                        customer, curr, PROVIDER, next_len, ranks[pos]
+                    )
+
+    def simulate(self, destination):
+        '''
+            Simulates routes towards the destination (an AS id).
+
+            Returns an int32 array (valid until the next call):
+                next_hop[asn_id] = <next_hop_asn_id> (-1: no route)
+        '''
+        self._reset()
+        self._stage_1(destination)
+        self._stage_2()
+        self._stage_3()
+        return self.next_hop
+
+    def routing_topo(self, destination):
+        '''
+            Same result as quicksand.bgp_simulate:
+                routing_topo[asn] = <next_hop_asn>
+        '''
+        dest_id = self.as_topo.asn2id[destination]
+        next_hops = self.simulate(dest_id)
+        return next_hops_to_routing_topo(self.as_topo.asns, next_hops, dest_id)
+
+def next_hops_to_routing_topo(asns, next_hops, dest_id):
+    routing_topo = dict()
+    for asn_id, next_hop in enumerate(next_hops):
+        if asn_id == dest_id: routing_topo[asns[asn_id]] = None
+        elif next_hop != NO_ROUTE: routing_topo[asns[asn_id]] = asns[next_hop]
+    return routing_topo
+
+def tiebreak_key(asn, next_hop):
+    '''
+        (TB) an AS prefers the next hop with the smallest key.
+    '''
+    return sha256((asn + next_hop).encode('utf-8')).hexdigest()
+
+@profiling.stage
+def tiebreak_ranks(as_topo):
+    '''
+        Tie-break (TB) between equally good routes: an AS prefers the next hop
+        with the smallest sha256(ASN + next_hop_ASN).hexdigest(). The hashes
+        are computed once per link, and turned into ranks among the neighbours
+        of each AS.
+
+        Returns, aligned with the neighbour arrays of the topology:
+            ranks[rel][pos] = rank of curr among the neighbours of conn,
+                for the CSR entry pos: curr --(rel)--> conn
+    '''
+    asns = as_topo.asns
+    asn_num = len(asns)
+
+    # Entry sources, and the entries grouped by their target (conn)
+    sources, by_target, ranks = dict(), dict(), dict()
+    for rel in as_topo.rels:
+        off, nbr = as_topo.offsets[rel], as_topo.nbrs[rel]
+        src = array('i', bytes(4 * len(nbr)))
+        for curr in range(asn_num):
+            for pos in range(off[curr], off[curr + 1]):
+                src[pos] = curr
+        sources[rel] = src
+        by_target[rel] = _group_by_target(nbr, asn_num)
+        ranks[rel] = array('i', bytes(4 * len(nbr)))
+
+    for conn in range(asn_num):
+        entries = [
+            (rel, pos) for rel in as_topo.rels
+            for pos in _group(by_target[rel], conn)
+        ]
+        currs = set(sources[rel][pos] for rel, pos in entries)
+        by_hash = sorted(
+            currs, key=lambda curr: tiebreak_key(asns[conn], asns[curr])
+        )
+        rank = {curr: idx for idx, curr in enumerate(by_hash)}
+        for rel, pos in entries:
+            ranks[rel][pos] = rank[sources[rel][pos]]
+    return ranks
+
+def _group_by_target(nbr, asn_num):
+    # CSR of entry positions, by the neighbour they point to
+    off = array('i', bytes(4 * (asn_num + 1)))
+    for conn in nbr:
+        off[conn + 1] += 1
+    for idx in range(asn_num):
+        off[idx + 1] += off[idx]
+
+    fill = array('i', off)
+    positions = array('i', bytes(4 * len(nbr)))
+    for pos, conn in enumerate(nbr):
+        positions[fill[conn]] = pos
+        fill[conn] += 1
+    return off, positions
+
+def _group(grouped, idx):
+    off, positions = grouped
+    return positions[off[idx]:off[idx + 1]]
+
+def load_tiebreak_ranks(topology_file, as_topo):
+    '''
+        Tie-break ranks of the topology loaded from the file, kept as a
+        snapshot next to the topology snapshot (see load.SNAPSHOT_DIR).
+    '''
+    if not load.SNAPSHOT_DIR: return tiebreak_ranks(as_topo)
+
+    path = load.snapshot_path(topology_file, 'tiebreak')
+    digest = load.file_digest(topology_file)
+    snap = load.open_snapshot(path, digest)
+    if snap is not None:
+        return {rel: snap.array(rel) for rel in as_topo.rels}
+
+    ranks = tiebreak_ranks(as_topo)
+    load.save_snapshot(path, digest, arrays=ranks)
+    return ranks
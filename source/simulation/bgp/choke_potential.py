@@ -1,13 +1,14 @@
 import argparse
-import logging
-import os
 import time
 
 from collections import defaultdict
 
+from source.utils import profiling
 from source.utils import utils
 from source.utils import load
-from source.simulation.bgp.countrynet import get_border_ases, get_mainland
+from source.utils import telemetry
+from source.utils.routetrees import RoutingTrees
+from source.simulation.bgp.countrynet import load_country_index
 
 def _parse_args():
     parser = argparse.ArgumentParser()
@@ -33,33 +34,54 @@ def _parse_args():
         '--routing_file_root',
         default='generated_data/bgp_routes/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', default=None,
+        help='Route store file; if given, used instead of the routing files.'
+    )
     parser.add_argument(
         '--save_file',
         default='generated_data/chokepoint_border_mainland_NO_CLEAN/20230101.as-rel2'
     )
     parser.add_argument('-c', '--country')
+    parser.add_argument(
+        '--countries', nargs='*', default=None,
+        help='Countries to process in one pass over the routing trees; '
+        'all of utils.COUNTRIES if no country is given.'
+    )
     parser.add_argument(
         '--dataset', default='CAIDA_HYBRID', required=True,
         choices=['CAIDA_HYBRID']
     )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _set_global_vars(args):
 
-    global country, dataset, as_topo, mainland
-    country = args.country
+    global countries, dataset, as_topo, mainlands, border_ases
+    countries = [args.country]
+    if args.countries is not None:
+        countries = args.countries if args.countries else utils.COUNTRIES
     dataset = args.dataset
 
     as_topo = load.load_AS_topology(args.bgp_topo_file)
 
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
     
-    mainland = get_mainland(as_topo, as_info, country)
+    country_index = load_country_index(
+        as_topo, as_info, args.bgp_topo_file, as_info_file
+    )
+    mainlands = {
+        country: country_index.mainland(country) for country in countries
+    }
+    border_ases = {
+        country: country_index.border_ases(country) for country in countries
+    }
 
-def _is_in_mainland(asn):
-    return asn in mainland
+    global routing_trees
+    routing_trees = RoutingTrees(args.routing_file_root, args.route_store)
 
 def _get_reverse_routing_topo(routing_topo, destination):
     reverse_topo = defaultdict(list)
@@ -71,101 +93,82 @@ def _get_reverse_routing_topo(routing_topo, destination):
     
     return reverse_topo
 
-def _routing_topo_of_destination(destination, routing_file_root):
-    # Is the destination at the right side of the border?
-    if _is_in_mainland(destination):
-        return None
-
-    # Does this file exist, and contain right information?
-    destination_routing_file = f'{routing_file_root}.D_{destination}.txt'
-    if not os.path.isfile(destination_routing_file):
-        logging.warning(f'File not found: {destination_routing_file}')
-        return None
-    d, routing_topo = load.load_routing_topo(destination_routing_file)
-    if d != destination: 
-        logging.warning(
-            f'File {destination_routing_file} contains routing info for '
-            'destination {d}, although it should contain routing info for '
-            'destination {destination}.'
-        )
-        return None
-
-    return routing_topo
-
-def _sub_tree_cnt(asn2sub_tree_cnt, tree, root):
-    sub_tree_sz = 0
-    if _is_in_mainland(root): sub_tree_sz += 1
-
-    if root not in tree.keys():
-        asn2sub_tree_cnt[root] = sub_tree_sz
-        return asn2sub_tree_cnt
-    
-    for child in tree[root]:
-        asn2sub_tree_cnt = _sub_tree_cnt(asn2sub_tree_cnt, tree, child)
-        sub_tree_sz += asn2sub_tree_cnt[child]
-
-    asn2sub_tree_cnt[root] = sub_tree_sz
-    return asn2sub_tree_cnt
+def _post_order(reverse_topo, destination):
+    '''
+        ASes of the routing tree (without the destination), such that each AS
+            comes after all ASes in its subtree (i.e., reversed BFS order).
+    '''
+    order = list(reverse_topo[destination])
+    for asn in order:
+        if asn in reverse_topo: order.extend(reverse_topo[asn])
+    order.reverse()
+    return order
 
-def _update_cp_intercepted(
-    cp_intercepted, asn2sub_tree_cnt, border_ases, routing_topo
+def _update_chokepoint_potentials_by_destination(
+    mainland_of, border_of, cp_intercepted, path_cnt, destination
 ):
     '''
+        For all countries at once, with (sparse) per-country subtree counts:
+            sub_tree_cnt[asn][country] = number of ASes of the country's
+                mainland in the subtree of the AS
+
         For a border AS its chokepoint potential will be updated only if its
             next hope---for the given routing tree---is outside the country.
     '''
-    for border_as in border_ases:
-        if border_as not in routing_topo.keys(): continue
-        next_hop = routing_topo[border_as]
-        if not _is_in_mainland(next_hop):
-            cp_intercepted[border_as] += asn2sub_tree_cnt[border_as]
-    return cp_intercepted
+    # Is the destination at the right side of the border?
+    dest_countries = mainland_of.get(destination, ())
+    if len(dest_countries) == len(countries): return
 
-def _update_chokepoint_potentials_by_destination(
-    border_ases, cp_intercepted, path_cnt, destination, routing_file_root
-):
-    # Routing & reverse topo
-    routing_topo = _routing_topo_of_destination(destination, routing_file_root) 
-    if routing_topo is None: return path_cnt, cp_intercepted
+    routing_topo = routing_trees.get(destination)
+    if routing_topo is None: return
     reverse_topo = _get_reverse_routing_topo(routing_topo, destination)
 
-    # Total paths
-    path_cnt += len([s for s in routing_topo.keys() if _is_in_mainland(s)])
-
-    # Subtree size counts
-    asn2sub_tree_cnt = defaultdict(int)
-    asn2sub_tree_cnt = _sub_tree_cnt(
-        asn2sub_tree_cnt, reverse_topo, destination
-    )
-
-    # Calc and update chokepoint potentials based on this _clean_ routing topo.
-    cp_intercepted = _update_cp_intercepted(
-        cp_intercepted, asn2sub_tree_cnt, border_ases, routing_topo
-    )
-    return path_cnt, cp_intercepted
-
-def _chokepoint_potentials(border_ases, routing_file_root):
-    cp_intercepted = defaultdict(int)
-    path_cnt = 0
-
-    utils.rst_log_counter(counter_max_value=len(as_topo))
-    for destination in as_topo.keys():
-        utils.log_counter()
-
-        path_cnt, cp_intercepted = _update_chokepoint_potentials_by_destination(
-            border_ases, cp_intercepted, path_cnt, destination,
-            routing_file_root
+    sub_tree_cnt = dict()
+    for asn in _post_order(reverse_topo, destination):
+        cnt = sub_tree_cnt.pop(asn, None)
+        for country in mainland_of.get(asn, ()):
+            if country in dest_countries: continue
+            if cnt is None: cnt = dict()
+            cnt[country] = cnt.get(country, 0) + 1
+            path_cnt[country] += 1
+        if cnt is None: continue
+
+        next_hop = routing_topo[asn]
+        for country in border_of.get(asn, ()):
+            if country not in mainland_of.get(next_hop, ()):
+                cp_intercepted[country][asn] += cnt.get(country, 0)
+
+        # Passed on to the next hop (only the AS' own counts are reused)
+        if next_hop == destination: continue
+        next_hop_cnt = sub_tree_cnt.get(next_hop)
+        if next_hop_cnt is None:
+            sub_tree_cnt[next_hop] = cnt
+            continue
+        for country, c in cnt.items():
+            next_hop_cnt[country] = next_hop_cnt.get(country, 0) + c
+
+def _chokepoint_potentials():
+    mainland_of, border_of = defaultdict(tuple), defaultdict(tuple)
+    for country in countries:
+        for asn in mainlands[country]:
+            mainland_of[asn] += (country, )
+        for asn in border_ases[country]:
+            border_of[asn] += (country, )
+
+    cp_intercepted = {country: defaultdict(int) for country in countries}
+    path_cnt = defaultdict(int)
+
+    for destination in telemetry.track('destinations', as_topo.keys()):
+        _update_chokepoint_potentials_by_destination(
+            mainland_of, border_of, cp_intercepted, path_cnt, destination
         )
     return path_cnt, cp_intercepted
 
-def _calc_save_chokepoint_potentials(routing_file_root, save_file):
-    border_ases = get_border_ases(as_topo, mainland)
-    path_cnt, cp_potentials = _chokepoint_potentials(
-        border_ases, routing_file_root
-    )
+def _calc_save_chokepoint_potentials(save_file):
+    path_cnt, cp_potentials = _chokepoint_potentials()
 
-    # Save to a file
-    utils.check_make_save_file_dir(args.save_file)
+    # Save to files
+    utils.check_make_save_file_dir(save_file)
     INITIAL_INFO = [
         '# Country info; focus on the mainland only', '#',
         '# Format:', '# Country|total_path_cnt'
@@ -174,27 +177,36 @@ def _calc_save_chokepoint_potentials(routing_file_root, save_file):
         '# Chokepoint potentials', '#', '# Format:',
         '# Border_ASN|intercepted_outflow_cnt'
     ]
-    file_name = f'{save_file}.{country}.{dataset}.txt'
-    with open(file_name, 'w') as f:
-        # Info dump
-        f.writelines(line + '\n' for line in INITIAL_INFO)
-        f.writelines(f'{country}|{path_cnt}\n')
-        f.writelines(line + '\n' for line in CHOKEPOINT_INFO)
-
-        # Save outflow + inflow data
-        for border_asn in border_ases:
-            outflow_cnt = cp_potentials[border_asn]
-            f.writelines(f'{border_asn}|{outflow_cnt}\n')
+    for country in countries:
+        file_name = f'{save_file}.{country}.{dataset}.txt'
+        with open(file_name, 'w') as f:
+            # Info dump
+            f.writelines(line + '\n' for line in INITIAL_INFO)
+            f.writelines(f'{country}|{path_cnt[country]}\n')
+            f.writelines(line + '\n' for line in CHOKEPOINT_INFO)
+
+            # Save outflow + inflow data
+            for border_asn in border_ases[country]:
+                outflow_cnt = cp_potentials[country][border_asn]
+                f.writelines(f'{border_asn}|{outflow_cnt}\n')
+
+    telemetry.write_summary(f'{save_file}.{"_".join(countries)}.{dataset}')
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('choke_potential', args)
     _set_global_vars(args)
     utils.enable_logger(
-        f'chokepoint_border.mainland.{country}',
+        f'chokepoint_border.mainland.{"_".join(countries)}',
+        log_dir=f'logs/chokepoint_border_mainland.NO_CLEAN.{dataset}'
+    )
+    telemetry.enable_telemetry(
+        f'chokepoint_border.mainland.{"_".join(countries)}',
         log_dir=f'logs/chokepoint_border_mainland.NO_CLEAN.{dataset}'
     )
 
     start = time.time()   
-    _calc_save_chokepoint_potentials(args.routing_file_root, args.save_file)
+    _calc_save_chokepoint_potentials(args.save_file)
+    routing_trees.log_stats()
     end = time.time()
     utils.log_elapsed_time(end-start)
@@ -1,5 +1,10 @@
-from collections import defaultdict, deque
-from functools import cmp_to_key
+import os
+
+from array import array
+from collections import deque
+
+from source.utils import load
+from source.utils.unionfind import UnionFind
 
 def in_country(asn, country, as_country_map):
     if isinstance(as_country_map[asn], list):
@@ -23,76 +28,208 @@ def get_mainland(as_topo, as_country_map, country):
             ==> S = mainland; D = non-mainland
     '''
 
-    def _get_country_asns():
-        return [
-            asn for asn in as_topo.keys()
-            if in_country(asn, country, as_country_map)
-        ]
+    asns = as_topo.asns
 
-    def _get_island(start_asn):
-        q = deque()
-        q.append(start_asn)
+    def _get_country_flags():
+        # in_country for each AS id
+        return bytearray(
+            in_country(asn, country, as_country_map) for asn in asns
+        )
 
-        visited = defaultdict(bool)
-        visited[start_asn] = True
+    def _get_island(start_idx, in_c, visited):
+        q = deque()
+        q.append(start_idx)
+        visited[start_idx] = True
 
         island = list()
-        island.append(start_asn)
+        island.append(start_idx)
 
         while q:
-            curr_asn = q.popleft()
-            rels = as_topo[curr_asn]
-            all_conns = rels['providers'] + rels['customers'] + rels['peers']
-            for conn in all_conns:
-                if not in_country(conn, country, as_country_map):
+            curr_idx = q.popleft()
+            for conn in as_topo.all_neighbours(curr_idx):
+                if not in_c[conn] or visited[conn]:
                     continue
-                if not visited[conn]:
-                    visited[conn] = True
-                    q.append(conn)
-                    island.append(conn)
+                visited[conn] = True
+                q.append(conn)
+                island.append(conn)
         return island
 
-    def _get_island_size(start_asn, visited):
-        island = _get_island(start_asn)
-        island_size = len(island)
-        for asn in island: visited[asn] = True
-        return island_size, visited
-
-    def _get_islands(country_asns):
-        country_islands = list()
-        visited = defaultdict(bool)
-        for asn in country_asns:
-            if not visited[asn]:
-                island_size, visited = _get_island_size(asn, visited)
-                country_islands.append((asn, island_size))
-        return country_islands
-
-    def _get_country_islands():
-        
-        def _islands_cmp(a, b):
-            if a[1] > b[1]: return -1
-            return 1
-
-        country_asns = _get_country_asns()
-        country_islands = _get_islands(country_asns)
-        country_islands.sort(key=cmp_to_key(_islands_cmp))
-        return country_islands
-
-    country_islands = _get_country_islands()
-    mainland_start_asn, _ = country_islands[0]
-    return set(_get_island(mainland_start_asn))
+    def _get_mainland_island(in_c):
+        # Islands are discovered in the order of the topology; the first of the
+        #   largest ones is the mainland.
+        visited = bytearray(len(asns))
+        mainland = list()
+        for idx in range(len(asns)):
+            if not in_c[idx] or visited[idx]: continue
+            island = _get_island(idx, in_c, visited)
+            if len(island) > len(mainland):
+                mainland = island
+        return mainland
+
+    in_c = _get_country_flags()
+    mainland = _get_mainland_island(in_c)
+    return set(asns[idx] for idx in mainland)
 
 def get_border_ases(as_topo, mainland):
     border_ases = list()
+    asn2id, asns = as_topo.asn2id, as_topo.asns
     for asn in mainland:
         # The AS _in_ the country...
-        rels = as_topo[asn]
+        idx = asn2id.get(asn)
+        if idx is None: continue
 
         # ...with a connection _outside_ the country
-        all_connections = rels['customers'] + rels['peers'] + rels['providers']
-        for connection in all_connections:
-            if connection not in mainland:
+        for conn in as_topo.all_neighbours(idx):
+            if asns[conn] not in mainland:
                 border_ases.append(asn)
                 break
 
     return border_ases
+
+class CountryIndex:
+    '''
+        Mainland and border ASes of all countries at once:
+            country_index.mainland(country) = set of mainland ASNs
+            country_index.border_ases(country) = [border ASN]
+        Same as get_mainland and get_border_ases, but border ASes are in the
+        order of the topology.
+
+        Kept as AS ids of the topology, in the CSR format over the countries.
+    '''
+
+    def __init__(self, as_topo, countries, country_sizes, mainland_off,
+                 mainland_ids, border_off, border_ids):
+        self.asns = as_topo.asns
+        self.countries = countries
+        self.country2id = {c: idx for idx, c in enumerate(countries)}
+        self.country_sizes = country_sizes
+        self.mainland_off, self.mainland_ids = mainland_off, mainland_ids
+        self.border_off, self.border_ids = border_off, border_ids
+        self._mainlands = dict()
+
+    def _ids(self, off, ids, country):
+        c = self.country2id.get(country)
+        if c is None: return ()
+        return ids[off[c]:off[c + 1]]
+
+    def country_size(self, country):
+        '''
+            Number of ASes in the country (mainland and islands)
+        '''
+        c = self.country2id.get(country)
+        return 0 if c is None else self.country_sizes[c]
+
+    def mainland(self, country):
+        if country not in self._mainlands:
+            self._mainlands[country] = set(
+                self.asns[idx] for idx in
+                self._ids(self.mainland_off, self.mainland_ids, country)
+            )
+        return self._mainlands[country]
+
+    def border_ases(self, country):
+        return [
+            self.asns[idx] for idx in
+            self._ids(self.border_off, self.border_ids, country)
+        ]
+
+def _country_labels(as_topo, as_country_map):
+    # Countries of each AS id, as ids over the country table
+    country2id = dict()
+    labels = list()
+    for asn in as_topo.asns:
+        countries = as_country_map.get(asn, ())
+        if isinstance(countries, str): countries = (countries, )
+        labels.append(tuple(
+            country2id.setdefault(c, len(country2id))
+            for c in dict.fromkeys(countries)
+        ))
+    return list(country2id), labels
+
+def get_country_index(as_topo, as_country_map):
+    '''
+        Builds the CountryIndex with a single union-find pass over the links:
+            ASes are connected (per country) if both are in the country. The
+            mainland is the largest component, and the first in the order of
+            the topology among the largest ones (as in get_mainland).
+    '''
+    countries, labels = _country_labels(as_topo, as_country_map)
+
+    # Items are (AS id, country id) pairs
+    islands = UnionFind((idx, c) for idx, cs in enumerate(labels) for c in cs)
+    for idx, cs in enumerate(labels):
+        if not cs: continue
+        for conn in as_topo.all_neighbours(idx):
+            if conn < idx: continue
+            for c in cs:
+                if c in labels[conn]: islands.union((idx, c), (conn, c))
+
+    # Mainland root of every country (items are in the order of the topology)
+    country_sizes = array('i', bytes(4 * len(countries)))
+    mainland_root = dict()
+    for idx, c in islands:
+        country_sizes[c] += 1
+        root = islands.find((idx, c))
+        curr_root = mainland_root.get(c)
+        if curr_root is None or islands.size(root) > islands.size(curr_root):
+            mainland_root[c] = root
+
+    mainland_ids = [list() for _ in countries]
+    for idx, c in islands:
+        if islands.find((idx, c)) == mainland_root[c]:
+            mainland_ids[c].append(idx)
+
+    # Border ASes: mainland ASes with a link outside the mainland
+    border_ids = [list() for _ in countries]
+    for c, ids in enumerate(mainland_ids):
+        in_mainland = set(ids)
+        for idx in ids:
+            for conn in as_topo.all_neighbours(idx):
+                if conn not in in_mainland:
+                    border_ids[c].append(idx)
+                    break
+
+    def _csr(lists):
+        off, ids = array('i', [0]), array('i')
+        for l in lists:
+            ids.extend(l)
+            off.append(len(ids))
+        return off, ids
+
+    return CountryIndex(
+        as_topo, countries, country_sizes,
+        *_csr(mainland_ids), *_csr(border_ids)
+    )
+
+def load_country_index(as_topo, as_country_map, topology_file, as_info_file):
+    '''
+        The CountryIndex of the topology and AS info files (loaded as as_topo
+        and as_country_map), cached as a snapshot next to the topology one.
+    '''
+    if not load.SNAPSHOT_DIR: return get_country_index(as_topo, as_country_map)
+
+    kind = f'country-index.{os.path.basename(as_info_file)}'
+    path = load.snapshot_path(topology_file, kind)
+    digest = load.file_digest(topology_file) + load.file_digest(as_info_file)
+    snap = load.open_snapshot(path, digest)
+    if snap is not None and snap.meta.get('asn_num') == len(as_topo):
+        return CountryIndex(
+            as_topo, snap.strings('countries'), snap.array('country_sizes'),
+            snap.array('mainland.off'), snap.array('mainland.ids'),
+            snap.array('border.off'), snap.array('border.ids')
+        )
+
+    country_index = get_country_index(as_topo, as_country_map)
+    arrays = {
+        'country_sizes': country_index.country_sizes,
+        'mainland.off': country_index.mainland_off,
+        'mainland.ids': country_index.mainland_ids,
+        'border.off': country_index.border_off,
+        'border.ids': country_index.border_ids,
+    }
+    load.save_snapshot(
+        path, digest, arrays=arrays,
+        strings={'countries': country_index.countries},
+        meta={'asn_num': len(as_topo)}
+    )
+    return country_index
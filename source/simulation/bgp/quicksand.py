@@ -1,19 +1,35 @@
 import argparse
 import copy
+import logging
+import multiprocessing
+import os
 import time
 
 from collections import defaultdict, deque
 from functools import cmp_to_key
 from hashlib import sha256
 
+from source.simulation.bgp.bgpsim import (
+    BGPSimulator, load_tiebreak_ranks, next_hops_to_routing_topo
+)
+from source.utils import profiling
+from source.utils import telemetry
 from source.utils import utils
-from source.utils.load import load_AS_topology
+from source.utils.load import file_digest, load_AS_topology
+from source.utils.routestore import RouteStoreWriter, routing_topo_to_next_hops
 
+@profiling.stage
 def _bgp_simulate_prep(as_topo):
-    as_topo_new = copy.deepcopy(as_topo)
-    for asn in as_topo.keys():
-        as_topo_new[asn]['visited'] = False
-        as_topo_new[asn]['preferred_next'] = list()
+    # The relationships are only read, so only the simulation state is new.
+    as_topo_new = dict()
+    for asn, rels in as_topo.items():
+        as_topo_new[asn] = {
+            'providers': rels['providers'],
+            'customers': rels['customers'],
+            'peers': rels['peers'],
+            'visited': False,
+            'preferred_next': list()
+        }
     return as_topo_new
 
 def _stage_1(as_topo, destination):
@@ -158,6 +174,29 @@ def _parse_args():
     parser.add_argument(
         '--save_file', default='generated_data/bgp_routes/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', action=argparse.BooleanOptionalAction,
+        help='Save all routes in a single route store ({save_file}.routes).'
+    )
+    parser.set_defaults(route_store=False)
+    parser.add_argument(
+        '--engine', default='array', choices=['array', 'dict'],
+        help='array: BGPSimulator (bgpsim.py); dict: bgp_simulate.'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='Number of worker processes simulating the destinations.'
+    )
+    parser.add_argument(
+        '--chunksize', type=int, default=16,
+        help='Number of destinations sent to a worker at once.'
+    )
+    parser.add_argument(
+        '--resume', action=argparse.BooleanOptionalAction,
+        help='Skip the destinations recorded in the completion manifest.'
+    )
+    parser.set_defaults(resume=True)
+    profiling.add_profile_args(parser)
     return parser.parse_args()  
 
 def _save_routing_topo(routing_topo, destination, save_file):
@@ -174,20 +213,123 @@ def _save_routing_topo(routing_topo, destination, save_file):
             if next_hop is None: continue
             f.writelines(f'{asn}|{next_hop}\n')
 
+def _load_manifest(manifest_file, topo_digest):
+    '''
+        The manifest lists the finished destinations, in the order in which
+        they were saved. It is valid only for the same topology file.
+    '''
+    done = list()
+    if not os.path.isfile(manifest_file): return done
+
+    with open(manifest_file) as f:
+        for line in f:
+            if line.startswith('# topology:'):
+                if line.split(':')[1].strip() != topo_digest: return list()
+            elif not line.startswith('#') and line.strip() != '':
+                done.append(line.strip())
+    return done
+
+def _open_manifest(manifest_file, topo_digest, done):
+    MANIFEST_INFO = [
+        '# Finished destinations', f'# topology: {topo_digest}', '#',
+        '# Format:', '# destination'
+    ]
+    # Rewritten, so that a partly written last line is dropped
+    f = open(manifest_file, 'w')
+    f.writelines(line + '\n' for line in MANIFEST_INFO)
+    f.writelines(f'{dest}\n' for dest in done)
+    f.flush()
+    return f
+
+def _init_worker(topo, ranks, save_file, store_asn2id):
+    # With the fork start method the topology is inherited (copy-on-write)
+    #   instead of being pickled.
+    global worker_topo, worker_sim, worker_save_file, worker_store_asn2id
+    worker_topo = topo
+    worker_sim = BGPSimulator(topo, ranks) if ranks is not None else None
+    worker_save_file = save_file
+    worker_store_asn2id = store_asn2id
+
+def _simulate_destination(dest):
+    if worker_sim is not None:
+        dest_id = worker_topo.asn2id[dest]
+        next_hops = worker_sim.simulate(dest_id)
+        if worker_store_asn2id is not None: return dest, next_hops.tobytes()
+        routing_topo = next_hops_to_routing_topo(
+            worker_topo.asns, next_hops, dest_id
+        )
+    else:
+        routing_topo = bgp_simulate(worker_topo, dest)
+        if worker_store_asn2id is not None:
+            next_hops = routing_topo_to_next_hops(
+                routing_topo, worker_store_asn2id
+            )
+            return dest, next_hops.tobytes()
+
+    _save_routing_topo(routing_topo, dest, worker_save_file)
+    return dest, None
+
+def _simulate_destinations(as_topo, ranks, dests, args, store_asn2id):
+    if args.workers <= 1:
+        _init_worker(as_topo, ranks, args.save_file, store_asn2id)
+        for dest in dests:
+            yield _simulate_destination(dest)
+        return
+
+    ctx = multiprocessing.get_context('fork')
+    _init_worker(as_topo, ranks, args.save_file, store_asn2id)
+    with ctx.Pool(args.workers) as pool:
+        yield from pool.imap_unordered(
+            _simulate_destination, dests, chunksize=args.chunksize
+        )
+
 def save_routing_topo_all_destinations(args):
     utils.check_make_save_file_dir(args.save_file)
     as_topo = load_AS_topology(args.bgp_topo_file)
+    ranks = None
+    if args.engine == 'array':
+        ranks = load_tiebreak_ranks(args.bgp_topo_file, as_topo)
+
+    # Finished destinations (from a previous, interrupted run)
+    topo_digest = file_digest(args.bgp_topo_file)
+    store_file = f'{args.save_file}.routes'
+    manifest_file = (
+        f'{store_file if args.route_store else args.save_file}.manifest.txt'
+    )
+    done = _load_manifest(manifest_file, topo_digest) if args.resume else []
+
+    writer, store_asn2id = None, None
+    if args.route_store:
+        writer = RouteStoreWriter(store_file, as_topo.keys(), resume_dests=done)
+        if not writer.resumed: done = list()
+        store_asn2id = writer.asn2id
+    logging.info(f'Finished destinations (skipped): {len(done)}')
+
+    done_set = set(done)
+    dests = [dest for dest in as_topo.keys() if dest not in done_set]
+    manifest = _open_manifest(manifest_file, topo_digest, done)
 
-    utils.rst_log_counter(counter_max_value=len(as_topo))
-    for dest in as_topo.keys():
-        utils.log_counter()
+    for dest, next_hops in telemetry.track(
+        'destinations',
+        _simulate_destinations(as_topo, ranks, dests, args, store_asn2id),
+        total=len(dests)
+    ):
+        # The tree is saved before the destination is marked as finished
+        if writer is not None:
+            writer.add_by_id(writer.asn2id[dest], next_hops)
+            writer.flush()
+        manifest.write(f'{dest}\n')
+        manifest.flush()
 
-        routing_topo = bgp_simulate(as_topo, dest)
-        _save_routing_topo(routing_topo, dest, args.save_file) 
+    manifest.close()
+    if writer is not None: writer.close()
+    telemetry.write_summary(manifest_file.removesuffix('.manifest.txt'))
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('quicksand', args)
     utils.enable_logger('quicksand', log_dir='logs/quicksand')
+    telemetry.enable_telemetry('quicksand', log_dir='logs/quicksand')
 
     start = time.time()
     save_routing_topo_all_destinations(args)
@@ -0,0 +1,287 @@
+import argparse
+import logging
+import time
+
+from array import array
+
+from source.simulation.bgp.bgpsim import (
+    BGPSimulator, CUSTOMER, ORIGIN, PEER, PROVIDER, load_tiebreak_ranks,
+    tiebreak_key
+)
+from source.utils import profiling
+from source.utils import telemetry
+from source.utils import utils
+from source.utils.load import load_AS_topology
+from source.utils.routestore import NO_ROUTE, RouteStore, RouteStoreWriter
+
+# Incremental route recomputation between two topology snapshots.
+#
+# Only the routing trees that the added or removed links can affect are
+# simulated again (on the new topology); all other trees are carried over.
+# A tree towards D is affected by a link x--y if, in the old tree, y offers x
+# (as in the three stages of the simulation) a route that
+#   - is added, and is better than x's route (or x had no route), or as good
+#     and preferred by the tie-break to x's next hop; provider routes are not
+#     ordered by length in the third stage: x takes the length (and its place
+#     in the queue) of the provider dequeued first, so any other provider
+#     route counts if y is dequeued before that provider,
+#   - is removed, and was one of x's candidates (same type and length).
+# The third-stage dequeue order is not in the store; it is bounded by keys
+# (see _OldRoutes.order_key), and ties count as affecting the tree.
+# The unchanged links are assumed to keep their relative order in the files
+# (e.g., sorted CAIDA files), as the order of neighbours is part of the
+# simulation.
+#
+# The ASN table of the new route store extends the old one: ASes that are new
+# get new ids, and ASes that disappeared keep theirs (without any routes).
+
+def _get_links(as_topo):
+    links = set()
+    asns = as_topo.asns
+    for idx, asn in enumerate(asns):
+        for cust in as_topo.neighbours('customers', idx):
+            links.add((asn, asns[cust], -1))
+        for peer in as_topo.neighbours('peers', idx):
+            if asn < asns[peer]: links.add((asn, asns[peer], 0))
+    return links
+
+def _get_offers(links):
+    '''
+        Returns (receiver, sender, route_type) for both directions of links.
+    '''
+    offers = list()
+    for asn1, asn2, rel_type in links:
+        if rel_type == -1:
+            # asn1: provider; asn2: customer
+            offers.append((asn1, asn2, CUSTOMER))
+            offers.append((asn2, asn1, PROVIDER))
+        else:
+            offers.append((asn1, asn2, PEER))
+            offers.append((asn2, asn1, PEER))
+    return offers
+
+class _OldRoutes:
+    '''
+        (route_type, path_length) of ASes in one routing tree of the old store.
+    '''
+
+    def __init__(self, old_topo, route_type_cache, dest_id, next_hops):
+        self.old_topo = old_topo
+        self.route_type_cache = route_type_cache
+        self.dest_id = dest_id
+        self.next_hops = next_hops
+        self.path_len = {dest_id: 0}
+        self.order_keys = dict()
+
+    def _route_type(self, asn_id, next_hop):
+        key = (asn_id, next_hop)
+        if key not in self.route_type_cache:
+            route_type = None
+            for rel, rel_route_type in [
+                ('customers', CUSTOMER), ('peers', PEER),
+                ('providers', PROVIDER)
+            ]:
+                if next_hop in self.old_topo.neighbours(rel, asn_id):
+                    route_type = rel_route_type
+                    break
+            self.route_type_cache[key] = route_type
+        return self.route_type_cache[key]
+
+    def _path_len(self, asn_id):
+        path = list()
+        curr = asn_id
+        while curr not in self.path_len:
+            path.append(curr)
+            curr = self.next_hops[curr]
+        curr_len = self.path_len[curr]
+        for asn in reversed(path):
+            curr_len += 1
+            self.path_len[asn] = curr_len
+        return self.path_len[asn_id]
+
+    def route(self, asn_id):
+        if asn_id is None: return None
+        if asn_id == self.dest_id: return ORIGIN, 0
+        next_hop = self.next_hops[asn_id]
+        if next_hop == NO_ROUTE: return None
+        return self._route_type(asn_id, next_hop), self._path_len(asn_id)
+
+    def order_key(self, asn_id):
+        '''
+            Key of the AS in the third-stage queue: if key(a) < key(b), a is
+            dequeued before b (equal keys: unknown order).
+                - first the ASes of the first two stages (in the order of the
+                    simulation): the origin and the customer routes, then the
+                    peer routes, each by length: (0, 0 or 1, length);
+                - then the provider routes, in the order of their first
+                    providers (which enqueued them): (1, key of the first
+                    provider).
+            Returns None for ASes on a provider cycle (unknown order).
+        '''
+        if asn_id in self.order_keys: return self.order_keys[asn_id]
+        route_type, length = self.route(asn_id)
+        if route_type in [ORIGIN, CUSTOMER]: key = (0, 0, length)
+        elif route_type == PEER: key = (0, 1, length)
+        else:
+            self.order_keys[asn_id] = None
+            key = self.first_provider_key(asn_id)
+            if key is not None: key = (1, key)
+        self.order_keys[asn_id] = key
+        return key
+
+    def first_provider_key(self, asn_id):
+        '''
+            Smallest order key of the providers (with a route) of the AS, i.e.,
+            of the provider that gave it its provider route length.
+        '''
+        keys = list()
+        for provider in self.old_topo.neighbours('providers', asn_id):
+            if self.next_hops[provider] == NO_ROUTE and \
+                provider != self.dest_id:
+                continue
+            key = self.order_key(provider)
+            if key is None: return None
+            keys.append(key)
+        return min(keys)
+
+def _offered_route(sender_route, route_type):
+    # Customer and peer routes are offered only by the first-stage ASes
+    if sender_route is None: return None
+    sender_type, sender_len = sender_route
+    if route_type != PROVIDER and sender_type not in [ORIGIN, CUSTOMER]:
+        return None
+    return route_type, sender_len + 1
+
+def _is_affected(routes, asn2id, added_offers, removed_offers):
+    for receiver, sender, route_type in added_offers:
+        recv_id = asn2id.get(receiver)
+        if recv_id == routes.dest_id: continue
+        offered = _offered_route(routes.route(asn2id.get(sender)), route_type)
+        if offered is None: continue
+
+        current = routes.route(recv_id)
+        if current is None or offered[0] < current[0]: return True
+        if offered[0] != current[0]: continue
+        if offered[1] == current[1]:
+            next_hop = routes.old_topo.asns[routes.next_hops[recv_id]]
+            if tiebreak_key(receiver, sender) < \
+                tiebreak_key(receiver, next_hop):
+                return True
+            if offered[0] != PROVIDER: continue
+        elif offered[0] != PROVIDER:
+            if offered[1] < current[1]: return True
+            continue
+
+        # Provider route: only if the sender is dequeued before the
+        #   receiver's first provider; of another length, it would change the
+        #   receiver's route, of the same length, the receiver's place in the
+        #   queue (hence the first providers of its customers)
+        sender_key = routes.order_key(asn2id[sender])
+        first_key = routes.first_provider_key(recv_id)
+        if sender_key is None or first_key is None: return True
+        if sender_key <= first_key: return True
+
+    for receiver, sender, route_type in removed_offers:
+        recv_id = asn2id.get(receiver)
+        if recv_id == routes.dest_id: continue
+        offered = _offered_route(routes.route(asn2id.get(sender)), route_type)
+        if offered is not None and offered == routes.route(recv_id):
+            return True
+    return False
+
+def recompute_routes(old_topo, new_topo, old_store, new_ranks, save_file):
+    '''
+        Writes the route store of the new topology, given the route store of
+        the old one. Returns the number of recomputed destinations.
+    '''
+    old_links, new_links = _get_links(old_topo), _get_links(new_topo)
+    added_offers = _get_offers(new_links - old_links)
+    removed_offers = _get_offers(old_links - new_links)
+    logging.info(
+        f'Links added: {len(new_links - old_links)}, '
+        f'removed: {len(old_links - new_links)}'
+    )
+
+    # The old store ids (old topology ids must be the same), extended with
+    #   the new ASes.
+    asns = list(old_store.asns)
+    if asns != old_topo.asns:
+        raise ValueError('The old route store is not for the old topology.')
+    asns_set = set(asns)
+    asns.extend(asn for asn in new_topo.asns if asn not in asns_set)
+    extension = array('i', [NO_ROUTE]) * (len(asns) - len(old_store.asns))
+
+    sim = BGPSimulator(new_topo, new_ranks)
+    route_type_cache = dict()
+    stage = telemetry.Stage('destinations', total=len(new_topo))
+
+    with RouteStoreWriter(save_file, asns) as writer, stage:
+        store_asn2id = writer.asn2id
+        new2store = array('i', [store_asn2id[asn] for asn in new_topo.asns])
+
+        for dest_id, dest in enumerate(new_topo.asns):
+            old_next_hops = old_store.next_hops(dest)
+            if old_next_hops is not None:
+                routes = _OldRoutes(
+                    old_topo, route_type_cache, old_store.asn2id[dest],
+                    old_next_hops
+                )
+                if not _is_affected(
+                    routes, old_store.asn2id, added_offers, removed_offers
+                ):
+                    writer.add_by_id(
+                        store_asn2id[dest], bytes(old_next_hops) + bytes(extension)
+                    )
+                    stage.tick()
+                    continue
+
+            stage.count('recomputed')
+            next_hops = array('i', [NO_ROUTE]) * len(asns)
+            for asn_id, next_hop in enumerate(sim.simulate(dest_id)):
+                if next_hop != NO_ROUTE:
+                    next_hops[new2store[asn_id]] = new2store[next_hop]
+            writer.add_by_id(store_asn2id[dest], next_hops)
+            stage.tick()
+
+    recomputed = stage.counters.get('recomputed', 0)
+    logging.info(f'Recomputed: {recomputed} / {len(new_topo)}')
+    telemetry.write_summary(save_file)
+    return recomputed
+
+################################################################################
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--old_bgp_topo_file', default='data/caida/20230101.as-rel2.txt'
+    )
+    parser.add_argument(
+        '--new_bgp_topo_file', default='data/caida/20230201.as-rel2.txt'
+    )
+    parser.add_argument(
+        '--old_route_store',
+        default='generated_data/bgp_routes/20230101.as-rel2.routes'
+    )
+    parser.add_argument(
+        '--save_file',
+        default='generated_data/bgp_routes/20230201.as-rel2.routes'
+    )
+    profiling.add_profile_args(parser)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+    profiling.enable_profiling('routediff', args)
+    utils.enable_logger('routediff', log_dir='logs/routediff')
+    telemetry.enable_telemetry('routediff', log_dir='logs/routediff')
+
+    start = time.time()
+    old_topo = load_AS_topology(args.old_bgp_topo_file)
+    new_topo = load_AS_topology(args.new_bgp_topo_file)
+    new_ranks = load_tiebreak_ranks(args.new_bgp_topo_file, new_topo)
+    old_store = RouteStore(args.old_route_store)
+
+    utils.check_make_save_file_dir(args.save_file)
+    recompute_routes(old_topo, new_topo, old_store, new_ranks, args.save_file)
+    end = time.time()
+    utils.log_elapsed_time(end-start)
@@ -1,33 +1,199 @@
 import argparse
+
+from array import array
+from bisect import bisect_left
 from collections import defaultdict, deque
 
+from source.utils import profiling
 from source.utils.load import load_AS_topology
+from source.utils.snapshot import Snapshot, write_snapshot
 from source.utils.utils import sort_dict
 
-def get_customer_cone_for_all(as_topo):
+# Set bits of every byte value, for reading the AS ids out of a cone bitset
+_BYTE_BITS = [
+    tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)
+]
 
-    def get_customer_cone_for_as(asn):
-        q = deque()
-        q.append(asn)
-        visited = defaultdict(bool)
-        visited[asn] = True
-        cone = 1
+def _customer_sccs(as_topo):
+    '''
+        Strongly connected components of the provider->customer graph (they
+            are not single ASes only if the relationship data has cycles),
+            by the iterative Tarjan's algorithm.
 
-        while q:
-            curr_asn = q.popleft()
-            for cust in as_topo[curr_asn]['customers']:
-                if not visited[cust]:
-                    q.append(cust)
-                    visited[cust] = True
-                    cone += 1
-        return cone
+        Components come in the reverse topological order, i.e., the customers
+            of a component are all in the earlier components.
+        Returns: comp, comps
+            comp[idx] = component of the AS
+            comps[c] = [idx of the AS in the component]
+    '''
+    cust_off, cust_nbr = as_topo.offsets['customers'], as_topo.nbrs['customers']
+    as_num = len(as_topo)
+    index = array('i', [-1]) * as_num
+    low = array('i', [-1]) * as_num
+    comp = array('i', [-1]) * as_num
+    comps, stack = list(), list()
+    counter = 0
+
+    for root in range(as_num):
+        if index[root] != -1: continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        work = [[root, cust_off[root]]]
+
+        while work:
+            frame = work[-1]
+            idx, pos = frame
+            if pos < cust_off[idx + 1]:
+                frame[1] += 1
+                cust = cust_nbr[pos]
+                if index[cust] == -1:
+                    index[cust] = low[cust] = counter
+                    counter += 1
+                    stack.append(cust)
+                    work.append([cust, cust_off[cust]])
+                elif comp[cust] == -1:
+                    # On the stack, i.e., a cycle
+                    low[idx] = min(low[idx], index[cust])
+                continue
+
+            work.pop()
+            if work:
+                prov = work[-1][0]
+                low[prov] = min(low[prov], low[idx])
+            if low[idx] != index[idx]: continue
+
+            members = list()
+            while True:
+                member = stack.pop()
+                comp[member] = len(comps)
+                members.append(member)
+                if member == idx: break
+            comps.append(members)
+
+    return comp, comps
+
+def _bitset_ids(lo, bitset, pos2id):
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, 'little')
+    ids = array('i')
+    for byte_idx, byte in enumerate(data):
+        if not byte: continue
+        base = lo + 8 * byte_idx
+        ids.extend(pos2id[base + bit] for bit in _BYTE_BITS[byte])
+    return sorted(ids)
+
+@profiling.stage
+def get_customer_cone_for_all(as_topo, index_file=None):
+    '''
+        Customer cones of all ASes in a single pass over the components of
+            the provider->customer graph, in the reverse topological order:
+            the cone of a component is the union of its members and the cones
+            of its customers' components. A cone is freed as soon as all its
+            providers' components took it.
+
+        Cones are bitsets over the positions of the ASes in that order,
+            shifted by their lowest position: (lo, bits). A cone then mostly
+            spans a short range of positions, as customers come just before
+            their providers.
+
+        If index_file is given, the cone members are saved to it as well (see
+            ConeIndex).
+    '''
+    cust_off, cust_nbr = as_topo.offsets['customers'], as_topo.nbrs['customers']
+    comp, comps = _customer_sccs(as_topo)
+
+    # Customer components of every component, and the number of components
+    #   that still need its cone
+    cust_comps = list()
+    pending = array('i', bytes(4 * len(comps)))
+    for c, members in enumerate(comps):
+        custs = {
+            comp[cust_nbr[pos]] for idx in members
+            for pos in range(cust_off[idx], cust_off[idx + 1])
+        }
+        custs.discard(c)
+        for cust_c in custs:
+            pending[cust_c] += 1
+        cust_comps.append(custs)
+
+    pos2id = array('i', [idx for members in comps for idx in members])
+    comp_cone_size = array('i', bytes(4 * len(comps)))
+    cones = dict()
+    cone_off, cone_ids = array('q', [0]), array('i')
+    start = 0
+    for c, members in enumerate(comps):
+        cust_cones = [cones[cust_c] for cust_c in cust_comps[c]]
+        lo = min([start] + [cust_lo for cust_lo, _ in cust_cones])
+        bits = ((1 << len(members)) - 1) << (start - lo)
+        for cust_lo, cust_bits in cust_cones:
+            bits |= cust_bits << (cust_lo - lo)
+        start += len(members)
+
+        for cust_c in cust_comps[c]:
+            pending[cust_c] -= 1
+            if not pending[cust_c]: del cones[cust_c]
+        cust_comps[c] = None
+
+        comp_cone_size[c] = bits.bit_count()
+        if pending[c]: cones[c] = (lo, bits)
+        if index_file is not None:
+            cone_ids.extend(_bitset_ids(lo, bits, pos2id))
+            cone_off.append(len(cone_ids))
+
+    if index_file is not None:
+        write_snapshot(
+            index_file, {'kind': 'cone-index'},
+            arrays={'comp': comp, 'cone.off': cone_off, 'cone.ids': cone_ids},
+            strings={'asns': as_topo.asns}
+        )
 
     cc_map = defaultdict(int)
-    for asn in as_topo.keys():
-        customer_cone = get_customer_cone_for_as(asn)
-        cc_map[asn] = customer_cone
+    for idx, asn in enumerate(as_topo.asns):
+        cc_map[asn] = comp_cone_size[comp[idx]]
     return sort_dict(cc_map)
 
+class ConeIndex:
+    '''
+        Customer cone members of all ASes, as saved by
+            get_customer_cone_for_all(as_topo, index_file):
+                cone_index.cone(asn) = [ASNs in the customer cone of the AS]
+        The file is mmap-ed, and the cones are kept as sorted AS ids.
+    '''
+
+    def __init__(self, index_file):
+        snap = Snapshot(index_file)
+        if snap.meta.get('kind') != 'cone-index':
+            raise ValueError(f'Not a cone index: {index_file}')
+
+        self.asns = snap.strings('asns')
+        self.asn2id = {asn: idx for idx, asn in enumerate(self.asns)}
+        self._comp = snap.array('comp')
+        self._off = snap.array('cone.off')
+        self._ids = snap.array('cone.ids')
+
+    def __contains__(self, asn):
+        return asn in self.asn2id
+
+    def _cone_ids(self, asn):
+        c = self._comp[self.asn2id[asn]]
+        return self._ids[self._off[c]:self._off[c + 1]]
+
+    def size(self, asn):
+        return len(self._cone_ids(asn))
+
+    def cone(self, asn):
+        return [self.asns[idx] for idx in self._cone_ids(asn)]
+
+    def in_cone(self, asn, cust_asn):
+        '''
+            Is cust_asn in the customer cone of asn?
+        '''
+        cust_id = self.asn2id.get(cust_asn)
+        if cust_id is None: return False
+        ids = self._cone_ids(asn)
+        pos = bisect_left(ids, cust_id)
+        return pos < len(ids) and ids[pos] == cust_id
+
 def get_customer_cone_size_core_ISD(isd_core_topo, isd_non_core_topo):
 
     def get_customer_cone_for_core_as(core_asn):
@@ -61,11 +227,16 @@ def _parse_args():
     parser.add_argument(
         '--save_file', default='data/scion/20230101.customer-cone-size.txt'
     )
+    parser.add_argument(
+        '--cone_index_file', default=None,
+        help='If given, the members of all customer cones are saved to it.'
+    )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
-def _get_save_customer_cone(as_topo, save_file):
-    cc_map = get_customer_cone_for_all(as_topo)
+def _get_save_customer_cone(as_topo, save_file, cone_index_file=None):
+    cc_map = get_customer_cone_for_all(as_topo, index_file=cone_index_file)
 
     # Write to the file
     INFO = [
@@ -82,5 +253,6 @@ def _get_save_customer_cone(as_topo, save_file):
     
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('conesize', args)
     as_topo = load_AS_topology(args.bgp_topo_file)
-    _get_save_customer_cone(as_topo, args.save_file)
+    _get_save_customer_cone(as_topo, args.save_file, args.cone_index_file)
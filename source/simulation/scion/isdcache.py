@@ -0,0 +1,128 @@
+import os
+
+from array import array
+from collections import defaultdict
+from hashlib import sha256
+
+from source.simulation.scion.conesize import get_customer_cone_size_core_ISD
+from source.simulation.scion.sciongen import get_isd_topos
+from source.utils import load
+from source.utils.asgraph import AS_RELS, ASGraph, ASGraphBuilder
+from source.utils.load import SCION_CORE_RELS
+
+class ISDCache:
+    '''
+        ISD topologies of countries (see sciongen.get_isd_topos), built once
+        per country and kept as compact graphs (ASGraph), together with the
+        customer cone sizes of the ISD cores:
+            isd_cache.topos(country) = isd_core_topo, isd_non_core_topo
+            isd_cache.cone_sizes(country) = {core_ASN: ISD customer cone size}
+
+        If the input files (SCION core topology first) are given, the ISDs are
+        also cached on disk, as snapshots keyed by the hash of the inputs, the
+        country and the dataset.
+    '''
+
+    def __init__(self, scion_core_topo, as_topo, cones, as_info, dataset,
+                 input_files=(), country_index=None):
+        self.scion_core_topo = scion_core_topo
+        self.as_topo = as_topo
+        self.cones = cones
+        self.as_info = as_info
+        self.dataset = dataset
+        self.country_index = country_index
+
+        self.input_files = list(input_files)
+        self._digest = None
+        self._isds = dict()
+
+    def _snapshot_path(self, country):
+        if not load.SNAPSHOT_DIR or not self.input_files: return None
+        return load.snapshot_path(
+            self.input_files[0], f'isd.{country}.{self.dataset}'
+        )
+
+    def _inputs_digest(self):
+        if self._digest is None:
+            h = sha256()
+            for input_file in self.input_files:
+                h.update(load.file_digest(input_file).encode('utf-8'))
+            self._digest = h.hexdigest()
+        return self._digest
+
+    def _build(self, country):
+        mainland = None
+        if self.country_index is not None:
+            mainland = self.country_index.mainland(country)
+        isd_core_topo, isd_non_core_topo = get_isd_topos(
+            self.scion_core_topo, self.as_topo, self.cones, self.as_info,
+            country, mainland=mainland
+        )
+        isd_core_topo = _to_graph(isd_core_topo, SCION_CORE_RELS)
+        isd_non_core_topo = _to_graph(isd_non_core_topo, AS_RELS)
+        isd_cone = get_customer_cone_size_core_ISD(
+            isd_core_topo, isd_non_core_topo
+        )
+        return isd_core_topo, isd_non_core_topo, isd_cone
+
+    def _get(self, country):
+        if country in self._isds: return self._isds[country]
+
+        path = self._snapshot_path(country)
+        if path is None:
+            self._isds[country] = self._build(country)
+            return self._isds[country]
+
+        snap = load.open_snapshot(path, self._inputs_digest())
+        if snap is not None:
+            isd = _isd_from_snapshot(snap)
+        else:
+            isd = self._build(country)
+            arrays, strings = _isd_to_snapshot(*isd)
+            load.save_snapshot(
+                path, self._inputs_digest(), arrays=arrays, strings=strings
+            )
+        self._isds[country] = isd
+        return isd
+
+    def topos(self, country):
+        isd_core_topo, isd_non_core_topo, _ = self._get(country)
+        return isd_core_topo, isd_non_core_topo
+
+    def cone_sizes(self, country):
+        return self._get(country)[2]
+
+def _to_graph(topo, rels):
+    # Keys keep their order, and come before the other neighbours
+    builder = ASGraphBuilder(rels)
+    for asn in topo.keys():
+        builder.intern(asn)
+    for asn, asn_rels in list(topo.items()):
+        for rel in rels:
+            for conn in asn_rels[rel]:
+                builder.add(rel, asn, conn)
+    return builder.build()
+
+def _isd_to_snapshot(isd_core_topo, isd_non_core_topo, isd_cone):
+    arrays, strings = dict(), dict()
+    graphs = [('core', isd_core_topo), ('non_core', isd_non_core_topo)]
+    for name, graph in graphs:
+        strings[f'{name}.asns'] = graph.asns
+        for rel in graph.rels:
+            arrays[f'{name}.{rel}.off'] = array('i', graph.offsets[rel])
+            arrays[f'{name}.{rel}.nbr'] = array('i', graph.nbrs[rel])
+    arrays['cones'] = array('i', isd_cone.values())
+    strings['cones.asns'] = list(isd_cone.keys())
+    return arrays, strings
+
+def _isd_from_snapshot(snap):
+    graphs = list()
+    for name, rels in [('core', SCION_CORE_RELS), ('non_core', AS_RELS)]:
+        offsets = {rel: snap.array(f'{name}.{rel}.off') for rel in rels}
+        nbrs = {rel: snap.array(f'{name}.{rel}.nbr') for rel in rels}
+        asns = snap.strings(f'{name}.asns')
+        graphs.append(ASGraph(asns, offsets, nbrs, rels))
+    isd_cone = defaultdict(
+        int, zip(snap.strings('cones.asns'), snap.array('cones'))
+    )
+    return graphs[0], graphs[1], isd_cone
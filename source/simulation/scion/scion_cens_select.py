@@ -5,9 +5,10 @@ import sys
 
 from tabulate import tabulate
 
-from source.simulation.scion.conesize import get_customer_cone_size_core_ISD
-from source.simulation.scion.sciongen import get_isd_topos
+from source.simulation.bgp.countrynet import load_country_index
+from source.simulation.scion.isdcache import ISDCache
 from source.utils import load
+from source.utils import profiling
 from source.utils.utils import pretty_print, sort_dict
 
 N_CENSORS = [1, 5, 10]
@@ -50,6 +51,7 @@ def _parse_args():
         choices=['CAIDA_HYBRID']
     )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _set_global_vars(args):
@@ -60,12 +62,25 @@ def _set_global_vars(args):
     as_topo = load.load_AS_topology(args.bgp_topo_file)
 
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
 
     global cones, scion_core_topo
     cones = load.load_customer_cone(args.customer_cone_file)
     scion_core_topo = load.load_SCION_core_topo_no_rels(args.SCION_core_topo)
 
+    global isd_cache
+    isd_cache = ISDCache(
+        scion_core_topo, as_topo, cones, as_info, dataset,
+        input_files=[
+            args.SCION_core_topo, args.bgp_topo_file, args.customer_cone_file,
+            as_info_file
+        ],
+        country_index=load_country_index(
+            as_topo, as_info, args.bgp_topo_file, as_info_file
+        )
+    )
+
 def select_biggest_cone_size(country, N):
 
     def _has_foreign_connection(core_asn, isd_core_topo):
@@ -75,10 +90,8 @@ def select_biggest_cone_size(country, N):
                 return True
         return False
 
-    isd_core_topo, isd_non_core_topo = get_isd_topos(
-        scion_core_topo, as_topo, cones, as_info, country
-    )
-    isd_cone = get_customer_cone_size_core_ISD(isd_core_topo, isd_non_core_topo)
+    isd_core_topo, _ = isd_cache.topos(country)
+    isd_cone = isd_cache.cone_sizes(country)
     
     biggest_cone_cores = set()
     idx = 0
@@ -94,6 +107,7 @@ def select_biggest_cone_size(country, N):
 
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('scion_cens_select', args)
     _set_global_vars(args)
 
     select_biggest_cone_size(args.country, N=5)
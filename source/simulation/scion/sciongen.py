@@ -4,6 +4,7 @@ from collections import defaultdict
 from statistics import median
 
 from source.simulation.bgp.countrynet import get_mainland, in_country
+from source.utils import profiling
 from source.utils.load import load_customer_cone, load_AS_topology
 from source.utils.utils import sort_dict
 
@@ -179,14 +180,18 @@ def select_isd_cores_of_country(
     return isd_core_topo
 
 def select_isd_non_cores_of_country(
-    isd_core_topo, as_topo, as_info, country
+    isd_core_topo, as_topo, as_info, country, mainland=None
 ):
 
     def _get_isd_non_cores():
-        mainland = get_mainland(as_topo, as_info, country)
+        isd_mainland = mainland
+        if isd_mainland is None:
+            isd_mainland = get_mainland(as_topo, as_info, country)
 
         isd_cores_set = set(isd_core_topo.keys())
-        isd_non_cores = [asn for asn in mainland if asn not in isd_cores_set]
+        isd_non_cores = [
+            asn for asn in isd_mainland if asn not in isd_cores_set
+        ]
         return isd_non_cores
 
     def _get_isd_non_core_topo(isd_non_cores):
@@ -242,13 +247,16 @@ def select_isd_non_cores_of_country(
 
 def get_isd_topos(
     scion_core_topo, as_topo, cones, as_info, country,
-    use_all_cores=True
+    use_all_cores=True, mainland=None
 ):
+    '''
+        The mainland of the country is computed, if not given.
+    '''
     isd_core_topo = select_isd_cores_of_country(
         scion_core_topo, cones, as_info, country
     )
     isd_non_core_topo = select_isd_non_cores_of_country(
-        isd_core_topo, as_topo, as_info, country
+        isd_core_topo, as_topo, as_info, country, mainland=mainland
     )
 
     return isd_core_topo, isd_non_core_topo
@@ -288,10 +296,12 @@ def _parse_args():
     )
     parser.add_argument('-N', type=int, default=2000)
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
     
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('sciongen', args)
     
     N = args.N
     cones = load_customer_cone(args.customer_cone_file)
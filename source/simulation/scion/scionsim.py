@@ -1,6 +1,8 @@
 from collections import defaultdict, deque
 from functools import cmp_to_key
 
+from source.utils.unionfind import UnionFind
+
 # ==============================================================================
 # ===============================  UTILS  ======================================
 # ==============================================================================
@@ -27,154 +29,256 @@ def cores_within_reach(isd_core_topo, core_destination, censors=set()):
     visited = _traverse(core_destination, visited)
     return _get_within_reach(visited)
 
-def non_cores_within_reach(
-    cores, isd_non_core_topo, core_destination, censors=set()
-):
+# Arrival relationships (what the AS is to the AS that forwarded to it)
+_REL_BITS = {'customers': 1, 'providers': 2, 'peers': 4}
 
-    def _get_next_visit_rels(visiting_rel):
-        # What am I (visiting_rel) to this node that forwarded to me?
-        # Based on that I am forwarding to others.
-        if visiting_rel == 'providers':
-            return ['customers', 'providers', 'peers']
-        return ['customers']
-
-    def _traverse(node, visited_from, visiting_rel):
-        if node == core_destination:
-            return visited_from
-        
-        if node in censors:
-            return visited_from
+def _get_next_visit_rels(visiting_rel):
+    # What am I (visiting_rel) to this node that forwarded to me?
+    # Based on that I am forwarding to others.
+    if visiting_rel == 'providers':
+        return ['customers', 'providers', 'peers']
+    return ['customers']
 
-        visited_from[node][visiting_rel] = True
-        next_visit_rels = _get_next_visit_rels(visiting_rel)
-        for rel in next_visit_rels:
+def non_cores_within_multi_reach(
+    cores, isd_non_core_topo, core_sources, censors=set()
+):
+    '''
+        Non-cores reachable from any of the core sources, by a single BFS over
+        (node, arrival relationship) states; censors are never entered.
+
+        Same as the union of non_cores_within_reach over the sources: passing
+        through another source only leads to states that are reached from that
+        source directly, and the sources themselves are cores.
+    '''
+    nodes = list(isd_non_core_topo.keys())
+    node2id = {asn: idx for idx, asn in enumerate(nodes)}
+    visited = bytearray(len(nodes))
+    q = deque()
+
+    def _arrive(node, rel):
+        if node in censors: return
+        idx = node2id.get(node)
+        if idx is None:
+            idx = len(nodes)
+            node2id[node] = idx
+            nodes.append(node)
+            visited.append(0)
+        if visited[idx] & _REL_BITS[rel]: return
+        visited[idx] |= _REL_BITS[rel]
+        q.append((node, rel))
+
+    for source in core_sources:
+        if source not in node2id: continue
+        for rel in ['customers', 'providers', 'peers']:
+            for conn in isd_non_core_topo[source][rel]:
+                _arrive(conn, rel)
+
+    while q:
+        node, visiting_rel = q.popleft()
+        for rel in _get_next_visit_rels(visiting_rel):
             for conn in isd_non_core_topo[node][rel]:
-                if not visited_from[conn][rel]:
-                    visited_from = _traverse(conn, visited_from, rel)
-        return visited_from
-    
-    def _get_within_reach(visited_from):
-        reachable = set([
-            x for x, visited in visited_from.items()
-            if x not in cores and
-            (visited['peers'] or visited['customers'] or visited['providers'])
-        ])
-        return reachable
+                _arrive(conn, rel)
 
-    if core_destination not in isd_non_core_topo.keys(): return set()
-    
-    visited_from = defaultdict(lambda: defaultdict(bool))
-    for rel in ['customers', 'providers', 'peers']:
-        for conn in isd_non_core_topo[core_destination][rel]:
-            visited_from = _traverse(conn, visited_from, rel)
-    return _get_within_reach(visited_from)
+    return set([
+        asn for asn, idx in node2id.items()
+        if visited[idx] and asn not in cores
+    ])
+
+def non_cores_within_reach(
+    cores, isd_non_core_topo, core_destination, censors=set()
+):
+    return non_cores_within_multi_reach(
+        cores, isd_non_core_topo, [core_destination], censors
+    )
 
 # ==============================================================================
 # ================================  ISD  =======================================
 # ==============================================================================
 
-def cores_within_foreign_reach(
-    scion_core_topo, isd_core_topo, as_info, country, censors=set()
-):
+def _get_cores_with_foreign_connection(scion_core_topo, isd_core_topo):
+    isd_cores_set = set(isd_core_topo.keys())
 
     def _has_foreign_connection(asn):
-        isd_cores_set = set(isd_core_topo.keys())
         for conn in scion_core_topo[asn]['cores']:
             if conn not in isd_cores_set:
                 return True
         return False
-    
-    def _get_cores_with_foreign_connection(cores):
-        return set([
-            asn for asn in cores if _has_foreign_connection(asn)
-        ])
-
-    def _get_foreign_reachable_from_cores():
-        core2reachable = defaultdict(set)
-        for core in cores:
-            core_reach = cores_within_reach(isd_core_topo, core, censors)
-            core2reachable[core] = core_reach
-        return core2reachable
-    
-    def _get_core_reach(cores, cores_with_foreign, core2reachable):
-        cores_reach = set()
-        for core in cores:
-            if core in censors: continue
 
-            for core_foreign in cores_with_foreign:
-                if core == core_foreign or core in core2reachable[core_foreign]:
-                    cores_reach.update([core])
-                    break
-        return cores_reach
+    return set([
+        asn for asn in isd_cores_set if _has_foreign_connection(asn)
+    ])
+
+def core_components(isd_core_topo, censors=set()):
+    '''
+        Connected components of the ISD core graph without the censors.
+        Returns: UnionFind over the uncensored cores
+    '''
+    components = UnionFind(
+        core for core in isd_core_topo.keys() if core not in censors
+    )
+    for core in components:
+        for conn in isd_core_topo[core]['cores']:
+            if conn in components: components.union(core, conn)
+    return components
 
-    cores = set(isd_core_topo.keys())
-    cores_with_foreign = _get_cores_with_foreign_connection(cores)
-    core2reachable = _get_foreign_reachable_from_cores()
-    core_reach = _get_core_reach(cores, cores_with_foreign, core2reachable)
-        
-    return core_reach
+def cores_within_foreign_reach(
+    scion_core_topo, isd_core_topo, as_info, country, censors=set()
+):
+    '''
+        Uncensored cores connected (over uncensored cores) to a core with a
+        foreign connection, i.e., in the same component as one.
+    '''
+    cores_with_foreign = _get_cores_with_foreign_connection(
+        scion_core_topo, isd_core_topo
+    )
+    components = core_components(isd_core_topo, censors)
+
+    foreign_components = set([
+        components.find(core) for core in cores_with_foreign
+        if core in components
+    ])
+    return set([
+        core for core in components
+        if components.find(core) in foreign_components
+    ])
 
 def non_cores_within_foreign_reach(
     scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
     censors=set()
 ):
-
-    def _has_foreign_connection(asn):
-        isd_cores_set = set(isd_core_topo.keys())
-        for conn in scion_core_topo[asn]['cores']:
-            if conn not in isd_cores_set:
-                return True
-        return False
-    
-    def _get_cores_with_foreign_connection(cores):
-        return set([
-            asn for asn in cores if _has_foreign_connection(asn)
-        ])
-
-    def _get_foreign_reachable_from_cores():
-        core2reachable = defaultdict(set)
-        for core in cores:
-            core_reach = cores_within_reach(isd_core_topo, core, censors)
-            core2reachable[core] = core_reach
-        return core2reachable
-    
-    def _get_non_core_reach(cores, cores_with_foreign, core2reachable):
-        non_cores_reach = set()
-        for core in cores:
-            if core in censors: continue
-
-            new_nodes = non_cores_within_reach(
-                cores, isd_non_core_topo, core, censors
-            )
-
-            for core_foreign in cores_with_foreign:
-                if core == core_foreign or core in core2reachable[core_foreign]:
-                    non_cores_reach.update(new_nodes)
-                    break
-        return non_cores_reach
-
     cores = set(isd_core_topo.keys())
-    cores_with_foreign = _get_cores_with_foreign_connection(cores)
-    core2reachable = _get_foreign_reachable_from_cores()
+    core_reach = cores_within_foreign_reach(
+        scion_core_topo, isd_core_topo, as_info, country, censors
+    )
 
-    non_cores_reach = _get_non_core_reach(
-        cores, cores_with_foreign, core2reachable
-    ) 
-    return non_cores_reach
+    return non_cores_within_multi_reach(
+        cores, isd_non_core_topo, core_reach, censors
+    )
 
 def nodes_within_foreign_reach(
     scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
     censors=set()
 ):
-    reach_non_core = non_cores_within_foreign_reach(
-        scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
-        censors
-    )
+    # The core components are built once, for the cores and the non-cores
+    cores = set(isd_core_topo.keys())
     reach_core = cores_within_foreign_reach(
         scion_core_topo, isd_core_topo, as_info, country, censors
     )
+    reach_non_core = non_cores_within_multi_reach(
+        cores, isd_non_core_topo, reach_core, censors
+    )
     return reach_non_core.union(reach_core)
 
+def nodes_within_foreign_reach_sweep(
+    scion_core_topo, isd_core_topo, isd_non_core_topo, as_info, country,
+    censors_order
+):
+    '''
+        For nested censor sets, i.e., the first N ASes of censors_order:
+            reach[N] = len(nodes_within_foreign_reach(
+                ..., censors=set(censors_order[:N])
+            ))
+        for all N = 0, ..., len(censors_order), in a single pass.
+
+        Starts with all censors, and removes them in the reverse order: the
+        core components are merged (with their members and whether they have
+        a foreign connection), and the BFS over (node, arrival relationship)
+        states only continues, from the cores that get foreign reach and from
+        the states that were blocked at the removed censor.
+    '''
+    cores = set(isd_core_topo.keys())
+    cores_with_foreign = _get_cores_with_foreign_connection(
+        scion_core_topo, isd_core_topo
+    )
+    isd_nodes = set(isd_non_core_topo.keys())
+
+    # An AS is a censor from its first position on
+    censor_from = dict()
+    for idx, asn in enumerate(censors_order):
+        if asn not in censor_from: censor_from[asn] = idx
+    censors = set(censor_from)
+
+    # BFS over (node, arrival relationship) states
+    node2id = dict()
+    visited = bytearray()
+    blocked = defaultdict(int)
+    q = deque()
+    reached = {'cores': 0, 'non_cores': 0}
+
+    def _arrive(node, rel):
+        if node in censors:
+            blocked[node] |= _REL_BITS[rel]
+            return
+        idx = node2id.get(node)
+        if idx is None:
+            idx = len(node2id)
+            node2id[node] = idx
+            visited.append(0)
+        if visited[idx] & _REL_BITS[rel]: return
+        if not visited[idx] and node not in cores: reached['non_cores'] += 1
+        visited[idx] |= _REL_BITS[rel]
+        q.append((node, rel))
+
+    def _expand():
+        while q:
+            node, visiting_rel = q.popleft()
+            for rel in _get_next_visit_rels(visiting_rel):
+                for conn in isd_non_core_topo[node][rel]:
+                    _arrive(conn, rel)
+
+    def _foreign_reach(core):
+        reached['cores'] += 1
+        if core not in isd_nodes: return
+        for rel in ['customers', 'providers', 'peers']:
+            for conn in isd_non_core_topo[core][rel]:
+                _arrive(conn, rel)
+
+    # Components of uncensored cores
+    components = UnionFind()
+    members, has_foreign = dict(), dict()
+
+    def _add_core(core):
+        components.add(core)
+        members[core] = [core]
+        has_foreign[core] = core in cores_with_foreign
+        if has_foreign[core]: _foreign_reach(core)
+
+        for conn in isd_core_topo[core]['cores']:
+            if conn not in components: continue
+            root1, root2 = components.find(core), components.find(conn)
+            if root1 == root2: continue
+
+            # Members of the other component get foreign reach
+            if has_foreign[root1] != has_foreign[root2]:
+                no_foreign = root2 if has_foreign[root1] else root1
+                for asn in members[no_foreign]:
+                    _foreign_reach(asn)
+
+            root = components.union(root1, root2)
+            merged = root2 if root == root1 else root1
+            members[root].extend(members.pop(merged))
+            has_foreign[root] = has_foreign.pop(merged) or has_foreign[root]
+
+    def _remove_censor(asn):
+        censors.discard(asn)
+        if asn in cores: _add_core(asn)
+        blocked_rels = blocked.pop(asn, 0)
+        for rel, bit in _REL_BITS.items():
+            if blocked_rels & bit: _arrive(asn, rel)
+        _expand()
+
+    for core in isd_core_topo.keys():
+        if core not in censors: _add_core(core)
+    _expand()
+
+    reach = [0] * (len(censors_order) + 1)
+    reach[-1] = reached['cores'] + reached['non_cores']
+    for N in range(len(censors_order), 0, -1):
+        asn = censors_order[N - 1]
+        if censor_from[asn] == N - 1: _remove_censor(asn)
+        reach[N - 1] = reached['cores'] + reached['non_cores']
+    return reach
+
 # ==============================================================================
 # ===============================  CORE  =======================================
 # ==============================================================================
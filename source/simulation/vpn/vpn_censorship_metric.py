@@ -1,16 +1,19 @@
 import argparse
 import logging
 import math
-import os
 import random
 import sys
 import time
 
+from bisect import bisect_right
 from collections import defaultdict
 
+from source.utils import profiling
 from source.utils import utils
 from source.utils import load
-from source.simulation.bgp.countrynet import get_mainland
+from source.utils import telemetry
+from source.utils.routetrees import RoutingTrees
+from source.simulation.bgp.countrynet import load_country_index
 
 DATA_DATE = '20230101.as-rel2'
 
@@ -42,6 +45,10 @@ def _parse_args():
         '--choke_potentials_file',
         default='generated_data/chokepoint_border_mainland/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', default=None,
+        help='Route store file; if given, used instead of the routing files.'
+    )
     parser.add_argument(
         '--save_file', default='generated_data/CRP.VPN.add.results'
     )
@@ -56,9 +63,14 @@ def _parse_args():
         '--vpnmethod', default='MaxMind-AnonG', required=False,
         choices=['MaxMind-AnonG']
     )
+    parser.add_argument(
+        '--vpn_nodes_file', default=None,
+        help='List of VPN nodes (ASes); if given, used instead of vpnmethod\'s.'
+    )
 
     parser.add_argument('--Ns', nargs="+", type=int, required=True)
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _get_potential_censors(choke_potentials_file):
@@ -71,10 +83,11 @@ def _get_potential_censors(choke_potentials_file):
     return list(sorted_cpp.keys())
 
 def _create_censors_by_num(choke_potentials_file):
-    global pot_censors_num
+    global pot_censors_num, censor_rank
 
     potential_censors = _get_potential_censors(choke_potentials_file)
     pot_censors_num = len(potential_censors)
+    censor_rank = {asn: rank for rank, asn in enumerate(potential_censors)}
     censors_by_num = defaultdict(set)
 
     for N in N_CENSORS:
@@ -83,6 +96,10 @@ def _create_censors_by_num(choke_potentials_file):
         censor_num = min(pot_censors_num, N)
         top_censors = potential_censors[:censor_num]
         censors_by_num[N] = set(top_censors)
+
+    # Not enough potential censors: no censors
+    for N in N_CENSORS:
+        if N > pot_censors_num: censors_by_num[N] = set()
     return censors_by_num
 
 def _set_global_vars(args):
@@ -95,109 +112,179 @@ def _set_global_vars(args):
     as_topo = load.load_AS_topology(args.bgp_topo_file)
     
     if dataset == 'CAIDA_HYBRID':
-        as_info = load.load_as_info(args.as_info_caida_hybrid)
-    mainland = get_mainland(as_topo, as_info, country)
+        as_info_file = args.as_info_caida_hybrid
+        as_info = load.load_as_info(as_info_file)
+    mainland = load_country_index(
+        as_topo, as_info, args.bgp_topo_file, as_info_file
+    ).mainland(country)
     non_mainland = [
         asn for asn in as_topo.keys() if not asn in mainland
     ]
     random.shuffle(non_mainland)
 
-    global routing_file_root
-    routing_file_root = args.routing_file_root
-
     global censors_by_num, N_CENSORS
     N_CENSORS = args.Ns
     censors_by_num = _create_censors_by_num(args.choke_potentials_file)
 
-def _routing_topo_of_destination(destination):
-    destination_routing_file = f'{routing_file_root}.D_{destination}.txt'
-    if not os.path.isfile(destination_routing_file):
-        logging.warning(f'File not found: {destination_routing_file}')
-        sys.exit()
-    d, routing_topo = load.load_routing_topo(destination_routing_file)
-    if d != destination: 
-        logging.warning(
-            f'File {destination_routing_file} contains routing info for '
-            'destination {d}, although it should contain routing info for '
-            'destination {destination}.'
-        )
-        sys.exit()
+    global routing_trees
+    routing_trees = RoutingTrees(args.routing_file_root, args.route_store)
 
+def _routing_topo_of_destination(destination):
+    routing_topo = routing_trees.get(destination)
+    if routing_topo is None: sys.exit()
     return routing_topo
 
-def _is_censored(source, destination, routing_topo, censors):
-    curr_node = source
-    while curr_node != destination:
-        if curr_node in censors: return True
-        curr_node = routing_topo[curr_node]
-    return False
-
-def _could_reach(source, destination, censors, routing_topo):
-    if source in censors or destination in censors: return False
-    if len(censors) == 0: return source in routing_topo.keys()
-    if source not in routing_topo.keys(): return False
-    return not _is_censored(source, destination, routing_topo, censors)
-
-def _get_reach_via_vpns(censors, vpn_nodes):
-    # Create map VPN --> Destination
-    vpn_to_dest_list = defaultdict(list)
-    utils.rst_log_counter(counter_max_value=len(non_mainland))
-    for destination in non_mainland:
-        utils.log_counter(modulo=10000, info='dest')
+def _first_censor_ranks(destination, routing_topo, sources):
+    '''
+        The censors for N are the top N potential censors, so a source reaches
+        the destination for all N up to the best (smallest) censor rank on its
+        path (the source and the destination included).
+
+        Returns: ranks[source] = best censor rank on the path of the source,
+            where rank = pot_censors_num means no censor on the path. Sources
+            without a route (or the destination itself) are left out.
+    '''
+    no_censor = pot_censors_num
+    first_rank = {destination: censor_rank.get(destination, no_censor)}
+
+    ranks = dict()
+    for source in sources:
+        if source not in routing_topo.keys(): continue
+
+        path = list()
+        curr_node = source
+        while curr_node not in first_rank:
+            path.append(curr_node)
+            curr_node = routing_topo[curr_node]
+        rank = first_rank[curr_node]
+        for node in reversed(path):
+            rank = min(rank, censor_rank.get(node, no_censor))
+            first_rank[node] = rank
+
+        ranks[source] = first_rank[source]
+    return ranks
+
+def _rank_level(rank):
+    '''
+        Only whether rank >= N matters (for the N in N_CENSORS), hence ranks
+        are kept as levels: the number of thresholds N up to the rank.
+    '''
+    return bisect_right(rank_thresholds, rank)
+
+def _min_level(N):
+    # No censors for N = 0, or if there are not enough of them
+    if N == 0 or N > pot_censors_num: return 0
+    return rank_thresholds.index(N) + 1
+
+def _get_vpn_dest_bitsets(vpn_nodes):
+    '''
+        Destinations reached by the VPN nodes, as bitsets over the AS ids (of
+        as_topo), by the level of the best censor rank on the path:
+            dest_bitsets[vpn_idx][level] = <int bitset>
+    '''
+    bitset_len = (len(as_topo) + 7) // 8
+    dest_bits = [dict() for _ in vpn_nodes]
+    vpn_idxs = {vpn_node: idx for idx, vpn_node in enumerate(vpn_nodes)}
+    for destination in telemetry.track(
+        'destinations', non_mainland, every=10000
+    ):
         routing_topo = _routing_topo_of_destination(destination)
         if routing_topo is None: continue
 
-        for vpn_node in vpn_nodes:
-            reached = _could_reach(
-                vpn_node, destination, censors, routing_topo
-            )
-            if reached:
-                vpn_to_dest_list[vpn_node].append(destination)
-    vpn_to_dest_set = defaultdict(set)
-    for vpn_node, reach_per_vpn in vpn_to_dest_list.items():
-        vpn_to_dest_set[vpn_node] = set(reach_per_vpn)
-                                        
-    # Get reach source --> VPN (--> destination)
+        dest_id = as_topo.asn2id[destination]
+        byte_idx, bit = dest_id >> 3, 1 << (dest_id & 7)
+        ranks = _first_censor_ranks(destination, routing_topo, vpn_nodes)
+        for vpn_node, rank in ranks.items():
+            by_level = dest_bits[vpn_idxs[vpn_node]]
+            level = _rank_level(rank)
+            if level not in by_level: by_level[level] = bytearray(bitset_len)
+            by_level[level][byte_idx] |= bit
+
+    # One bitset at a time (not all of them twice)
+    for by_level in dest_bits:
+        for level, bits in by_level.items():
+            by_level[level] = int.from_bytes(bits, 'little')
+    return dest_bits
+
+def _get_source_vpn_levels(vpn_nodes, sources):
+    '''
+        Levels of the best censor rank on the path of each source (by its
+        position in sources) to each VPN node, plus one (0: no route):
+            source_levels[vpn_idx][source_idx] = level + 1
+    '''
+    source_idxs = {source: idx for idx, source in enumerate(sources)}
+    source_levels = list()
+    vpn_nodes_progress = telemetry.track('vpn_nodes', vpn_nodes, every=500)
+    for vpn_node in vpn_nodes_progress:
+        levels = bytearray(len(sources))
+        source_levels.append(levels)
+        routing_topo = _routing_topo_of_destination(vpn_node)
+        if routing_topo is None: continue
+
+        ranks = _first_censor_ranks(vpn_node, routing_topo, sources)
+        for source, rank in ranks.items():
+            levels[source_idxs[source]] = _rank_level(rank) + 1
+    return source_levels
+
+def _get_reach_via_vpns(N, dest_bitsets, source_levels):
+    min_level = _min_level(N)
+
+    # Destinations reached by each VPN node
+    vpn_dests = list()
+    for by_level in dest_bitsets:
+        dests = 0
+        for level, bitset in by_level.items():
+            if level >= min_level: dests |= bitset
+        vpn_dests.append(dests)
+
+    # Sources (by position) that reach each VPN node: 1 if reached, else 0
+    reached = bytes(
+        1 if level > min_level else 0 for level in range(len(N_CENSORS) + 2)
+    ).ljust(256, b'\0')
+    vpn_reached = [levels.translate(reached) for levels in source_levels]
+
+    # Get reach source --> VPN (--> destination); sources that reach the same
+    #   VPN nodes reach the same destinations.
     total_reach = 0
-    utils.rst_log_counter(counter_max_value=len(mainland))
-    for source in mainland:
-        utils.log_counter(modulo=500, info='source')
-        
-        source_reach = set()
-        for vpn_node in vpn_nodes:
-            routing_topo = _routing_topo_of_destination(vpn_node)
-            if routing_topo is None: continue
-
-            reached = _could_reach(
-                source, vpn_node, censors, routing_topo
-            )
-            if reached:
-                source_reach = source_reach.union(vpn_to_dest_set[vpn_node])
-        total_reach += len(source_reach)
+    reach_by_vpns = dict()
+    for reached_vpns in zip(*vpn_reached):
+        if reached_vpns not in reach_by_vpns:
+            source_reach = 0
+            for vpn_idx, is_reached in enumerate(reached_vpns):
+                if is_reached: source_reach |= vpn_dests[vpn_idx]
+            reach_by_vpns[reached_vpns] = source_reach.bit_count()
+        total_reach += reach_by_vpns[reached_vpns]
 
     return total_reach
 
 def _get_all_vpn_results(vpn_nodes):
+    global rank_thresholds
+    rank_thresholds = sorted(set(
+        N for N in N_CENSORS if 0 < N <= pot_censors_num
+    ))
+    dest_bitsets = _get_vpn_dest_bitsets(vpn_nodes)
+    source_levels = _get_source_vpn_levels(vpn_nodes, list(mainland))
+
     data = defaultdict(int)
     for N in N_CENSORS:
         logging.info(f'--> Censor num: {N}')
-        censors = censors_by_num[N]
-        data[N] = _get_reach_via_vpns(censors, vpn_nodes)
+        data[N] = _get_reach_via_vpns(N, dest_bitsets, source_levels)
     return data
 
-def _get_vpn_nodes(vpnmethod):
-    if vpnmethod == 'MaxMind-AnonG':
+def _get_vpn_nodes(vpnmethod, vpn_nodes_file=None):
+    if vpn_nodes_file is None and vpnmethod == 'MaxMind-AnonG':
         vpn_nodes_file = 'data/maxmind/anon_asns.txt'
     vpn_nodes = load.load_AS_list(vpn_nodes_file)
 
     vpn_nodes = list([
-        vpn_node for vpn_node in vpn_nodes if vpn_node in as_topo.keys()
+        vpn_node for vpn_node in dict.fromkeys(vpn_nodes)
+        if vpn_node in as_topo.keys()
     ])
     random.shuffle(vpn_nodes)
     return vpn_nodes
 
 def _calc_save_vpn_results(args, info_plus):
-    vpn_nodes = _get_vpn_nodes(args.vpnmethod)
+    vpn_nodes = _get_vpn_nodes(args.vpnmethod, args.vpn_nodes_file)
     data = _get_all_vpn_results(vpn_nodes)
 
     # Save to a file
@@ -233,8 +320,11 @@ def _calc_save_vpn_results(args, info_plus):
         for N, reach in data.items():
             f.writelines(f'{N}|{reach}\n')
 
+    telemetry.write_summary(file_name.removesuffix('.txt'))
+
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('vpn_censorship_metric', args)
     _set_global_vars(args)
 
     info_plus = '_'.join([str(n) for n in N_CENSORS])
@@ -243,8 +333,13 @@ if __name__ == '__main__':
         f'CRP.VPN.results.{country}.{info_plus}',
         log_dir=f'logs/CRP.VPN.add.{vpnmethod}.{dataset}'
     )
+    telemetry.enable_telemetry(
+        f'CRP.VPN.results.{country}.{info_plus}',
+        log_dir=f'logs/CRP.VPN.add.{vpnmethod}.{dataset}'
+    )
 
     start = time.time()   
     _calc_save_vpn_results(args, info_plus)
+    routing_trees.log_stats()
     end = time.time()
     utils.log_elapsed_time(end-start)
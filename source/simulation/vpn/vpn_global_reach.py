@@ -1,13 +1,14 @@
 import argparse
-import logging
-import os
 import random
 import time
 
 from collections import defaultdict
 
+from source.utils import profiling
 from source.utils import utils
 from source.utils import load
+from source.utils import telemetry
+from source.utils.routetrees import RoutingTrees
 
 def _parse_args():
     parser = argparse.ArgumentParser()
@@ -31,6 +32,10 @@ def _parse_args():
         '--routing_file_root',
         default='generated_data/bgp_routes/20230101.as-rel2'
     )
+    parser.add_argument(
+        '--route_store', default=None,
+        help='Route store file; if given, used instead of the routing files.'
+    )
     parser.add_argument(
         '--save_file',
         default='generated_data/VPN.global.reach.results/20230101.as-rel2'
@@ -45,6 +50,7 @@ def _parse_args():
         '--vpn_nodes_file', default='data/maxmind/anon_asns.txt'
     )
 
+    profiling.add_profile_args(parser)
     return parser.parse_args()
 
 def _set_global_vars(args):
@@ -67,24 +73,14 @@ def _set_global_vars(args):
     ])
     random.shuffle(vpn_nodes)
 
+    global routing_trees
+    routing_trees = RoutingTrees(args.routing_file_root, args.route_store)
+
 def _country_origin(asn):
     return as_info[asn][0]
 
-def _routing_topo_of_destination(destination, routing_file_root):
-    destination_routing_file = f'{routing_file_root}.D_{destination}.txt'
-    if not os.path.isfile(destination_routing_file):
-        logging.warning(f'File not found: {destination_routing_file}')
-        return None
-    d, routing_topo = load.load_routing_topo(destination_routing_file)
-    if d != destination: 
-        logging.warning(
-            f'File {destination_routing_file} contains routing info for '
-            'destination {d}, although it should contain routing info for '
-            'destination {destination}.'
-        )
-        return None
-
-    return routing_topo
+def _routing_topo_of_destination(destination):
+    return routing_trees.get(destination)
 
 def _is_intercepted(source, destination, routing_topo, hegemons):
     curr_node = source
@@ -99,23 +95,26 @@ def _could_reach(source, destination, hegemons, dest_routing_topo):
     if source not in dest_routing_topo.keys(): return False
     return not _is_intercepted(source, destination, dest_routing_topo, hegemons)
 
-def _global_reach_potentials(hegemons, rfile_root):
+def _global_reach_potentials(hegemons):
     total_path_cnt = 0
     total_not_intercepted = 0
 
     all_asns = list(as_topo.keys())
     random.shuffle(all_asns)
 
+    # Trees of VPN nodes are needed for every source
+    routing_trees.pin(vpn_nodes)
+
     # Create map VPN --> Destination
     vpn_to_dest_list = defaultdict(list)
     vpn_to_dest_not_intercept_list = defaultdict(list)
 
-    utils.rst_log_counter(counter_max_value=len(all_asns))
-    for destination in all_asns:
+    for destination in telemetry.track(
+        'destinations', all_asns, every=10000
+    ):
         if _country_origin(destination) in hegemons: continue
 
-        utils.log_counter(modulo=10000, info='dest')
-        routing_topo = _routing_topo_of_destination(destination, rfile_root)
+        routing_topo = _routing_topo_of_destination(destination)
         if routing_topo is None: continue
 
         for vpn_node in vpn_nodes:
@@ -138,16 +137,13 @@ def _global_reach_potentials(hegemons, rfile_root):
         vpn_to_dest_not_intercept_set[vpn_node] = set(reach_per_vpn)
                                         
     # Get reach source --> VPN (--> destination)
-    utils.rst_log_counter(counter_max_value=len(all_asns))
-    for source in all_asns:
+    for source in telemetry.track('sources', all_asns, every=10000):
         if _country_origin(source) in hegemons: continue
 
-        utils.log_counter(modulo=10000, info='source')
-        
         source_reach = set()
         source_reach_not_intercept = set()
         for vpn_node in vpn_nodes:
-            routing_topo = _routing_topo_of_destination(vpn_node, rfile_root)
+            routing_topo = _routing_topo_of_destination(vpn_node)
             if routing_topo is None: continue
 
             # Whom could this source reach?
@@ -168,9 +164,9 @@ def _global_reach_potentials(hegemons, rfile_root):
 
     return total_path_cnt, total_not_intercepted
 
-def _calc_save_global_reach_potentials(rfr, hegemon_group_name, save_file):
+def _calc_save_global_reach_potentials(hegemon_group_name, save_file):
     hegs = set(utils.HEG_GROUPS[hegemon_group_name])
-    total_paths, free_paths = _global_reach_potentials(hegs, rfr)
+    total_paths, free_paths = _global_reach_potentials(hegs)
 
     # Save to a file
     utils.check_make_save_file_dir(args.save_file)
@@ -185,17 +181,23 @@ def _calc_save_global_reach_potentials(rfr, hegemon_group_name, save_file):
         f.writelines(f'{hegemon_group_name}|{",".join(hegs)}\n')
         f.writelines(f'{hegemon_group_name}|{total_paths}|{free_paths}\n')
 
+    telemetry.write_summary(file_name.removesuffix('.txt'))
+
 if __name__ == '__main__':
     args = _parse_args()
+    profiling.enable_profiling('vpn_global_reach', args)
     _set_global_vars(args)
     utils.enable_logger(
         f'global.reachability.{args.hegemons.replace(" ", "-")}',
         log_dir=f'logs/VPN.global.reach.{dataset}'
     )
+    telemetry.enable_telemetry(
+        f'global.reachability.{args.hegemons.replace(" ", "-")}',
+        log_dir=f'logs/VPN.global.reach.{dataset}'
+    )
 
     start = time.time()   
-    _calc_save_global_reach_potentials(
-        args.routing_file_root, args.hegemons, args.save_file
-    )
+    _calc_save_global_reach_potentials(args.hegemons, args.save_file)
+    routing_trees.log_stats()
     end = time.time()
     utils.log_elapsed_time(end - start)
@@ -0,0 +1,169 @@
+from array import array
+from itertools import chain, count
+
+AS_RELS = ('providers', 'customers', 'peers')
+
+class ASGraph:
+    '''
+        Compact AS topology. ASNs are interned to dense int32 ids (in the order
+        of their first appearance), and each relationship is kept in the CSR
+        format, i.e., as an offset and a neighbour array:
+            neighbours of id i: nbrs[rel][offsets[rel][i]:offsets[rel][i + 1]]
+
+        Hot loops should use the ids and the arrays directly. For existing
+        callers the graph also behaves as a (read-only) dict:
+            topology[ASN] = {'customers':[], 'peers':[], 'providers':[]}
+    '''
+
+    def __init__(self, asns, offsets, nbrs, rels=AS_RELS):
+        self.asns = asns
+        self.asn2id = {asn: idx for idx, asn in enumerate(asns)}
+        self.rels = rels
+        self.offsets = offsets
+        self.nbrs = nbrs
+
+    def __len__(self):
+        return len(self.asns)
+
+    def __iter__(self):
+        return iter(self.asns)
+
+    def __contains__(self, asn):
+        return asn in self.asn2id
+
+    def __getitem__(self, asn):
+        return _ASRelations(self, self.asn2id.get(asn))
+
+    def keys(self):
+        return self.asn2id.keys()
+
+    def values(self):
+        return (_ASRelations(self, idx) for idx in range(len(self.asns)))
+
+    def items(self):
+        return (
+            (asn, _ASRelations(self, idx)) for idx, asn in enumerate(self.asns)
+        )
+
+    def get(self, asn, default=None):
+        if asn not in self.asn2id: return default
+        return self[asn]
+
+    def neighbours(self, rel, idx):
+        off = self.offsets[rel]
+        return self.nbrs[rel][off[idx]:off[idx + 1]]
+
+    def all_neighbours(self, idx):
+        conns = list()
+        for rel in self.rels:
+            conns.extend(self.neighbours(rel, idx))
+        return conns
+
+    def degree(self, idx):
+        return sum(
+            self.offsets[rel][idx + 1] - self.offsets[rel][idx]
+            for rel in self.rels
+        )
+
+class _ASRelations:
+    '''
+        Dict-like view of the relationships of one AS:
+            {'customers':[], 'peers':[], 'providers':[]}
+        As with the defaultdict topology, unknown ASes and relationships are
+        empty.
+    '''
+
+    def __init__(self, graph, idx):
+        self._graph = graph
+        self._idx = idx
+
+    def __getitem__(self, rel):
+        graph = self._graph
+        if self._idx is None or rel not in graph.offsets: return list()
+        asns = graph.asns
+        return [asns[conn] for conn in graph.neighbours(rel, self._idx)]
+
+    def __contains__(self, rel):
+        return rel in self._graph.rels
+
+    def __iter__(self):
+        return iter(self._graph.rels)
+
+    def __len__(self):
+        return len(self._graph.rels)
+
+    def keys(self):
+        return self._graph.rels
+
+    def items(self):
+        return ((rel, self[rel]) for rel in self._graph.rels)
+
+class ASGraphBuilder:
+    '''
+        Collects (directed) relationships between ASNs and builds the ASGraph.
+        The order of neighbours is kept, i.e., it is the order of add() calls.
+    '''
+
+    def __init__(self, rels=AS_RELS):
+        self.rels = rels
+        self.asns = list()
+        self.asn2id = dict()
+        self.src = {rel: array('i') for rel in rels}
+        self.dst = {rel: array('i') for rel in rels}
+
+    def intern(self, asn):
+        idx = self.asn2id.get(asn)
+        if idx is None:
+            idx = len(self.asns)
+            self.asn2id[asn] = idx
+            self.asns.append(asn)
+        return idx
+
+    def add(self, rel, asn, conn):
+        self.src[rel].append(self.intern(asn))
+        self.dst[rel].append(self.intern(conn))
+
+    def intern_columns(self, *columns):
+        '''
+            Interns the ASNs of the columns row by row, i.e., in the order of
+            add() calls for the rows. Returns the ids (arrays) by column.
+        '''
+        asn2id = self.asn2id
+        new_asns = [
+            asn for asn in dict.fromkeys(chain.from_iterable(zip(*columns)))
+            if asn not in asn2id
+        ]
+        asn2id.update(zip(new_asns, count(len(self.asns))))
+        self.asns.extend(new_asns)
+        return [array('i', map(asn2id.__getitem__, col)) for col in columns]
+
+    def extend(self, rel, asn_ids, conn_ids):
+        '''
+            Bulk add() by ids (see intern_columns).
+        '''
+        self.src[rel].extend(asn_ids)
+        self.dst[rel].extend(conn_ids)
+
+    def build(self):
+        asn_num = len(self.asns)
+        offsets, nbrs = dict(), dict()
+        for rel in self.rels:
+            offsets[rel], nbrs[rel] = _to_csr(
+                asn_num, self.src[rel], self.dst[rel]
+            )
+        return ASGraph(self.asns, offsets, nbrs, self.rels)
+
+def _to_csr(node_num, src, dst):
+    # Counting sort by source, stable w.r.t. the order of the edges
+    off = array('i', bytes(4 * (node_num + 1)))
+    for s in src:
+        off[s + 1] += 1
+    for idx in range(node_num):
+        off[idx + 1] += off[idx]
+
+    pos = array('i', off)
+    nbr = array('i', bytes(4 * len(dst)))
+    for s, d in zip(src, dst):
+        nbr[pos[s]] = d
+        pos[s] += 1
+    return off, nbr
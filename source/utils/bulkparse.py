@@ -0,0 +1,192 @@
+import bz2
+import gzip
+import lzma
+import os
+import queue
+import re
+import threading
+import zlib
+
+from itertools import repeat
+
+# Bulk parsing of the text inputs: the file is read as bytes in chunks of
+#   whole lines, each chunk is decoded at once, and the fields of all of its
+#   lines are split at once (one join and one split). Python-level work per
+#   line is avoided, except for the lines of irregular files.
+#
+# As in the line-by-line loaders, lines are stripped, and comment lines
+#   (starting with '#') and empty lines are skipped.
+#
+# Compressed inputs (.bz2, .gz, .xz, as published by CAIDA) are decompressed
+#   as a stream, in a background thread, at most QUEUE_CHUNKS chunks ahead of
+#   the parsing. If a file is missing, its compressed version is read instead
+#   (e.g., 20230101.as-rel2.txt.bz2 for 20230101.as-rel2.txt).
+
+CHUNK_SIZE = 1 << 18
+QUEUE_CHUNKS = 4
+
+COMPRESSED_OPENERS = {'.bz2': bz2.open, '.gz': gzip.open, '.xz': lzma.open}
+DECOMPRESSORS = {
+    '.bz2': bz2.BZ2Decompressor,
+    '.gz': lambda: zlib.decompressobj(wbits=zlib.MAX_WBITS | 16),
+    '.xz': lzma.LZMADecompressor,
+}
+
+_COMMENT_LINES = re.compile(r'^[ \t]*#[^\n]*(?:\n|$)', re.M)
+_COMMENT_BLOCKS = re.compile(r'(?:^[ \t]*#[^\n]*(?:\n|$))+', re.M)
+
+def input_path(file_name):
+    '''
+        The file, or its compressed version if only that one exists.
+    '''
+    if os.path.exists(file_name): return file_name
+    for ext in COMPRESSED_OPENERS:
+        if os.path.exists(file_name + ext): return file_name + ext
+    return file_name
+
+def open_input(file_name):
+    '''
+        Opens the (possibly compressed) file for reading, in binary mode.
+    '''
+    path = input_path(file_name)
+    opener = COMPRESSED_OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rb')
+
+def _decompress_chunks(file_name, chunk_size):
+    '''
+        Yields the decompressed data, of each compressed chunk at once (the
+        decompressors release the GIL for the whole chunk). Concatenated
+        streams (e.g., of pbzip2) are decompressed one after another.
+    '''
+    new_decompressor = DECOMPRESSORS[os.path.splitext(file_name)[1]]
+    decompressor, in_stream = new_decompressor(), False
+    with open(file_name, 'rb') as f:
+        for data in iter(lambda: f.read(chunk_size), b''):
+            while data:
+                in_stream = True
+                out = decompressor.decompress(data)
+                if out: yield out
+                if not decompressor.eof: break
+                data = decompressor.unused_data
+                decompressor, in_stream = new_decompressor(), False
+    if in_stream:
+        raise EOFError(f'{file_name}: compressed file ended before the '
+                       'end-of-stream marker was reached')
+
+def _read_ahead(file_name, chunk_size):
+    '''
+        Yields the decompressed chunks of a compressed file, decompressed in a
+        background thread.
+    '''
+    chunks = queue.Queue(maxsize=QUEUE_CHUNKS)
+    stop = threading.Event()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress():
+        try:
+            for data in _decompress_chunks(file_name, chunk_size):
+                if not _put(data): return
+        except Exception as e:
+            _put(e)
+        _put(None)
+
+    thread = threading.Thread(target=_decompress, daemon=True)
+    thread.start()
+    try:
+        while True:
+            data = chunks.get()
+            if data is None: return
+            if isinstance(data, Exception): raise data
+            yield data
+    finally:
+        stop.set()
+        thread.join()
+
+def _read_raw(file_name, chunk_size):
+    with open_input(file_name) as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+def read_chunks(file_name, chunk_size=CHUNK_SIZE):
+    '''
+        Yields the text of the file in chunks of whole lines.
+    '''
+    path = input_path(file_name)
+    if os.path.splitext(path)[1] in COMPRESSED_OPENERS:
+        raw_chunks = _read_ahead(path, chunk_size)
+    else:
+        raw_chunks = _read_raw(path, chunk_size)
+
+    rest = b''
+    for data in raw_chunks:
+        data = rest + data
+        cut = data.rfind(b'\n') + 1
+        rest = data[cut:]
+        if cut: yield data[:cut].decode()
+    if rest: yield rest.decode()
+
+def data_lines(text):
+    '''
+        Stripped lines of the text, without comments and empty lines.
+    '''
+    if '\r' in text: text = text.replace('\r', '')
+    if '#' in text:
+        # Typically, only the header (at the start of the file)
+        header = _COMMENT_BLOCKS.match(text)
+        if header: text = text[header.end():]
+        if '#' in text: text = _COMMENT_LINES.sub('', text)
+    lines = text.split('\n')
+    if ' ' in text or '\t' in text: lines = map(str.strip, lines)
+    return list(filter(None, lines))
+
+def split_columns(lines, field_num, sep='|'):
+    '''
+        The first field_num fields of the lines, by columns:
+            columns[i] = [<i-th field of line 1>, ...]
+        Missing fields (of shorter lines) are empty strings.
+    '''
+    if not lines: return [list() for _ in range(field_num)]
+
+    # All lines with the same number of fields (typical): by slicing
+    seps = set(map(str.count, lines, repeat(sep)))
+    if len(seps) == 1 and seps.pop() + 1 >= field_num:
+        line_fields = lines[0].count(sep) + 1
+        fields = sep.join(lines).split(sep)
+        return [fields[i::line_fields] for i in range(field_num)]
+
+    # Lines with different numbers of fields
+    rows = [line.split(sep, field_num) for line in lines]
+    return [
+        [row[i] if i < len(row) else '' for row in rows]
+        for i in range(field_num)
+    ]
+
+def iter_columns(file_name, field_num, sep='|'):
+    '''
+        Yields the columns (see split_columns) of the data lines, by chunks.
+    '''
+    for text in read_chunks(file_name):
+        lines = data_lines(text)
+        if lines: yield split_columns(lines, field_num, sep)
+
+def read_sections(file_name):
+    '''
+        Multi-section files (e.g., CRP results): sections are the groups of
+        data lines separated by comment blocks.
+        Returns: sections = [[line, ...], ...]
+    '''
+    text = ''.join(read_chunks(file_name))
+    if '\r' in text: text = text.replace('\r', '')
+
+    sections = list()
+    for part in _COMMENT_BLOCKS.split(text):
+        lines = data_lines(part)
+        if lines: sections.append(lines)
+    return sections
@@ -1,6 +1,23 @@
 import json
+import logging
+import os
 
+from array import array
 from collections import defaultdict
+from hashlib import sha256
+from itertools import chain, compress, repeat
+
+from source.utils import bulkparse
+from source.utils import profiling
+from source.utils.asgraph import AS_RELS, ASGraph, ASGraphBuilder
+from source.utils.snapshot import Snapshot, write_snapshot
+
+# Parsed inputs are cached as binary snapshots, keyed by the content hash of
+#   the source file. Set the directory to '' to disable the cache.
+SNAPSHOT_DIR = os.environ.get('CENS_SNAPSHOT_DIR', 'generated_data/snapshots')
+SNAPSHOT_VERSION = 1
+
+SCION_CORE_RELS = ('cores',)
 
 def load_clean_CAIDA_data(topo_file, as_org_file):
 
@@ -16,29 +33,41 @@ def load_clean_CAIDA_data(topo_file, as_org_file):
     as_info = clean_info_dataset(as_topo, as_info)
     return as_topo, as_info, org_info
 
-def load_AS_topology(topology_file):
+@profiling.stage
+def load_AS_topology(topology_file, snapshot=True):
     '''
         File contains provider2customer & peer2peer relationships. Format:
             <provider-as>|<customer-as>|-1|<source> OR
             <peer-as>|<peer-as>|0|<source>
-        The return dict:
+        The return graph (see ASGraph), also usable as a dict:
             topology[ASN] = {'customers':[], 'peers':[], 'providers':[]}
     '''
-    topology = defaultdict(lambda: defaultdict(list))
-
-    with open(topology_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                arr = line.strip().split('|')
-                asn1, asn2, rel_type = arr[0], arr[1], int(arr[2])
-
-                if rel_type == -1:
-                    topology[asn1]['customers'].append(asn2)
-                    topology[asn2]['providers'].append(asn1)
-                else:
-                    topology[asn1]['peers'].append(asn2)
-                    topology[asn2]['peers'].append(asn1)
-    return topology
+    if snapshot:
+        return _load_snapshot_cached(
+            topology_file, 'as-topo', load_AS_topology,
+            _graph_to_snapshot, _graph_from_snapshot
+        )
+
+    builder = ASGraphBuilder(AS_RELS)
+
+    for asns1, asns2, rel_types in bulkparse.iter_columns(topology_file, 3):
+        ids1, ids2 = builder.intern_columns(asns1, asns2)
+
+        # Links in the order of the file (peer links in both directions)
+        is_p2c = list(map((-1).__eq__, map(int, rel_types)))
+        is_p2p = [not p2c for p2c in is_p2c]
+        p2c1, p2c2 = list(compress(ids1, is_p2c)), list(compress(ids2, is_p2c))
+        p2p1, p2p2 = list(compress(ids1, is_p2p)), list(compress(ids2, is_p2p))
+
+        builder.extend('customers', p2c1, p2c2)
+        builder.extend('providers', p2c2, p2c1)
+        builder.extend(
+            'peers', _interleave(p2p1, p2p2), _interleave(p2p2, p2p1)
+        )
+    return builder.build()
+
+def _interleave(first, second):
+    return chain.from_iterable(zip(first, second))
 
 def load_ORG_AS_info(as_org_info_file):
     '''
@@ -55,28 +84,24 @@ def load_ORG_AS_info(as_org_info_file):
     org_info = defaultdict(lambda: defaultdict(str))
     as_info  = defaultdict(lambda: defaultdict(str))
 
-    orgs_parsed = False
-    orgs_parsing = False
-
-    with open(as_org_info_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                if not orgs_parsed: orgs_parsing = True
-
-                # Parse either first part (orgs) or second part (ASes)
-                arr = line.strip().split('|')
-                if not orgs_parsed:
-                    org_id, _, org_name, c = arr[0], arr[1], arr[2], arr[3]
-                    org_info[org_id]['org_name'] = org_name
-                    org_info[org_id]['country'] = c
-                else:
-                    asn, _, asn_name, org_id = arr[0], arr[1], arr[2], arr[3]
-                    as_info[asn]['as_name'] = asn_name
-                    as_info[asn]['org_id'] = org_id
-            else:
-                if orgs_parsing: orgs_parsed = True
+    # First part (orgs), and all other parts (ASes)
+    sections = bulkparse.read_sections(as_org_info_file) or [list()]
+    org_ids, _, org_names, org_countries = bulkparse.split_columns(
+        sections[0], 4
+    )
+    for org_id, org_name, c in zip(org_ids, org_names, org_countries):
+        org_info[org_id]['org_name'] = org_name
+        org_info[org_id]['country'] = c
+
+    asns, _, asn_names, asn_org_ids = bulkparse.split_columns(
+        list(chain.from_iterable(sections[1:])), 4
+    )
+    for asn, asn_name, org_id in zip(asns, asn_names, asn_org_ids):
+        as_info[asn]['as_name'] = asn_name
+        as_info[asn]['org_id'] = org_id
     return org_info, as_info 
 
+@profiling.stage
 def load_routing_topo(topo_file):
     '''
         The file should contain the routing info (e.g. obtained by the BGP
@@ -92,25 +117,13 @@ def load_routing_topo(topo_file):
             <routing_info>
             ...
     '''
-    routing_topo = defaultdict(str)
-
-    destination_parsed = False
-    destination_parsing = False
-    with open(topo_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                if not destination_parsed: destination_parsing = True
-
-                # Parse either first part (dest) or second part (routing info)
-                if not destination_parsed:
-                    destination = line.strip()
-                else:
-                    arr = line.strip().split('|')
-                    asn, next_hop = arr[0], arr[1]
-                    routing_topo[asn] = next_hop
-            else:
-                if destination_parsing: destination_parsed = True
-    return destination, routing_topo
+    # First part (dest), and all other parts (routing info)
+    sections = bulkparse.read_sections(topo_file)
+    destination = sections[0][-1]
+    asns, next_hops = bulkparse.split_columns(
+        list(chain.from_iterable(sections[1:])), 2
+    )
+    return destination, defaultdict(str, zip(asns, next_hops))
 
 def load_RIPE_geo_address(geo_address_file):
     '''
@@ -129,13 +142,11 @@ def load_RIPE_geo_address(geo_address_file):
     '''
     as_info = defaultdict()
 
-    with open(geo_address_file) as f:
-        for line in f:
-            if line.strip() == '': continue
-            dict_info = json.loads(line.strip())
-            asn = dict_info['asn']
-            del dict_info['asn']
-            as_info[asn] = dict_info
+    # JSON lines, decoded as a single JSON array per chunk
+    for text in bulkparse.read_chunks(geo_address_file):
+        lines = list(filter(None, map(str.strip, text.split('\n'))))
+        for dict_info in json.loads(f'[{",".join(lines)}]'):
+            as_info[dict_info.pop('asn')] = dict_info
 
     return as_info
 
@@ -177,67 +188,62 @@ def load_choke_potentials(chokepoint_file):
             # Border_ASN|intercepted_outflow_cnt
             ...
     '''
-    cpp = defaultdict(int)
-
-    country_parsed = False
-    country_parsing = False
-    with open(chokepoint_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                if not country_parsed: country_parsing = True
-                arr = line.strip().split('|')
-
-                # Parse either first part (country) or second part (cpp info)
-                if not country_parsed:
-                    country = arr[0]
-                    total_cnt_outflow = int(arr[1])
-                else:
-                    border_as = arr[0]
-                    cpp[border_as] = int(arr[1])
-            else:
-                if country_parsing: country_parsed = True
-    return country, total_cnt_outflow, cpp
-
-def load_SCION_core_topo_no_rels(scion_core_topo_file):
+    # First part (country), and all other parts (cpp info)
+    sections = bulkparse.read_sections(chokepoint_file)
+    country, total_cnt_outflow = sections[0][-1].split('|')[:2]
+    border_ases, cnts = bulkparse.split_columns(
+        list(chain.from_iterable(sections[1:])), 2
+    )
+    cpp = defaultdict(int, zip(border_ases, map(int, cnts)))
+    return country, int(total_cnt_outflow), cpp
+
+def load_SCION_core_topo_no_rels(scion_core_topo_file, snapshot=True):
     '''
         The file contains info about links between core ASes.
         Format:
             core_ASN|core_ASN|<optional: link type>        
-        Return: a dict
+        Return: a graph (see ASGraph), also usable as a dict
             scion_core_topo[ASN]= {'cores':[]}
     '''
-    scion_core_topo = defaultdict(lambda: defaultdict(list))
+    if snapshot:
+        return _load_snapshot_cached(
+            scion_core_topo_file, 'scion-core-topo',
+            load_SCION_core_topo_no_rels,
+            _graph_to_snapshot, _graph_from_snapshot
+        )
 
-    with open(scion_core_topo_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                arr = line.strip().split('|')
-                asn1, asn2 = arr[0], arr[1]
+    builder = ASGraphBuilder(SCION_CORE_RELS)
 
-                scion_core_topo[asn1]['cores'].append(asn2)
-                scion_core_topo[asn2]['cores'].append(asn1)
+    for asns1, asns2 in bulkparse.iter_columns(scion_core_topo_file, 2):
+        ids1, ids2 = builder.intern_columns(asns1, asns2)
+        builder.extend(
+            'cores', _interleave(ids1, ids2), _interleave(ids2, ids1)
+        )
 
-    return scion_core_topo
+    return builder.build()
 
-def load_customer_cone(file_name):
+def load_customer_cone(file_name, snapshot=True):
     '''
         The file customer cone info. ASes are sorted by their customer cone.
         Format: idx|ASN|customer_cone
         The return dict:
             dict[ASN] = <customer_cone>
     '''
+    if snapshot:
+        return _load_snapshot_cached(
+            file_name, 'customer-cone', load_customer_cone,
+            _cones_to_snapshot, _cones_from_snapshot
+        )
+
     customer_cone = defaultdict(int)
 
-    for line in open(file_name):
-        if not line.strip().startswith("#"):
-            arr = line.strip().split('|')
-            _, asn, cc = arr[0], arr[1], int(arr[2])
-            customer_cone[asn] = cc
+    for _, asns, cones in bulkparse.iter_columns(file_name, 3):
+        customer_cone.update(zip(asns, map(int, cones)))
     return customer_cone
 
 def load_from_json(json_file):
     as_per_country = defaultdict()
-    with open(json_file, 'r') as f:
+    with bulkparse.open_input(json_file) as f:
         as_per_country = json.load(f)
     return as_per_country
 
@@ -263,30 +269,21 @@ def load_bgp_crp_results(bgp_results_file):
             censor_num|total_reach_outflow_path
     '''
     censors_by_num = defaultdict(set)
-    results_by_num = defaultdict(int)
-
-    part_parsing = 1
-    comment_parsing = True
-    with open(bgp_results_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                comment_parsing = False
-
-                if part_parsing == 1:
-                    country = line.strip()
-                elif part_parsing == 2:
-                    arr = line.strip().split('|')
-                    if len(arr) == 1: total_potential_censors = int(arr[0])
-                    else:
-                        censors = arr[1].strip().split(',')
-                        censors_by_num[int(arr[0])] = set(censors)
-                else:
-                    arr = line.strip().split('|')
-                    results_by_num[int(arr[0])] = int(arr[1])
-            else:
-                if not comment_parsing:
-                    part_parsing += 1
-                    comment_parsing = True
+
+    # Parts: country, censors, and results (all other parts)
+    sections = bulkparse.read_sections(bgp_results_file)
+    country = sections[0][-1]
+    for line in sections[1]:
+        arr = line.split('|')
+        if len(arr) == 1: total_potential_censors = int(arr[0])
+        else:
+            censors = arr[1].strip().split(',')
+            censors_by_num[int(arr[0])] = set(censors)
+
+    Ns, results = bulkparse.split_columns(
+        list(chain.from_iterable(sections[2:])), 2
+    )
+    results_by_num = defaultdict(int, zip(map(int, Ns), map(int, results)))
     return country, censors_by_num, total_potential_censors, results_by_num
 
 def load_hegemony_info(hegemony_file):
@@ -305,29 +302,20 @@ def load_hegemony_info(hegemony_file):
             # Country|intercepted_path_cnt
             ...
     '''
-    heg = defaultdict(int)
-
-    country_parsed = False
-    country_parsing = False
-    with open(hegemony_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                if not country_parsed: country_parsing = True
-                arr = line.strip().split('|')
-
-                # Parse either first part (country) or second part (hegemony info)
-                if not country_parsed:
-                    country = arr[0]
-                    total_path_cnt = int(arr[1])
-                    interception_free = int(arr[2]) if arr[2] != "None" else None
-                else:
-                    foreign_country = arr[0]
-                    heg[foreign_country] = int(arr[1])
-            else:
-                if country_parsing: country_parsed = True
+    # First part (country), and all other parts (hegemony info)
+    sections = bulkparse.read_sections(hegemony_file)
+    arr = sections[0][-1].split('|')
+    country = arr[0]
+    total_path_cnt = int(arr[1])
+    interception_free = int(arr[2]) if arr[2] != "None" else None
+
+    foreign_countries, cnts = bulkparse.split_columns(
+        list(chain.from_iterable(sections[1:])), 2
+    )
+    heg = defaultdict(int, zip(foreign_countries, map(int, cnts)))
     return country, total_path_cnt, interception_free, heg
 
-def load_as_info(filename):
+def load_as_info(filename, snapshot=True):
     '''
         File contains info about ASes obtained from Team Cymru or CAIDA (with
         minor post-processing).
@@ -335,14 +323,19 @@ def load_as_info(filename):
         The return dict:
             as_info[ASN] = alpha2_country_code_1, ..., alpha2_country_code_N
     '''
+    if snapshot:
+        return _load_snapshot_cached(
+            filename, 'as-info', load_as_info,
+            _as_info_to_snapshot, _as_info_from_snapshot
+        )
+
     as_info = defaultdict(list)
 
-    with open(filename) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                arr = line.strip().split('|')
-                asn, countries = arr[0].strip(), arr[1].strip().split(',')
-                as_info[asn] = countries
+    for asns, countries in bulkparse.iter_columns(filename, 2):
+        as_info.update(zip(
+            map(str.strip, asns),
+            map(str.split, map(str.strip, countries), repeat(','))
+        ))
     return as_info
 
 def load_AS_list(as_list_file):
@@ -351,29 +344,119 @@ def load_AS_list(as_list_file):
         Returns: list of ASes from the file
     '''
     as_list = list()
-    with open(as_list_file) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                asn = line.strip()
-                as_list.append(asn)
+    for text in bulkparse.read_chunks(as_list_file):
+        as_list.extend(bulkparse.data_lines(text))
     return as_list
 
 def load_global_reach_info(file_name):
     '''
         Returns: heg_group, heg_countries, total_path_cnt, int_free_path_cnt
     # '''
-    line_num = 1
-    with open(file_name) as f:
-        for line in f:
-            if not line.strip().startswith("#"):
-                arr = line.strip().split('|')
-
-                if line_num == 1:
-                    heg_group = arr[0]
-                    heg_countries = list(arr[1].strip().split(','))
-                elif line_num == 2:
-                    total_path_cnt = int(arr[1].strip())
-                    int_free_path_cnt = int(arr[2].strip())
-                line_num += 1
+    lines = list(chain.from_iterable(bulkparse.read_sections(file_name)))
+
+    arr = lines[0].split('|')
+    heg_group = arr[0]
+    heg_countries = list(arr[1].strip().split(','))
+
+    arr = lines[1].split('|')
+    total_path_cnt = int(arr[1].strip())
+    int_free_path_cnt = int(arr[2].strip())
                 
     return heg_group, heg_countries, total_path_cnt, int_free_path_cnt
+
+################################################################################
+# Snapshot cache
+################################################################################
+
+def file_digest(file_name):
+    h = sha256()
+    with open(bulkparse.input_path(file_name), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def snapshot_path(source_file, kind):
+    file_name = f'{os.path.basename(source_file)}.{kind}.snap'
+    return os.path.join(SNAPSHOT_DIR, file_name)
+
+def open_snapshot(path, digest):
+    '''
+        Returns the snapshot at the path, or None if it is missing, unreadable
+        or built from another version of the source file(s).
+    '''
+    if not os.path.isfile(path): return None
+    try:
+        snap = Snapshot(path)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Ignoring snapshot {path}: {e}')
+        return None
+    if snap.meta.get('version') != SNAPSHOT_VERSION: return None
+    if snap.meta.get('digest') != digest: return None
+    return snap
+
+def save_snapshot(path, digest, arrays=None, strings=None, meta=None):
+    meta = dict(meta or dict())
+    meta.update({'version': SNAPSHOT_VERSION, 'digest': digest})
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        write_snapshot(path, meta, arrays=arrays, strings=strings)
+    except OSError as e:
+        logging.warning(f'Could not save snapshot {path}: {e}')
+
+def _load_snapshot_cached(source_file, kind, loader, encode, decode):
+    if not SNAPSHOT_DIR:
+        return loader(source_file, snapshot=False)
+
+    path = snapshot_path(source_file, kind)
+    digest = file_digest(source_file)
+    snap = open_snapshot(path, digest)
+    if snap is not None:
+        return decode(snap)
+
+    data = loader(source_file, snapshot=False)
+    arrays, strings, meta = encode(data)
+    save_snapshot(path, digest, arrays=arrays, strings=strings, meta=meta)
+    return data
+
+def _graph_to_snapshot(graph):
+    arrays = dict()
+    for rel in graph.rels:
+        arrays[f'{rel}.off'] = array('i', graph.offsets[rel])
+        arrays[f'{rel}.nbr'] = array('i', graph.nbrs[rel])
+    return arrays, {'asns': graph.asns}, {'rels': list(graph.rels)}
+
+def _graph_from_snapshot(snap):
+    rels = tuple(snap.meta['rels'])
+    offsets = {rel: snap.array(f'{rel}.off') for rel in rels}
+    nbrs = {rel: snap.array(f'{rel}.nbr') for rel in rels}
+    return ASGraph(snap.strings('asns'), offsets, nbrs, rels)
+
+def _cones_to_snapshot(customer_cone):
+    arrays = {'cones': array('i', customer_cone.values())}
+    return arrays, {'asns': list(customer_cone.keys())}, dict()
+
+def _cones_from_snapshot(snap):
+    return defaultdict(int, zip(snap.strings('asns'), snap.array('cones')))
+
+def _as_info_to_snapshot(as_info):
+    # Country lists in the CSR format, over a table of distinct countries
+    country2id = dict()
+    off, ids = array('i', [0]), array('i')
+    for countries in as_info.values():
+        for c in countries:
+            ids.append(country2id.setdefault(c, len(country2id)))
+        off.append(len(ids))
+
+    arrays = {'countries.off': off, 'countries.ids': ids}
+    strings = {'asns': list(as_info.keys()), 'countries': list(country2id)}
+    return arrays, strings, dict()
+
+def _as_info_from_snapshot(snap):
+    country_table = snap.strings('countries')
+    off = snap.array('countries.off').tolist()
+    ids = [country_table[c] for c in snap.array('countries.ids')]
+
+    as_info = defaultdict(list)
+    for idx, asn in enumerate(snap.strings('asns')):
+        as_info[asn] = ids[off[idx]:off[idx + 1]]
+    return as_info
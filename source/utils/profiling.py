@@ -0,0 +1,176 @@
+import atexit
+import cProfile
+import functools
+import logging
+import os
+import signal
+import tracemalloc
+from collections import Counter
+
+from source.utils.utils import TODAY
+
+# Opt-in profiling of the entry points (--profile, or CENS_PROFILE, e.g.,
+#   CENS_PROFILE=cprofile,memory), written when the process exits:
+#       cprofile: {profile_dir}/{name}.{TODAY}.pstats
+#       sample:   {profile_dir}/{name}.{TODAY}.collapsed.txt (stack samples,
+#                   in the collapsed format of flamegraph.pl / speedscope)
+#       memory:   {profile_dir}/{name}.{TODAY}.tracemalloc.txt (top
+#                   allocators, overall and of the @stage functions)
+#   Only the main process is profiled (not the workers of a pool).
+
+PROFILE_MODES = ['cprofile', 'sample', 'memory']
+PROFILE_DIR = os.environ.get('CENS_PROFILE_DIR', 'logs/profiles')
+
+SAMPLE_INTERVAL = 0.005
+TRACE_FRAMES = 16
+TOP_ALLOCATORS = 15
+
+_profiler = None
+_samples = None
+_stages = None
+_active_stages = set()
+
+def add_profile_args(parser):
+    env_modes = [
+        mode for mode in os.environ.get('CENS_PROFILE', '').split(',') if mode
+    ]
+    for mode in env_modes:
+        if mode not in PROFILE_MODES:
+            parser.error(f'CENS_PROFILE: unknown mode {mode}')
+    parser.add_argument(
+        '--profile', nargs='+', default=env_modes, choices=PROFILE_MODES,
+        help='Profile the run (default: the modes in CENS_PROFILE).'
+    )
+    parser.add_argument('--profile_dir', default=PROFILE_DIR)
+
+def enable_profiling(name, args):
+    '''
+        Starts the profilers of the modes in args.profile (see
+        add_profile_args); the results are saved at exit.
+    '''
+    global _profiler, _samples, _stages
+    modes = args.profile
+    if not modes: return
+    os.makedirs(args.profile_dir, exist_ok=True)
+    file_root = f'{args.profile_dir}/{name}.{TODAY}'
+
+    if 'memory' in modes:
+        tracemalloc.start(TRACE_FRAMES)
+        _stages = dict()
+    if 'sample' in modes:
+        _samples = Counter()
+        signal.signal(signal.SIGPROF, _sample)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLE_INTERVAL, SAMPLE_INTERVAL)
+    if 'cprofile' in modes:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+    os.register_at_fork(after_in_child=_stop_profiling)
+    atexit.register(_save_profiles, file_root)
+
+def _stop_profiling():
+    global _profiler, _samples, _stages
+    if _profiler is not None: _profiler.disable()
+    if _samples is not None:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+    if _stages is not None: tracemalloc.stop()
+    _profiler, _samples, _stages = None, None, None
+
+def _save_profiles(file_root):
+    profiler, samples, stages = _profiler, _samples, _stages
+    if profiler is not None: profiler.disable()
+    if samples is not None: signal.setitimer(signal.ITIMER_PROF, 0)
+
+    if profiler is not None:
+        profiler.dump_stats(f'{file_root}.pstats')
+        logging.info(f'Profile saved: {file_root}.pstats')
+    if samples is not None:
+        with open(f'{file_root}.collapsed.txt', 'w') as f:
+            for stack, cnt in samples.most_common():
+                f.write(f'{stack} {cnt}\n')
+        logging.info(f'Stack samples saved: {file_root}.collapsed.txt')
+    if stages is not None:
+        _save_allocators(f'{file_root}.tracemalloc.txt', stages)
+        logging.info(f'Allocators saved: {file_root}.tracemalloc.txt')
+    _stop_profiling()
+
+# ==============================================================================
+# ===============================  SAMPLER  ====================================
+# ==============================================================================
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+def _sample(signum, frame):
+    stack = list()
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    _samples[';'.join(reversed(stack))] += 1
+
+# ==============================================================================
+# ===============================  MEMORY  =====================================
+# ==============================================================================
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+    ])
+
+def stage(func):
+    '''
+        Decorator of a profiled stage: with the memory profiling, records the
+        number of calls, the largest net allocation of a call, and the top
+        allocators of the first call. Nested calls of an active stage (e.g.,
+        a loader calling itself) are part of the outer call.
+    '''
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _stages is None or name in _active_stages:
+            return func(*args, **kwargs)
+
+        stats = _stages.setdefault(
+            name, {'calls': 0, 'max_net_mb': 0.0, 'top': None}
+        )
+        stats['calls'] += 1
+        before = _snapshot() if stats['top'] is None else None
+        current = tracemalloc.get_traced_memory()[0]
+
+        _active_stages.add(name)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            _active_stages.discard(name)
+
+        net_mb = (tracemalloc.get_traced_memory()[0] - current) / 2**20
+        stats['max_net_mb'] = max(stats['max_net_mb'], net_mb)
+        if before is not None:
+            stats['top'] = _snapshot().compare_to(before, 'lineno')[
+                :TOP_ALLOCATORS
+            ]
+        return result
+
+    return wrapper
+
+def _save_allocators(file_name, stages):
+    current, peak = tracemalloc.get_traced_memory()
+    top = _snapshot().statistics('lineno')[:TOP_ALLOCATORS]
+
+    with open(file_name, 'w') as f:
+        f.write(
+            f'# Traced memory at exit: {current / 2**20:.1f} MB, peak: '
+            f'{peak / 2**20:.1f} MB\n'
+        )
+        f.write('# Top allocators at exit\n')
+        f.writelines(f'{stat}\n' for stat in top)
+        for name, stats in stages.items():
+            f.write(
+                f'\n# Stage {name}: {stats["calls"]} calls, max net '
+                f'allocation of a call: {stats["max_net_mb"]:.2f} MB\n'
+            )
+            f.write('# Top allocators of the first call\n')
+            f.writelines(f'{stat}\n' for stat in stats['top'] or [])
@@ -0,0 +1,282 @@
+import argparse
+import logging
+import mmap
+import os
+import struct
+import time
+
+from array import array
+from collections import defaultdict
+
+from source.utils import profiling
+from source.utils import telemetry
+from source.utils import utils
+from source.utils.load import load_AS_topology, load_routing_topo
+
+# Route store: routing trees of all destinations in a single file.
+#
+# Format:
+#   MAGIC|<header>|<ASN table>|<tree_1>|...|<tree_D>|<index>
+#   header = <asn_num:uint32><reserved:uint32><asn_table_len:uint64>
+#            <dest_num:uint64><index_offset:uint64>
+#   ASN table = ASNs joined with new lines; the i-th ASN has the id i
+#   tree_k = int32 next hop id of every AS (-1: no route / the destination)
+#   index = int32 destination id of every tree, in the order of the trees
+#
+# The trees have a fixed size, hence the k-th tree starts at:
+#   data_offset + k * asn_num * 4
+
+MAGIC = b'CENSRTS1'
+HEADER = struct.Struct('<IIQQQ')
+DATA_ALIGN = 64
+NO_ROUTE = -1
+
+def _data_offset(asn_table_len):
+    pos = len(MAGIC) + HEADER.size + asn_table_len
+    return (pos + DATA_ALIGN - 1) // DATA_ALIGN * DATA_ALIGN
+
+class RouteStore:
+    '''
+        Read-only access to a route store; the file is mmap-ed once, and the
+        routing tree of any destination is then accessed in O(1).
+    '''
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        with open(store_file, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a route store: {store_file}')
+
+        asn_num, _, asn_table_len, dest_num, index_offset = HEADER.unpack_from(
+            self._mm, len(MAGIC)
+        )
+        if index_offset == 0:
+            raise ValueError(f'Route store was not closed: {store_file}')
+
+        pos = len(MAGIC) + HEADER.size
+        asn_table = self._mm[pos:pos + asn_table_len].decode('utf-8')
+        self.asns = asn_table.split('\n') if asn_num else list()
+        self.asn2id = {asn: idx for idx, asn in enumerate(self.asns)}
+
+        self._view = memoryview(self._mm)
+        self._data_offset = _data_offset(asn_table_len)
+        self._tree_size = 4 * asn_num
+
+        index = self._view[index_offset:index_offset + 4 * dest_num].cast('i')
+        self._slot = array('i', [-1]) * asn_num
+        for slot, dest_id in enumerate(index):
+            self._slot[dest_id] = slot
+
+    def __len__(self):
+        return sum(1 for slot in self._slot if slot >= 0)
+
+    def __contains__(self, destination):
+        dest_id = self.asn2id.get(destination)
+        return dest_id is not None and self._slot[dest_id] >= 0
+
+    def destinations(self):
+        return [
+            self.asns[dest_id] for dest_id, slot in enumerate(self._slot)
+            if slot >= 0
+        ]
+
+    def next_hops_by_id(self, dest_id):
+        '''
+            Returns the routing tree as an int32 memoryview:
+                next_hops[asn_id] = <next_hop_asn_id> (-1: no route)
+            or None if the destination is not in the store.
+        '''
+        slot = self._slot[dest_id]
+        if slot < 0: return None
+        start = self._data_offset + slot * self._tree_size
+        return self._view[start:start + self._tree_size].cast('i')
+
+    def next_hops(self, destination):
+        dest_id = self.asn2id.get(destination)
+        if dest_id is None: return None
+        return self.next_hops_by_id(dest_id)
+
+    def routing_topo(self, destination):
+        '''
+            Same content as load_routing_topo:
+                routing_topo[asn] = <next_hop_asn>
+            or None if the destination is not in the store.
+        '''
+        next_hops = self.next_hops(destination)
+        if next_hops is None: return None
+
+        asns = self.asns
+        routing_topo = defaultdict(str)
+        for asn, next_hop in zip(asns, next_hops):
+            if next_hop != NO_ROUTE:
+                routing_topo[asn] = asns[next_hop]
+        return routing_topo
+
+class RouteStoreWriter:
+    '''
+        Appends routing trees (as int32 next hop ids) to a new route store.
+        The store is readable only after close(); if the writing fails (an
+        exception in the with block), it is left unreadable (not closed).
+
+        With resume_dests (the destinations whose trees are known to be
+        written first, in order) an unfinished store is continued: the trees
+        after them are dropped, and new ones are appended.
+    '''
+
+    def __init__(self, store_file, asns, resume_dests=None):
+        self.store_file = store_file
+        self.asns = list(asns)
+        self.asn2id = {asn: idx for idx, asn in enumerate(self.asns)}
+        self.dest_ids = array('i')
+
+        self._asn_table = '\n'.join(self.asns).encode('utf-8')
+        self._tree_size = 4 * len(self.asns)
+        data_offset = _data_offset(len(self._asn_table))
+
+        self.resumed = bool(resume_dests) and self._can_resume(
+            store_file, len(resume_dests)
+        )
+        if self.resumed:
+            self.dest_ids.extend(self.asn2id[d] for d in resume_dests)
+            self._f = open(store_file, 'r+b')
+            self._write_header(index_offset=0)
+            self._f.seek(data_offset + len(self.dest_ids) * self._tree_size)
+            self._f.truncate()
+            return
+
+        self._f = open(store_file, 'wb')
+        self._write_header(index_offset=0)
+        self._f.write(self._asn_table)
+        self._f.seek(data_offset)
+
+    def _can_resume(self, store_file, tree_num):
+        if not os.path.isfile(store_file): return False
+        data_end = _data_offset(len(self._asn_table)) + tree_num * self._tree_size
+        if os.path.getsize(store_file) < data_end: return False
+        with open(store_file, 'rb') as f:
+            head = f.read(len(MAGIC) + HEADER.size + len(self._asn_table))
+        if head[:len(MAGIC)] != MAGIC: return False
+        asn_num, _, asn_table_len, _, _ = HEADER.unpack_from(head, len(MAGIC))
+        return (
+            asn_num == len(self.asns) and
+            asn_table_len == len(self._asn_table) and
+            head[len(MAGIC) + HEADER.size:] == self._asn_table
+        )
+
+    def _write_header(self, index_offset):
+        self._f.seek(0)
+        self._f.write(MAGIC)
+        self._f.write(HEADER.pack(
+            len(self.asns), 0, len(self._asn_table), len(self.dest_ids),
+            index_offset
+        ))
+
+    def add_by_id(self, dest_id, next_hops):
+        data = next_hops if isinstance(next_hops, bytes) else bytes(next_hops)
+        if len(data) != self._tree_size:
+            raise ValueError(
+                f'Routing tree of {self.asns[dest_id]} has {len(data)} bytes, '
+                f'expected {self._tree_size}.'
+            )
+        self._f.write(data)
+        self.dest_ids.append(dest_id)
+
+    def add(self, destination, routing_topo):
+        '''
+            Adds a routing tree given as a dict:
+                routing_topo[asn] = <next_hop_asn>
+        '''
+        self.add_by_id(
+            self.asn2id[destination], routing_topo_to_next_hops(
+                routing_topo, self.asn2id
+            )
+        )
+
+    def flush(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.seek(_data_offset(len(self._asn_table)) + (
+            len(self.dest_ids) * self._tree_size
+        ))
+        index_offset = self._f.tell()
+        self._f.write(self.dest_ids.tobytes())
+        self._f.truncate()
+        self._write_header(index_offset)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def abort(self):
+        '''
+            Closes the file without the index: the store stays unreadable
+            (but can be resumed, see resume_dests).
+        '''
+        self._f.close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+            logging.warning(f'Route store not closed: {self.store_file}')
+            return
+        self.close()
+
+def routing_topo_to_next_hops(routing_topo, asn2id):
+    next_hops = array('i', [NO_ROUTE]) * len(asn2id)
+    for asn, next_hop in routing_topo.items():
+        if next_hop is None: continue
+        next_hops[asn2id[asn]] = asn2id[next_hop]
+    return next_hops
+
+################################################################################
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--bgp_topo_file', default='data/caida/20230101.as-rel2.txt'
+    )
+    parser.add_argument(
+        '--routing_file_root',
+        default='generated_data/bgp_routes/20230101.as-rel2'
+    )
+    parser.add_argument(
+        '--save_file', default='generated_data/bgp_routes/20230101.as-rel2.routes'
+    )
+    profiling.add_profile_args(parser)
+    return parser.parse_args()
+
+def convert_text_routes(as_topo, routing_file_root, save_file):
+    '''
+        Converts the per-destination routing files (*.D_{dest}.txt, written by
+        quicksand) into a single route store.
+    '''
+    utils.check_make_save_file_dir(save_file)
+    with RouteStoreWriter(save_file, as_topo.keys()) as writer:
+        for dest in telemetry.track('destinations', as_topo.keys()):
+            destination_routing_file = f'{routing_file_root}.D_{dest}.txt'
+            if not os.path.isfile(destination_routing_file):
+                logging.warning(f'File not found: {destination_routing_file}')
+                continue
+            d, routing_topo = load_routing_topo(destination_routing_file)
+            if d != dest:
+                logging.warning(
+                    f'File {destination_routing_file} contains routing info '
+                    f'for destination {d} instead of {dest}.'
+                )
+                continue
+            writer.add(dest, routing_topo)
+
+if __name__ == '__main__':
+    args = _parse_args()
+    profiling.enable_profiling('routestore', args)
+    utils.enable_logger('routestore', log_dir='logs/routestore')
+    telemetry.enable_telemetry('routestore', log_dir='logs/routestore')
+
+    start = time.time()
+    as_topo = load_AS_topology(args.bgp_topo_file)
+    convert_text_routes(as_topo, args.routing_file_root, args.save_file)
+    telemetry.write_summary(args.save_file)
+    end = time.time()
+    utils.log_elapsed_time(end-start)
@@ -0,0 +1,151 @@
+import logging
+import os
+import sys
+
+from collections import OrderedDict
+
+from source.utils import load
+from source.utils.routestore import RouteStore
+
+# Budget of the routing tree cache (in MB), shared by all cached trees
+CACHE_MB = int(os.environ.get('CENS_TREE_CACHE_MB', '1024'))
+# Share of the budget that pinned trees may take (the rest is for the LRU)
+PIN_SHARE = 0.5
+
+class RoutingTrees:
+    '''
+        Routing trees of destinations, read from a route store (if given) or
+        from the per-destination routing files (written by quicksand):
+            routing_trees.get(destination)[asn] = <next_hop_asn>
+
+        Trees are kept in an LRU cache bounded by their (estimated) size in
+        bytes. Pinned trees (e.g., of VPN nodes) are never evicted, but count
+        towards the budget; trees beyond PIN_SHARE of the budget are not pinned.
+    '''
+
+    def __init__(self, routing_file_root, route_store_file=None,
+                 max_bytes=CACHE_MB * 2**20):
+        self.routing_file_root = routing_file_root
+        self.route_store = None
+        if route_store_file is not None:
+            self.route_store = RouteStore(route_store_file)
+        self.max_bytes = max_bytes
+
+        self._lru = OrderedDict()
+        self._pinned = dict()
+        self._sizes = dict()
+        self.cached_bytes = 0
+        self.pinned_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self, destination):
+        if self.route_store is not None:
+            routing_topo = self.route_store.routing_topo(destination)
+            if routing_topo is None:
+                logging.warning(f'Not in the route store: {destination}')
+            return routing_topo
+
+        # Does this file exist, and contain right information?
+        destination_routing_file = (
+            f'{self.routing_file_root}.D_{destination}.txt'
+        )
+        if not os.path.isfile(destination_routing_file):
+            logging.warning(f'File not found: {destination_routing_file}')
+            return None
+        d, routing_topo = load.load_routing_topo(destination_routing_file)
+        if d != destination:
+            logging.warning(
+                f'File {destination_routing_file} contains routing info for '
+                f'destination {d}, although it should contain routing info '
+                f'for destination {destination}.'
+            )
+            return None
+        return routing_topo
+
+    def _size_of(self, routing_topo):
+        size = sys.getsizeof(routing_topo)
+        # ASNs of the route store are shared by all trees; those of a routing
+        #   file (ASNs and next hops) are strings of this tree
+        if self.route_store is None:
+            size += sum(map(sys.getsizeof, routing_topo.keys()))
+            size += sum(map(sys.getsizeof, routing_topo.values()))
+        return size
+
+    def _evict(self):
+        while self.cached_bytes > self.max_bytes and self._lru:
+            destination, _ = self._lru.popitem(last=False)
+            self.cached_bytes -= self._sizes.pop(destination)
+            self.evictions += 1
+
+    def get(self, destination):
+        '''
+            Returns the routing tree of the destination (not to be modified), or
+            None if it is not available.
+        '''
+        if destination in self._pinned:
+            self.hits += 1
+            return self._pinned[destination]
+        if destination in self._lru:
+            self.hits += 1
+            self._lru.move_to_end(destination)
+            return self._lru[destination]
+
+        self.misses += 1
+        routing_topo = self._load(destination)
+        if routing_topo is None: return None
+
+        self._sizes[destination] = self._size_of(routing_topo)
+        self.cached_bytes += self._sizes[destination]
+        self._lru[destination] = routing_topo
+        self._evict()
+        return routing_topo
+
+    def pin(self, destinations):
+        '''
+            Keeps the routing trees of the destinations in the cache, until
+            unpinned.
+        '''
+        refused = 0
+        for destination in destinations:
+            if destination in self._pinned: continue
+            if destination in self._lru:
+                routing_topo = self._lru.pop(destination)
+            else:
+                routing_topo = self._load(destination)
+                if routing_topo is None: continue
+                self._sizes[destination] = self._size_of(routing_topo)
+                self.cached_bytes += self._sizes[destination]
+
+            # Pins over their share would leave no room for the LRU trees
+            size = self._sizes[destination]
+            if self.pinned_bytes + size > PIN_SHARE * self.max_bytes:
+                self._lru[destination] = routing_topo
+                refused += 1
+            else:
+                self._pinned[destination] = routing_topo
+                self.pinned_bytes += size
+            self._evict()
+
+        if refused:
+            logging.warning(
+                f'Routing trees: {refused} trees not pinned, over '
+                f'{PIN_SHARE:.0%} of the budget of '
+                f'{self.max_bytes / 2**20:.0f} MB (CENS_TREE_CACHE_MB)'
+            )
+
+    def unpin(self, destinations):
+        for destination in destinations:
+            if destination not in self._pinned: continue
+            self._lru[destination] = self._pinned.pop(destination)
+            self.pinned_bytes -= self._sizes[destination]
+        self._evict()
+
+    def log_stats(self):
+        logging.info(
+            f'Routing trees: {self.hits} hits, {self.misses} misses, '
+            f'{self.evictions} evictions; {len(self._pinned)} pinned, '
+            f'{len(self._lru)} cached, {self.cached_bytes / 2**20:.1f} MB'
+        )
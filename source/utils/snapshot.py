@@ -0,0 +1,104 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+# Binary snapshot container: a small JSON header followed by raw sections.
+#
+# Format:
+#   MAGIC|<header_len:uint32>|<header:json>|<sections, 8-byte aligned>
+#   header = {
+#       'byteorder': <sys.byteorder>,
+#       'meta': {...},
+#       'sections': {name: [kind, typecode, offset, size]}
+#   }
+#
+# Array sections are read back as memoryviews over the mmap-ed file, so opening
+# a snapshot costs (almost) nothing regardless of its size.
+
+MAGIC = b'CENSSNP1'
+ALIGN = 8
+
+class Snapshot:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a snapshot file: {path}')
+        pos = len(MAGIC)
+        header_len, = struct.unpack_from('<I', self._mm, pos)
+        pos += 4
+        header = json.loads(self._mm[pos:pos + header_len].decode('utf-8'))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f'Snapshot {path} has a different byte order')
+
+        self.meta = header['meta']
+        self._sections = header['sections']
+        self._view = memoryview(self._mm)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def array(self, name):
+        _, typecode, offset, size = self._sections[name]
+        return self._view[offset:offset + size].cast(typecode)
+
+    def blob(self, name):
+        _, _, offset, size = self._sections[name]
+        return bytes(self._view[offset:offset + size])
+
+    def strings(self, name):
+        blob = self.blob(name)
+        if not blob: return list()
+        return blob.decode('utf-8').split('\n')
+
+def write_snapshot(path, meta, arrays=None, blobs=None, strings=None):
+    '''
+        Writes the snapshot atomically (a reader never sees a partial file).
+            arrays: {name: array.array}
+            blobs: {name: bytes}
+            strings: {name: list of str (without new lines)}
+    '''
+    sections = list()
+    for name, arr in (arrays or dict()).items():
+        sections.append((name, 'array', arr.typecode, arr.tobytes()))
+    for name, blob in (blobs or dict()).items():
+        sections.append((name, 'blob', 'B', bytes(blob)))
+    for name, strs in (strings or dict()).items():
+        blob = '\n'.join(strs).encode('utf-8')
+        sections.append((name, 'blob', 'B', blob))
+
+    # Offsets depend on the header length, and vice versa: reserve the space.
+    def _header(base):
+        offsets, pos = dict(), base
+        for name, kind, typecode, data in sections:
+            pos = _align(pos)
+            offsets[name] = [kind, typecode, pos, len(data)]
+            pos += len(data)
+        return json.dumps({
+            'byteorder': sys.byteorder, 'meta': meta, 'sections': offsets
+        }).encode('utf-8')
+
+    base = 0
+    while True:
+        header = _header(base)
+        new_base = _align(len(MAGIC) + 4 + len(header))
+        if new_base <= base: break
+        base = new_base
+    header = header.ljust(base - len(MAGIC) - 4)
+
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for _, _, _, data in sections:
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+
+def _align(pos):
+    return (pos + ALIGN - 1) // ALIGN * ALIGN
@@ -0,0 +1,208 @@
+import json
+import logging
+import math
+import os
+import resource
+import time
+from array import array
+from collections import deque
+
+from source.utils.utils import LOG_DIR, TODAY
+
+# Progress of the main loops (stages): every `every` items (or `interval`
+#   seconds) a record is logged, and appended to the JSON-lines telemetry file
+#   (if enabled):
+#       {"stage", "done", "total", "elapsed_s", "items_per_s", "eta_s",
+#        "latency_ms": {"p50", "p90", "p99"}, "rss_mb", "counters"}
+#   Rates, the ETA and the percentiles are over the last `window` items.
+
+_stages = list()
+_telemetry_file = None
+_start = time.perf_counter()
+
+PERCENTILES = [50, 90, 99]
+
+def enable_telemetry(log_sub_file_name, log_dir=LOG_DIR):
+    '''
+        Records are appended to:
+            {log_dir}/{log_sub_file_name}.{TODAY}.telemetry.jsonl
+    '''
+    global _telemetry_file
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    _telemetry_file = f'{log_dir}/{log_sub_file_name}.{TODAY}.telemetry.jsonl'
+
+def rss_mb():
+    '''
+        Current resident set size of the process (peak, if not on Linux).
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def _percentiles(values):
+    if not values: return dict()
+    values = sorted(values)
+    # Nearest-rank percentiles
+    return {
+        f'p{p}': round(
+            1000 * values[max(math.ceil(p / 100 * len(values)) - 1, 0)], 3
+        )
+        for p in PERCENTILES
+    }
+
+def _emit(record):
+    if _telemetry_file is not None:
+        with open(_telemetry_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+class Stage:
+    '''
+        Timer (and counters) of a named stage, e.g., of a main loop:
+
+            stage = Stage('destinations', total=len(dests))
+            for dest in dests:
+                ...
+                stage.tick()
+            stage.finish()
+
+        or, equivalently: for dest in track('destinations', dests): ...
+    '''
+
+    def __init__(self, name, total=None, every=1000, interval=60, window=1000):
+        self.name = name
+        self.total = total
+        self.every = every
+        self.interval = interval
+
+        self.done = self.reported = 0
+        self.counters = dict()
+        self.latencies = array('d')
+        self.recent = deque(maxlen=window)
+        self.finished = False
+
+        self.start = self.last = self.last_record = time.perf_counter()
+        _stages.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+    def tick(self, n=1):
+        '''
+            n more items are done (since the last tick).
+        '''
+        now = time.perf_counter()
+        latency = (now - self.last) / n
+        self.last = now
+        for _ in range(n):
+            self.latencies.append(latency)
+            self.recent.append(latency)
+
+        done_before = self.done
+        self.done += n
+        if self.done // self.every != done_before // self.every or \
+            now - self.last_record >= self.interval:
+            self.report()
+
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    def record(self):
+        elapsed = time.perf_counter() - self.start
+        window_time = sum(self.recent)
+        items_per_s = len(self.recent) / window_time if window_time else None
+
+        record = {
+            'stage': self.name, 'done': self.done, 'total': self.total,
+            'elapsed_s': round(elapsed, 3),
+            'items_per_s': items_per_s and round(items_per_s, 3),
+            'eta_s': None,
+            'latency_ms': _percentiles(self.recent),
+            'rss_mb': round(rss_mb(), 1),
+        }
+        if self.total is not None and items_per_s:
+            record['eta_s'] = round(
+                max(self.total - self.done, 0) / items_per_s, 1
+            )
+        if self.counters: record['counters'] = dict(self.counters)
+        return record
+
+    def report(self):
+        self.last_record = time.perf_counter()
+        self.reported = self.done
+        record = self.record()
+        _emit(record)
+
+        total = '?' if self.total is None else self.total
+        eta = ''
+        if record['eta_s'] is not None:
+            hours, rem = divmod(int(record['eta_s']), 3600)
+            eta = ', ETA {:0>2}:{:0>2}:{:0>2}'.format(hours, *divmod(rem, 60))
+        rate = record['items_per_s'] or 0
+        logging.info(
+            f'Processing: {self.done} / {total} ({self.name}), '
+            f'{rate:.1f} items/s{eta}, RSS {record["rss_mb"]:.0f} MB'
+        )
+
+    def finish(self):
+        if self.finished: return
+        self.finished = True
+        self.end = time.perf_counter()
+        if self.reported != self.done or not self.done: self.report()
+
+    def summary(self):
+        elapsed = getattr(self, 'end', time.perf_counter()) - self.start
+        summary = {
+            'stage': self.name, 'done': self.done, 'total': self.total,
+            'elapsed_s': round(elapsed, 3),
+            'items_per_s': round(self.done / elapsed, 3) if elapsed else None,
+            'latency_ms': _percentiles(self.latencies),
+        }
+        if self.latencies:
+            summary['latency_ms']['mean'] = round(
+                1000 * sum(self.latencies) / len(self.latencies), 3
+            )
+        if self.counters: summary['counters'] = dict(self.counters)
+        return summary
+
+def track(name, items, total=None, every=1000, interval=60):
+    '''
+        Yields the items; an item is done when the next one is requested.
+    '''
+    if total is None and hasattr(items, '__len__'): total = len(items)
+    stage = Stage(name, total=total, every=every, interval=interval)
+    try:
+        for item in items:
+            yield item
+            stage.tick()
+    finally:
+        stage.finish()
+
+def write_summary(save_file_root):
+    '''
+        Summary of all stages (of this process), saved next to the results:
+            {save_file_root}.telemetry.json
+    '''
+    summary = {
+        'date': TODAY,
+        'elapsed_s': round(time.perf_counter() - _start, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': [stage.summary() for stage in _stages],
+    }
+    children_rss = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    if children_rss: summary['peak_rss_children_mb'] = round(children_rss, 1)
+
+    file_name = f'{save_file_root}.telemetry.json'
+    with open(file_name, 'w') as f:
+        json.dump(summary, f, indent=4)
+    return file_name
@@ -0,0 +1,51 @@
+class UnionFind:
+    '''
+        Disjoint sets of (hashable) items, with union by size and path
+        halving; all operations are (almost) O(1).
+    '''
+
+    def __init__(self, items=()):
+        self.parent = dict()
+        self.sizes = dict()
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return item in self.parent
+
+    def __len__(self):
+        return len(self.parent)
+
+    def __iter__(self):
+        return iter(self.parent)
+
+    def add(self, item):
+        if item in self.parent: return
+        self.parent[item] = item
+        self.sizes[item] = 1
+
+    def find(self, item):
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, item1, item2):
+        '''
+            Merges the sets of both items. Returns the root of the merged set.
+        '''
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 == root2: return root1
+
+        if self.sizes[root1] < self.sizes[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.sizes[root1] += self.sizes.pop(root2)
+        return root1
+
+    def connected(self, item1, item2):
+        return self.find(item1) == self.find(item2)
+
+    def size(self, item):
+        return self.sizes[self.find(item)]
@@ -43,20 +43,6 @@ def log_elapsed_time(elapsed):
     s = '{:0>2}:{:0>2}:{:05.2f}'.format(int(hours), int(minutes), seconds)
     logging.info(f'Time elapsed: {s}\n')
 
-def rst_log_counter(counter_max_value):
-    global lcounter, lcounter_max
-    lcounter = 0
-    lcounter_max = counter_max_value
-
-def log_counter(modulo=1000, info=None):
-    global lcounter
-    if lcounter % modulo == 0:
-        str_info = ''
-        if info is not None:
-            str_info = f' ({info})'
-        logging.info(f'Processing: {lcounter + 1} / {lcounter_max}{str_info}')
-    lcounter += 1
-
 def sort_dict(d, reverse=True):
     return {
         k: v
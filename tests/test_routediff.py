@@ -0,0 +1,90 @@
+import random
+
+from array import array
+
+from source.benchmark.topogen import generate_topology, save_topology
+from source.simulation.bgp.bgpsim import (
+    BGPSimulator, tiebreak_key, tiebreak_ranks
+)
+from source.simulation.bgp.routediff import recompute_routes
+from source.utils.load import load_AS_topology
+from source.utils.routestore import RouteStore, RouteStoreWriter
+
+AS_NUM = 1000
+
+def _load_topology(tmp_path, name, links, as_countries):
+    topo_file = f'{tmp_path}/{name}.as-rel2.txt'
+    save_topology(links, as_countries, topo_file, f'{tmp_path}/as-info.txt')
+    return load_AS_topology(topo_file, snapshot=False)
+
+def _simulate_all(as_topo, save_file):
+    sim = BGPSimulator(as_topo)
+    with RouteStoreWriter(save_file, as_topo.asns) as writer:
+        for dest_id in range(len(as_topo)):
+            writer.add_by_id(dest_id, array('i', sim.simulate(dest_id)))
+    return RouteStore(save_file)
+
+def _recompute(tmp_path, links, new_links, as_countries):
+    old_topo = _load_topology(tmp_path, 'old', links, as_countries)
+    new_topo = _load_topology(tmp_path, 'new', new_links, as_countries)
+    old_store = _simulate_all(old_topo, f'{tmp_path}/old.routes')
+
+    recomputed = recompute_routes(
+        old_topo, new_topo, old_store, tiebreak_ranks(new_topo),
+        f'{tmp_path}/new.routes'
+    )
+    new_store = RouteStore(f'{tmp_path}/new.routes')
+    full_store = _simulate_all(new_topo, f'{tmp_path}/full.routes')
+    for dest in new_topo.asns:
+        assert new_store.routing_topo(dest) == full_store.routing_topo(dest)
+    return recomputed
+
+def _new_link(rnd, asns, links):
+    existing = {frozenset([asn1, asn2]) for asn1, asn2, _ in links}
+    while True:
+        asn1, asn2 = rnd.sample(asns, 2)
+        if frozenset([asn1, asn2]) not in existing: return asn1, asn2
+
+def test_single_link_recomputes_few_trees(tmp_path):
+    links, as_countries = generate_topology(AS_NUM, seed=3)
+    # A provider->customer link between two stub ASes
+    providers = {asn1 for asn1, _, rel in links if rel == -1}
+    stubs = [asn for asn in as_countries if asn not in providers]
+    provider, customer = _new_link(random.Random(3), stubs, links)
+
+    recomputed = _recompute(
+        tmp_path, links, links + [(provider, customer, -1)], as_countries
+    )
+    assert recomputed <= 0.05 * AS_NUM
+
+def test_changed_links_match_full_simulation(tmp_path):
+    links, as_countries = generate_topology(AS_NUM, seed=0)
+    rnd = random.Random(0)
+    new_links = list(links)
+    for _ in range(2):
+        del new_links[rnd.randrange(len(new_links))]
+    for rel in [-1, 0]:
+        asn1, asn2 = _new_link(rnd, list(as_countries), links)
+        new_links.insert(rnd.randrange(len(new_links)), (asn1, asn2, rel))
+
+    _recompute(tmp_path, links, new_links, as_countries)
+
+def test_tied_provider_offer_reorders_third_stage(tmp_path):
+    # x -> y is as long as p1 -> y, and loses the tie-break, but x is dequeued
+    #   before p1: y is queued earlier, and z takes y (instead of q) as its
+    #   first provider
+    asns = iter(str(asn) for asn in range(1, 1000))
+    D, A, r, p1, q, z = (next(asns) for _ in range(6))
+    x, y = next(asns), next(asns)
+    while tiebreak_key(y, x) < tiebreak_key(y, p1):
+        x = next(asns)
+    links = [
+        (A, D, -1), (x, A, -1), (D, r, 0), (A, p1, 0), (p1, y, -1),
+        (r, q, -1), (y, z, -1), (q, z, -1),
+    ]
+    as_countries = {asn: ['CH'] for asn in [D, A, r, p1, q, z, x, y]}
+
+    recomputed = _recompute(
+        tmp_path, links, links + [(x, y, -1)], as_countries
+    )
+    assert recomputed >= 1